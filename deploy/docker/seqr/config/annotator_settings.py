@@ -8,6 +8,8 @@ install_dir = os.environ.get("SEQR_DIR", '/seqr')
 vep_perl_path = '%(install_dir)s/variant_effect_predictor/variant_effect_predictor.pl' % locals()
 vep_cache_dir = '%(install_dir)s/vep_cache_dir' % locals()
 vep_batch_size = 50000
+# number of VEP batches annotated at once, each running VEP with --fork 4
+vep_processes = 2
 
 reference_populations = [
     {
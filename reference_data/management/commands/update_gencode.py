@@ -7,6 +7,7 @@ from tqdm import tqdm
 from django.core.management.base import BaseCommand, CommandError
 
 from reference_data.management.commands.utils.download_utils import download_file
+from reference_data.management.commands.utils.update_utils import update_gene_annotations_version
 from reference_data.models import GeneInfo, TranscriptInfo, GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
 
 logger = logging.getLogger(__name__)
@@ -180,6 +181,7 @@ def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None,
     TranscriptInfo.objects.bulk_create([
         TranscriptInfo(gene=gene_id_to_gene_info[record.pop('gene_id')], **record) for record in new_transcripts.values()
     ], batch_size=50000)
+    update_gene_annotations_version()
 
     logger.info("Done")
     logger.info("Stats: ")
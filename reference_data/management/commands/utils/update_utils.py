@@ -2,11 +2,13 @@ import logging
 import gc
 import os
 import gzip
+import redis
 from tqdm import tqdm
 from django.core.management.base import BaseCommand, CommandError
 from reference_data.management.commands.utils.download_utils import download_file
 from reference_data.management.commands.utils.gene_utils import get_genes_by_symbol_and_id
-from reference_data.models import GeneInfo
+from reference_data.models import GeneInfo, GENE_ANNOTATIONS_VERSION_CACHE_KEY
+from settings import REDIS_SERVICE_HOSTNAME
 
 logger = logging.getLogger(__name__)
 
@@ -122,3 +124,13 @@ def update_records(reference_data_handler, file_path=None):
         model_objects.count(), model_name, file_path, skip_counter))
     if skip_counter > 0:
         logger.info('Running ./manage.py update_gencode to update the gencode version might fix missing genes')
+
+    update_gene_annotations_version()
+
+
+def update_gene_annotations_version():
+    """Marks the gene tables as changed, so the seqr processes reload any gene data they hold in memory."""
+    try:
+        redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3).incr(GENE_ANNOTATIONS_VERSION_CACHE_KEY)
+    except Exception as e:
+        logger.warn('Unable to update "{}" in redis: {}'.format(GENE_ANNOTATIONS_VERSION_CACHE_KEY, e))
@@ -13,6 +13,9 @@ GENOME_VERSION_CHOICES = [
     (GENOME_VERSION_GRCh38, "GRCh38")
 ]
 
+# Incremented whenever the gene tables are reloaded, so processes holding gene data in memory know to reload it
+GENE_ANNOTATIONS_VERSION_CACHE_KEY = 'reference_data__gene_annotations_version'
+
 
 class HumanPhenotypeOntology(models.Model):
     """Human Phenotype Ontology table contains one record per phenotype term parsed from the hp.obo
@@ -0,0 +1,170 @@
+import logging
+import timeit
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+
+from reference_data.models import GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
+from seqr.utils.es_utils import _HitParser, QUERY_FIELD_NAMES, SORTED_TRANSCRIPTS_FIELD_KEY, GENOTYPES_FIELD_KEY, \
+    HAS_ALT_FIELD_KEYS, CORE_FIELDS_CONFIG, NESTED_FIELDS, POPULATIONS, POPULATION_RESPONSE_FIELD_CONFIGS, \
+    PREDICTION_FIELDS_CONFIG, GENOTYPE_FIELDS_CONFIG
+from seqr.utils.liftover_utils import get_liftover
+from seqr.views.utils.json_utils import _to_camel_case
+
+logger = logging.getLogger(__name__)
+
+
+class _Transcript(object):
+    def __init__(self, transcript):
+        self._transcript = transcript
+
+    def to_dict(self):
+        return dict(self._transcript)
+
+
+# A copy of the parsing in EsSearch._parse_hit before the field configs were compiled per index, as the baseline
+
+
+def _reference_get_source(raw_hit):
+    return {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
+
+
+def _reference_parse_genotype(genotype_hit):
+    return _reference_get_field_values(genotype_hit, GENOTYPE_FIELDS_CONFIG)
+
+
+def _reference_parse(hit, index_metadata):
+    genome_version = index_metadata.get('genomeVersion')
+    lifted_over_genome_version = None
+    lifted_over_chrom = None
+    lifted_over_pos = None
+    # The liftover was set up for every hit, but is only benchmarked separately by benchmark_liftover
+    liftover_grch38_to_grch37 = get_liftover(GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37) \
+        if genome_version == GENOME_VERSION_GRCh38 else None
+    if liftover_grch38_to_grch37:
+        grch37_coord = liftover_grch38_to_grch37.convert_coordinate(hit['contig'], hit['start'])
+        if grch37_coord:
+            lifted_over_genome_version = GENOME_VERSION_GRCh37
+            lifted_over_chrom, lifted_over_pos = grch37_coord
+
+    populations = {
+        population: _reference_get_field_values(
+            hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+            lookup_field_prefix=population,
+            existing_fields=index_metadata['fields'],
+            get_addl_fields=lambda field, field_config:
+            [pop_config.get(field)] + ['{}_{}'.format(population, custom_field) for custom_field in
+                                       field_config.get('fields', [])],
+        )
+        for population, pop_config in POPULATIONS.items()
+    }
+
+    sorted_transcripts = [
+        {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
+        for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
+    ]
+    transcripts = defaultdict(list)
+    for transcript in sorted_transcripts:
+        transcripts[transcript['geneId']].append(transcript)
+
+    result = _reference_get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
+    result.update({
+        field_name: _reference_get_field_values(hit, fields, lookup_field_prefix=field_name)
+        for field_name, fields in NESTED_FIELDS.items()
+    })
+    result.update({
+        'genomeVersion': genome_version,
+        'liftedOverGenomeVersion': lifted_over_genome_version,
+        'liftedOverChrom': lifted_over_chrom,
+        'liftedOverPos': lifted_over_pos,
+        'mainTranscript': sorted_transcripts[0] if len(sorted_transcripts) else {},
+        'populations': populations,
+        'predictions': _reference_get_field_values(
+            hit, PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower()
+        ),
+        'transcripts': transcripts,
+    })
+    return result
+
+
+def _reference_get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None,
+                                lookup_field_prefix='', existing_fields=None):
+    return {
+        field_config.get('response_key', format_response_key(field)): _reference_value_if_has_key(
+            hit,
+            (get_addl_fields(field, field_config) if get_addl_fields else []) +
+            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
+            existing_fields=existing_fields,
+            **field_config
+        )
+        for field, field_config in field_configs.items()
+    }
+
+
+def _reference_value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
+    for key in keys:
+        if key in hit:
+            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
+    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+
+
+def _benchmark_hit(num_samples):
+    hit = {field: 0.1 for field in QUERY_FIELD_NAMES}
+    hit.update({
+        'contig': '1', 'start': 248367227, 'xpos': 1248367227, 'ref': 'TC', 'alt': 'T', 'variantId': '1-248367227-TC-T',
+        'rsid': None, 'filters': [], 'originalAltAlleles': ['1-248367227-TC-T'],
+        SORTED_TRANSCRIPTS_FIELD_KEY: [_Transcript({
+            'gene_id': 'ENSG00000135953', 'gene_symbol': 'MFSD9', 'transcript_id': 'ENST0000000{}'.format(i),
+            'major_consequence': 'frameshift_variant', 'major_consequence_rank': 3, 'hgvsc': 'c.1C>T', 'hgvsp': None,
+            'lof': 'HC', 'lof_flags': None, 'lof_filter': None, 'biotype': 'protein_coding', 'canonical': i == 0,
+            'category': 'lof', 'amino_acids': 'P/X', 'codons': 'Ccc/cc', 'domains': ['Pfam_domain:PF00001'],
+            'transcript_rank': i,
+        }) for i in range(5)],
+        GENOTYPES_FIELD_KEY: [{
+            'sample_id': 'SAMPLE{}'.format(i), 'num_alt': 1, 'ab': 0.5, 'ad': None, 'dp': 40, 'gq': 99, 'pl': None,
+        } for i in range(num_samples)],
+    })
+    for field in HAS_ALT_FIELD_KEYS:
+        hit[field] = ['SAMPLE{}'.format(i) for i in range(num_samples)]
+    return hit
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-hit cost of parsing search hits with the previous parsing and the compiled hit parser'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hits', type=int, default=100, help='number of hits parsed per run')
+        parser.add_argument('--samples', type=int, default=3, help='number of genotypes per hit')
+        parser.add_argument('--repeat', type=int, default=20, help='number of timed runs')
+
+    def handle(self, *args, **options):
+        num_hits = options['hits']
+        index_metadata = {'genomeVersion': GENOME_VERSION_GRCh37, 'fields': QUERY_FIELD_NAMES}
+        hit = _benchmark_hit(options['samples'])
+
+        compiled_parser = _HitParser(index_metadata)
+
+        def _reference_parse_hit():
+            source = _reference_get_source(hit)
+            return _reference_parse(source, index_metadata), [
+                _reference_parse_genotype(genotype) for genotype in source[GENOTYPES_FIELD_KEY]]
+
+        def _compiled_parse_hit():
+            source = compiled_parser.get_source(hit)
+            return compiled_parser.parse(source), [
+                compiled_parser.parse_genotype(genotype) for genotype in source[GENOTYPES_FIELD_KEY]]
+
+        if _reference_parse_hit() != _compiled_parse_hit():
+            raise CommandError('The compiled hit parser output differs from the previous parsing')
+
+        def _parse_hits(parse_hit):
+            for _ in range(num_hits):
+                parse_hit()
+
+        reference_time = min(timeit.repeat(
+            lambda: _parse_hits(_reference_parse_hit), number=1, repeat=options['repeat']))
+        compiled_time = min(timeit.repeat(
+            lambda: _parse_hits(_compiled_parse_hit), number=1, repeat=options['repeat']))
+
+        logger.info('Previous parsing: {:.1f} us per hit'.format(reference_time / num_hits * 10**6))
+        logger.info('Compiled: {:.1f} us per hit'.format(compiled_time / num_hits * 10**6))
+        logger.info('Speedup: {:.1f}x'.format(reference_time / compiled_time))
@@ -0,0 +1,58 @@
+import logging
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from pyliftover.liftover import LiftOver
+
+from seqr.utils.liftover_utils import ChainLiftover
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Compare the cost of lifting over GRCh38 positions with per-call pyliftover and batched ChainLiftover'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--positions', type=int, default=100000, help='number of positions lifted per run')
+        parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+        parser.add_argument('--chain-file', help='local chain file to use instead of the hg38 to hg19 chain file')
+
+    def handle(self, *args, **options):
+        num_positions = options['positions']
+        pyliftover = LiftOver(options['chain_file']) if options.get('chain_file') else LiftOver('hg38', 'hg19')
+        chain_liftover = ChainLiftover.from_liftover(pyliftover, cache_size=num_positions * 2)
+
+        chrom_sizes = {chain.source_name: chain.source_size for chain in pyliftover.chain_file.chains}
+        chroms = sorted(chrom_sizes.keys())
+        rand = random.Random(0)
+        coords = []
+        for _ in range(num_positions):
+            chrom = rand.choice(chroms)
+            coords.append((chrom, rand.randint(1, chrom_sizes[chrom] - 1)))
+
+        def _pyliftover_convert():
+            lifted = []
+            for chrom, pos in coords:
+                lifted_coord = pyliftover.convert_coordinate(chrom, pos)
+                lifted.append((lifted_coord[0][0].lstrip('chr'), lifted_coord[0][1]) if lifted_coord else None)
+            return lifted
+
+        def _chain_liftover_convert():
+            chain_liftover.clear_cache()
+            return chain_liftover.convert_coordinates(coords)
+
+        mismatches = sum(1 for expected, lifted in zip(_pyliftover_convert(), _chain_liftover_convert()) if expected != lifted)
+        if mismatches:
+            logger.warn('{} of {} lifted positions differ from pyliftover'.format(mismatches, num_positions))
+
+        pyliftover_time = min(timeit.repeat(_pyliftover_convert, number=1, repeat=options['repeat']))
+        batch_time = min(timeit.repeat(_chain_liftover_convert, number=1, repeat=options['repeat']))
+        chain_liftover.convert_coordinates(coords)
+        cached_time = min(timeit.repeat(
+            lambda: chain_liftover.convert_coordinates(coords), number=1, repeat=options['repeat']))
+
+        logger.info('pyliftover per call: {:.2f} us per position'.format(pyliftover_time / num_positions * 10**6))
+        logger.info('Batched: {:.2f} us per position ({:.1f}x)'.format(
+            batch_time / num_positions * 10**6, pyliftover_time / batch_time))
+        logger.info('Batched, cached: {:.2f} us per position ({:.1f}x)'.format(
+            cached_time / num_positions * 10**6, pyliftover_time / cached_time))
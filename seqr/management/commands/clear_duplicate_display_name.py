@@ -3,7 +3,8 @@ import logging
 from django.core.management.base import BaseCommand
 from django.db.models import F
 
-from seqr.models import Family, Individual
+from seqr.models import Family, Individual, increment_project_page_version, PROJECT_PAGE_FAMILIES, \
+    PROJECT_PAGE_INDIVIDUALS, PROJECT_PAGE_VARIANT_TAGS
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +16,19 @@ class Command(BaseCommand):
         pass
 
     def handle(self, *args, **options):
-        updated = Family.objects.filter(display_name=F('family_id')).update(display_name='')
+        families = Family.objects.filter(display_name=F('family_id'))
+        family_project_ids = set(families.values_list('project_id', flat=True))
+        updated = families.update(display_name='')
         logger.info("Updated {} families".format(updated))
 
-        updated = Individual.objects.filter(display_name=F('individual_id')).update(display_name='')
+        individuals = Individual.objects.filter(display_name=F('individual_id'))
+        individual_project_ids = set(individuals.values_list('family__project_id', flat=True))
+        updated = individuals.update(display_name='')
         logger.info("Updated {} individuals".format(updated))
 
+        # Queryset updates do not send the model save signals, so the changed projects are marked as updated here
+        if family_project_ids:
+            increment_project_page_version([PROJECT_PAGE_FAMILIES], update_stats=True, id__in=family_project_ids)
+        if individual_project_ids:
+            increment_project_page_version(
+                [PROJECT_PAGE_INDIVIDUALS, PROJECT_PAGE_VARIANT_TAGS], update_stats=True, id__in=individual_project_ids)
@@ -0,0 +1,39 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+from seqr.models import SavedVariant
+from seqr.views.utils.variant_utils import bulk_save_saved_variant_json, SAVED_VARIANT_JSON_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Convert saved variant json to the storage format set by SAVED_VARIANT_JSON_COMPRESSED, and set the fields ' \
+           'projected from the json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=SAVED_VARIANT_JSON_CHUNK_SIZE,
+                            help='number of variants to convert at a time')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if settings.SAVED_VARIANT_JSON_COMPRESSED:
+            saved_variants = SavedVariant.objects.filter(saved_variant_json__isnull=False).exclude(saved_variant_json='')
+        else:
+            saved_variants = SavedVariant.objects.filter(saved_variant_json_compressed__isnull=False)
+        saved_variant_ids = list(saved_variants.order_by('id').values_list('id', flat=True))
+        logger.info('Converting {} saved variants'.format(len(saved_variant_ids)))
+
+        start = time.time()
+        for i in tqdm(range(0, len(saved_variant_ids), chunk_size), unit=' chunks'):
+            chunk = list(SavedVariant.objects.filter(id__in=saved_variant_ids[i:i + chunk_size]))
+            for saved_variant in chunk:
+                saved_variant.set_saved_variant_json(saved_variant.get_saved_variant_json())
+            bulk_save_saved_variant_json(chunk)
+
+        elapsed = time.time() - start
+        logger.info('Converted {} saved variants in {:.1f}s ({:.0f} variants/s)'.format(
+            len(saved_variant_ids), elapsed, len(saved_variant_ids) / elapsed if elapsed else 0))
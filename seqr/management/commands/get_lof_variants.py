@@ -1,13 +1,12 @@
 from collections import defaultdict
 import csv
 from django.core.management.base import BaseCommand
-import elasticsearch
 import elasticsearch_dsl
 import gzip
 import json
 
-import settings
 from seqr.models import Individual
+from seqr.utils.es_utils import get_es_client
 from seqr.views.utils.orm_to_json_utils import _get_json_for_individuals
 from xbrowse_server.base.models import Project as BaseProject
 
@@ -62,7 +61,7 @@ class Command(BaseCommand):
             es_indices = indices_for_project.keys()
 
         if not options["metadata_only"]:
-            es_client = elasticsearch.Elasticsearch(host=settings.ELASTICSEARCH_SERVICE_HOSTNAME, timeout=10000)
+            es_client = get_es_client(timeout=10000)
             search = elasticsearch_dsl.Search(using=es_client, index='*,'.join(es_indices) + "*")
             search = search.query("match", mainTranscript_lof='HC')
             search = search.source(['contig', 'pos', 'ref', 'alt', '*num_alt', '*gq', '*ab', '*dp', '*ad'])
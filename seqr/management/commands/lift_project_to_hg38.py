@@ -1,11 +1,9 @@
 import logging
-import json
 from collections import defaultdict
 from django.core.management.base import BaseCommand
 from django.db.models.query_utils import Q
-from pyliftover.liftover import LiftOver
 
-from reference_data.models import GENOME_VERSION_GRCh38
+from reference_data.models import GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
 from seqr.models import Project, SavedVariant, Sample
 from seqr.model_utils import update_xbrowse_vcfffiles
 from seqr.views.apis.dataset_api import _update_samples
@@ -14,7 +12,8 @@ from seqr.views.utils.dataset_utils import match_sample_ids_to_sample_records, v
 from seqr.views.utils.json_to_orm_utils import update_model_from_json
 from seqr.views.utils.orm_to_json_utils import get_json_for_saved_variants
 from seqr.views.utils.variant_utils import reset_cached_search_results
-from seqr.utils.es_utils import get_es_variants_for_variant_tuples
+from seqr.utils.es_utils import get_es_variants_for_variant_tuples, clear_index_mappings_cache
+from seqr.utils.liftover_utils import get_liftover
 from seqr.utils.xpos_utils import get_xpos
 
 logger = logging.getLogger(__name__)
@@ -37,6 +36,7 @@ class Command(BaseCommand):
 
         # Validate the provided index
         logger.info('Validating es index {}'.format(elasticsearch_index))
+        clear_index_mappings_cache(elasticsearch_index)
         sample_ids, index_metadata = get_elasticsearch_index_samples(elasticsearch_index)
         validate_index_metadata(index_metadata, project, elasticsearch_index, genome_version=GENOME_VERSION_GRCh38)
         sample_type = index_metadata['sampleType']
@@ -121,16 +121,17 @@ class Command(BaseCommand):
         logger.info('Lifting over {} variants (skipping {} that are already lifted)'.format(
             len(saved_variants_to_lift), num_already_lifted))
 
-        liftover_to_38 = LiftOver('hg19', 'hg38')
+        liftover_to_38 = get_liftover(GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38)
+        if not liftover_to_38:
+            raise Exception('Error: unable to set up liftover')
+        hg38_coords = liftover_to_38.convert_coordinates([(v['chrom'], v['pos']) for v in saved_variants_to_lift])
         hg37_to_hg38_xpos = {}
         lift_failed = set()
-        for v in saved_variants_to_lift:
-            if not (hg37_to_hg38_xpos.get(v['xpos']) or v['xpos'] in lift_failed):
-                hg38_coord = liftover_to_38.convert_coordinate('chr{}'.format(v['chrom'].lstrip('chr')), int(v['pos']))
-                if hg38_coord and hg38_coord[0]:
-                    hg37_to_hg38_xpos[v['xpos']] = get_xpos(hg38_coord[0][0], hg38_coord[0][1])
-                else:
-                    lift_failed.add(v['xpos'])
+        for v, hg38_coord in zip(saved_variants_to_lift, hg38_coords):
+            if hg38_coord:
+                hg37_to_hg38_xpos[v['xpos']] = get_xpos(*hg38_coord)
+            else:
+                lift_failed.add(v['xpos'])
 
         if lift_failed:
             raise Exception(
@@ -165,7 +166,7 @@ class Command(BaseCommand):
                 ))
             for saved_variant in saved_variant_models:
                 saved_variant.xpos_start = var['xpos']
-                saved_variant.saved_variant_json = json.dumps(var)
+                saved_variant.set_saved_variant_json(var)
                 saved_variant.save()
 
         logger.info('Successfully updated {} variants'.format(len(es_variants)))
@@ -0,0 +1,23 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.db.models.query_utils import Q
+
+from seqr.models import Project
+from seqr.views.utils.project_stats_utils import update_projects_stats
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed dashboard stats for projects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('projects', nargs="*", help='Project(s) to rebuild. If not specified, defaults to all projects.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['projects']:
+            projects = projects.filter(Q(name__in=options['projects']) | Q(guid__in=options['projects']))
+
+        update_projects_stats(list(projects))
+        logger.info('Done')
@@ -1,10 +1,13 @@
 import logging
+import time
+from multiprocessing.pool import ThreadPool
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.db.models.query_utils import Q
 from tqdm import tqdm
 import traceback
 from seqr.models import Project
-from seqr.views.utils.variant_utils import update_project_saved_variant_json
+from seqr.views.utils.variant_utils import update_project_saved_variant_json, SAVED_VARIANT_JSON_CHUNK_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +18,11 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('projects', nargs="*", help='Project(s) to transfer. If not specified, defaults to all projects.')
         parser.add_argument('--family-id', help='optional family to reload variants for')
+        parser.add_argument('--chunk-size', type=int, default=SAVED_VARIANT_JSON_CHUNK_SIZE,
+                            help='number of variants to look up and save at a time')
+        parser.add_argument('--changed-only', action='store_true',
+                            help='only save variants whose json has changed')
+        parser.add_argument('--threads', type=int, default=1, help='number of projects to reload in parallel')
 
     def handle(self, *args, **options):
         """transfer project"""
@@ -28,19 +36,33 @@ class Command(BaseCommand):
             projects = Project.objects.filter(deprecated_project_id__isnull=False)
             logging.info("Processing all %s projects" % len(projects))
 
+        start = time.time()
+        reload_kwargs = {
+            'family_id': family_id, 'chunk_size': options['chunk_size'], 'changed_only': options['changed_only'],
+        }
+        if options['threads'] > 1:
+            pool = ThreadPool(options['threads'])
+            results = pool.imap_unordered(
+                lambda project: _reload_project(project, close_connection=True, **reload_kwargs), projects)
+        else:
+            pool = None
+            results = (_reload_project(project, **reload_kwargs) for project in projects)
+
         success = {}
         error = {}
-        for project in tqdm(projects, unit=" projects"):
-            logger.info("Project: " + project.name)
-            try:
-                updated_saved_variant_guids = update_project_saved_variant_json(project, family_id=family_id)
-                success[project.name] = len(updated_saved_variant_guids)
-                logger.info('Updated {0} variants for project {1}'.format(len(updated_saved_variant_guids), project.name))
-            except Exception as e:
-                traceback_message = traceback.format_exc()
-                logger.error(traceback_message)
-                logger.error('Error in project {0}: {1}'.format(project.name, e))
-                error[project.name] = e
+        for project_name, updated_count, e in tqdm(results, total=len(projects), unit=" projects"):
+            if e:
+                error[project_name] = e
+            else:
+                success[project_name] = updated_count
+        if pool:
+            pool.close()
+            pool.join()
+
+        elapsed = time.time() - start
+        total_updated = sum(success.values())
+        logger.info('Updated {} variants in {} projects in {:.1f}s ({:.0f} variants/s)'.format(
+            total_updated, len(success), elapsed, total_updated / elapsed if elapsed else 0))
 
         logger.info("Done")
         logger.info("Summary: ")
@@ -52,3 +74,19 @@ class Command(BaseCommand):
         for k, v in error.items():
             logger.info("  {0}: {1}".format(k, v))
 
+
+def _reload_project(project, close_connection=False, **kwargs):
+    logger.info("Project: " + project.name)
+    try:
+        updated_saved_variant_guids = update_project_saved_variant_json(project, **kwargs)
+        logger.info('Updated {0} variants for project {1}'.format(len(updated_saved_variant_guids), project.name))
+        return project.name, len(updated_saved_variant_guids), None
+    except Exception as e:
+        traceback_message = traceback.format_exc()
+        logger.error(traceback_message)
+        logger.error('Error in project {0}: {1}'.format(project.name, e))
+        return project.name, 0, e
+    finally:
+        # Each worker thread opens its own database connection, which is closed once the project is reloaded
+        if close_connection:
+            connection.close()
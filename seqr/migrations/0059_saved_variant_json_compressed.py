@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2019-07-02 14:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seqr', '0058_matchmakercontactnotes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedvariant',
+            name='gene_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), blank=True, default=[], size=None),
+        ),
+        migrations.AddField(
+            model_name='savedvariant',
+            name='main_transcript_gene_id',
+            field=models.CharField(blank=True, db_index=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='savedvariant',
+            name='main_transcript_id',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='savedvariant',
+            name='saved_variant_json_compressed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='savedvariant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['gene_ids'], name='seqr_savedv_gene_id_737124_gin'),
+        ),
+    ]
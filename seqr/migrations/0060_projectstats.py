@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2019-07-09 10:27
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seqr', '0059_saved_variant_json_compressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStats',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='seqr.Project')),
+                ('stats', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('version', models.IntegerField(default=0)),
+                ('stats_version', models.IntegerField(null=True)),
+            ],
+        ),
+    ]
@@ -1,17 +1,27 @@
 from abc import abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import threading
 import uuid
 import json
 import random
+import zlib
 
 from django.contrib.auth.models import User, Group
 from django.contrib.postgres.fields import JSONField, ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.db.models import options
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.text import slugify as __slugify
 
+from guardian.models import UserObjectPermission, GroupObjectPermission
 from guardian.shortcuts import assign_perm
 
+from seqr.utils.redis_utils import get_redis_client
 from seqr.utils.xpos_utils import get_chrom_pos
 from reference_data.models import GENOME_VERSION_GRCh37, GENOME_VERSION_CHOICES
 from django.conf import settings
@@ -20,6 +30,19 @@ from django.conf import settings
 # (from https://stackoverflow.com/questions/1088431/adding-attributes-into-django-models-meta-class)
 options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('json_fields', 'internal_json_fields',)
 
+logger = logging.getLogger(__name__)
+
+# Incremented whenever project permissions or group membership change, so cached user permissions are not reused
+PROJECT_PERMISSIONS_VERSION_CACHE_KEY = 'project_permissions_version'
+
+# Incremented whenever the data shown in a section of the project page changes, so cached sections are not reused
+PROJECT_PAGE_VERSION_CACHE_KEY = 'project_page_version__{project_guid}__{section}'
+PROJECT_PAGE_FAMILIES = 'families'
+PROJECT_PAGE_INDIVIDUALS = 'individuals'
+PROJECT_PAGE_SAMPLES = 'samples'
+PROJECT_PAGE_ANALYSIS_GROUPS = 'analysis_groups'
+PROJECT_PAGE_VARIANT_TAGS = 'variant_tags'
+
 CAN_VIEW = 'can_view'
 CAN_EDIT = 'can_edit'
 IS_OWNER = 'is_owner'
@@ -399,6 +422,22 @@ class ProjectLastAccessedDate(models.Model):
     last_accessed_date = models.DateTimeField(auto_now=True, db_index=True)
 
 
+class ProjectStats(models.Model):
+    """Precomputed project counts shown on the dashboard.
+
+    The version is incremented whenever a family, individual, sample or variant tag in the project changes, and the
+    stats are out of date if they were computed for an earlier version.
+    """
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, primary_key=True)
+    stats = JSONField(null=True)
+    version = models.IntegerField(default=0)
+    stats_version = models.IntegerField(null=True)
+
+    @property
+    def is_stale(self):
+        return self.stats is None or self.stats_version != self.version
+
+
 class Sample(ModelWithGUID):
     """This model represents a single data type (eg. Read Alignments, Variant Calls, or SV Calls) that's generated from
     a single biological sample (eg. WES, WGS, RNA, Array).
@@ -521,7 +560,15 @@ class SavedVariant(ModelWithGUID):
     alt = models.TextField()
 
     # Cache genotypes and annotations for the variant as gene id and consequence - in case the dataset gets deleted, etc.
+    # The json is stored in only one of the plain or zlib compressed fields, and should be accessed with
+    # get_saved_variant_json and set_saved_variant_json
     saved_variant_json = models.TextField(null=True, blank=True)
+    saved_variant_json_compressed = models.BinaryField(null=True, blank=True)
+
+    # Fields from the saved variant json that are used without the rest of the json
+    gene_ids = ArrayField(models.CharField(max_length=20), default=list(), blank=True)
+    main_transcript_id = models.CharField(max_length=20, null=True, blank=True)
+    main_transcript_gene_id = models.CharField(max_length=20, null=True, blank=True, db_index=True)
 
     project = models.ForeignKey('Project')
     family = models.ForeignKey('Family', null=True, blank=True, on_delete=models.SET_NULL)
@@ -533,14 +580,69 @@ class SavedVariant(ModelWithGUID):
     def _compute_guid(self):
         return 'SV%07d_%s' % (self.id, _slugify(str(self)))
 
+    def get_saved_variant_json(self):
+        """Returns the parsed saved variant json, or None if it is not set.
+
+        The json is only decompressed and parsed the first time it is accessed for each instance.
+        """
+        if not hasattr(self, '_parsed_saved_variant_json'):
+            compressed = self.saved_variant_json_compressed
+            if compressed:
+                # Depending on the database driver binary fields are loaded as a buffer or a memoryview
+                json_string = zlib.decompress(compressed.tobytes() if isinstance(compressed, memoryview) else compressed)
+            else:
+                json_string = self.saved_variant_json
+            self._parsed_saved_variant_json = json.loads(json_string) if json_string else None
+        return self._parsed_saved_variant_json
+
+    def set_saved_variant_json(self, variant_json):
+        """Sets the stored json and the fields projected from it. The model is not saved."""
+        json_string = json.dumps(variant_json)
+        if settings.SAVED_VARIANT_JSON_COMPRESSED:
+            self.saved_variant_json_compressed = zlib.compress(json_string)
+            self.saved_variant_json = None
+        else:
+            self.saved_variant_json = json_string
+            self.saved_variant_json_compressed = None
+
+        gene_ids, main_transcript = _get_saved_variant_json_genes(variant_json)
+        self.gene_ids = gene_ids
+        self.main_transcript_id = main_transcript.get('transcriptId')
+        self.main_transcript_gene_id = main_transcript.get('geneId')
+        # Round trip through the json so the cached value matches what is later loaded from the database
+        self._parsed_saved_variant_json = json.loads(json_string)
+
     class Meta:
         index_together = ('xpos_start', 'ref', 'alt', 'project')
 
         unique_together = ('xpos_start', 'xpos_end', 'ref', 'alt', 'project', 'family')
 
+        indexes = [GinIndex(fields=['gene_ids'])]
+
         json_fields = ['guid', 'xpos', 'ref', 'alt']
 
 
+def _get_saved_variant_json_genes(variant_json):
+    """Returns the sorted gene ids and the main transcript (with transcriptId and geneId) for either the current or the
+    legacy xbrowse saved variant json."""
+    if 'transcripts' in variant_json:
+        gene_ids = (variant_json.get('transcripts') or {}).keys()
+        main_transcript = variant_json.get('mainTranscript') or {}
+    else:
+        annotation = variant_json.get('annotation') or {}
+        vep_annotation = annotation.get('vep_annotation') or []
+        gene_ids = [transcript.get('gene', transcript.get('gene_id')) for transcript in vep_annotation] + (
+            annotation.get('gene_ids') or [])
+        main_transcript = annotation.get('main_transcript') or (
+            vep_annotation[annotation['worst_vep_annotation_index']]
+            if annotation.get('worst_vep_annotation_index') is not None and vep_annotation else {})
+        main_transcript = {
+            'transcriptId': main_transcript.get('feature') or main_transcript.get('transcript_id'),
+            'geneId': main_transcript.get('gene') or main_transcript.get('gene_id'),
+        }
+    return sorted({gene_id for gene_id in gene_ids if gene_id}), main_transcript
+
+
 class VariantTagType(ModelWithGUID):
     """
     Previous color choices:
@@ -856,3 +958,163 @@ class MatchmakerContactNotes(ModelWithGUID):
     class Meta:
         json_fields = []
         internal_json_fields = ['institution', 'comments']
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver([post_save, post_delete], sender=UserObjectPermission)
+@receiver([post_save, post_delete], sender=GroupObjectPermission)
+@receiver(post_delete, sender=Project)
+def _update_project_permissions_version(**kwargs):
+    try:
+        get_redis_client().incr(PROJECT_PERMISSIONS_VERSION_CACHE_KEY)
+    except Exception as e:
+        logger.warn('Unable to update "{}" in redis: {}'.format(PROJECT_PERMISSIONS_VERSION_CACHE_KEY, e))
+
+
+# Project page changes collected by deferred_project_page_updates for the current thread
+PENDING_PROJECT_PAGE_UPDATES = threading.local()
+
+
+@contextmanager
+def deferred_project_page_updates():
+    """Collects the project page and stats changes made in the block, and applies them once the block exits.
+
+    Saving many rows one at a time would otherwise look up and update the projects for every row, instead of once for
+    each set of changed sections.
+    """
+    depth = getattr(PENDING_PROJECT_PAGE_UPDATES, 'depth', 0)
+    if not depth:
+        PENDING_PROJECT_PAGE_UPDATES.updates = defaultdict(set)
+    PENDING_PROJECT_PAGE_UPDATES.depth = depth + 1
+    try:
+        yield
+    finally:
+        PENDING_PROJECT_PAGE_UPDATES.depth = depth
+        if not depth:
+            # Rows are saved as they change, so any changes made before an error are applied as well
+            updates = PENDING_PROJECT_PAGE_UPDATES.updates
+            PENDING_PROJECT_PAGE_UPDATES.updates = None
+            _apply_project_page_updates(updates)
+
+
+def increment_project_page_version(sections, update_stats=False, resolve_now=False, **project_filter):
+    """Marks the given project page sections as changed for all projects matching the given single field filter.
+
+    If update_stats is set the projects' dashboard stats are also marked as out of date. Within
+    deferred_project_page_updates the change is applied when the block exits, and resolve_now looks up the projects
+    straight away for filters through rows that may be deleted before then.
+    """
+    is_deferred = getattr(PENDING_PROJECT_PAGE_UPDATES, 'depth', 0)
+    if is_deferred and resolve_now and project_filter:
+        project_filter = {'id__in': list(Project.objects.filter(**project_filter).values_list('id', flat=True))}
+
+    filter_field, filter_values = None, []
+    if project_filter:
+        (filter_field, filter_value), = project_filter.items()
+        if filter_field.endswith('__in'):
+            filter_field = filter_field[:-len('__in')]
+            filter_values = filter_value
+        else:
+            filter_values = [filter_value]
+
+    update_key = (filter_field, tuple(sections), update_stats)
+    if is_deferred:
+        PENDING_PROJECT_PAGE_UPDATES.updates[update_key].update(filter_values)
+    else:
+        _apply_project_page_updates({update_key: filter_values})
+
+
+def _apply_project_page_updates(updates):
+    """Increments the section versions and stats versions for the projects matching the collected filters.
+
+    The projects are looked up once for each filter field and set of sections, the stats are updated in one query and
+    the section versions are incremented in a single redis round trip.
+    """
+    section_versions = set()
+    stats_project_ids = set()
+    for (filter_field, sections, update_stats), filter_values in updates.items():
+        if filter_field and not filter_values:
+            continue
+        project_filter = {'{}__in'.format(filter_field): filter_values} if filter_field else {}
+        for project_id, project_guid in Project.objects.filter(**project_filter).values_list('id', 'guid').distinct():
+            section_versions.update((project_guid, section) for section in sections)
+            if update_stats:
+                stats_project_ids.add(project_id)
+
+    if stats_project_ids:
+        ProjectStats.objects.filter(project_id__in=stats_project_ids).update(version=models.F('version') + 1)
+
+    if not section_versions:
+        return
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for project_guid, section in sorted(section_versions):
+            pipeline.incr(PROJECT_PAGE_VERSION_CACHE_KEY.format(project_guid=project_guid, section=section))
+        pipeline.execute()
+    except Exception as e:
+        logger.warn('Unable to update project page versions in redis: {}'.format(e))
+
+
+@receiver([post_save, post_delete], sender=Family)
+def _update_family_project_page(sender, instance, signal, **kwargs):
+    sections = [PROJECT_PAGE_FAMILIES]
+    if signal == post_delete:
+        # Analysis group memberships are deleted along with the family without sending m2m_changed
+        sections.append(PROJECT_PAGE_ANALYSIS_GROUPS)
+    increment_project_page_version(sections, update_stats=True, id=instance.project_id)
+
+
+@receiver([post_save, post_delete], sender=FamilyAnalysedBy)
+def _update_family_analysed_by_project_page(sender, instance, signal, **kwargs):
+    increment_project_page_version(
+        [PROJECT_PAGE_FAMILIES], resolve_now=signal == post_delete, family__id=instance.family_id)
+
+
+@receiver([post_save, post_delete], sender=Individual)
+def _update_individual_project_page(sender, instance, signal, **kwargs):
+    # Discovery tag genotypes are keyed by the individual guids
+    increment_project_page_version(
+        [PROJECT_PAGE_INDIVIDUALS, PROJECT_PAGE_VARIANT_TAGS], update_stats=True, resolve_now=signal == post_delete,
+        family__id=instance.family_id)
+
+
+@receiver([post_save, post_delete], sender=Sample)
+def _update_sample_project_page(sender, instance, signal, **kwargs):
+    increment_project_page_version(
+        [PROJECT_PAGE_SAMPLES], update_stats=True, resolve_now=signal == post_delete,
+        family__individual__id=instance.individual_id)
+
+
+@receiver([post_save, post_delete], sender=AnalysisGroup)
+def _update_analysis_group_project_page(sender, instance, **kwargs):
+    increment_project_page_version([PROJECT_PAGE_ANALYSIS_GROUPS], id=instance.project_id)
+
+
+@receiver(m2m_changed, sender=AnalysisGroup.families.through)
+def _update_analysis_group_families_project_page(sender, instance, action, **kwargs):
+    # The instance is either the analysis group or the family, depending on which side of the relation was changed
+    if action.startswith('post_'):
+        increment_project_page_version([PROJECT_PAGE_ANALYSIS_GROUPS], id=instance.project_id)
+
+
+@receiver([post_save, post_delete], sender=SavedVariant)
+def _update_saved_variant_project_page(sender, instance, **kwargs):
+    increment_project_page_version([PROJECT_PAGE_VARIANT_TAGS], id=instance.project_id)
+
+
+@receiver([post_save, post_delete], sender=VariantTag)
+@receiver([post_save, post_delete], sender=VariantNote)
+@receiver([post_save, post_delete], sender=VariantFunctionalData)
+def _update_variant_annotation_project_page(sender, instance, signal, **kwargs):
+    if instance.saved_variant_id:
+        # Only the variant tag counts are included in the project stats
+        increment_project_page_version(
+            [PROJECT_PAGE_VARIANT_TAGS], update_stats=sender == VariantTag, resolve_now=signal == post_delete,
+            savedvariant__id=instance.saved_variant_id)
+
+
+@receiver([post_save, post_delete], sender=VariantTagType)
+def _update_variant_tag_type_project_page(sender, instance, **kwargs):
+    # Tag types without a project are shown for every project
+    project_filter = {'id': instance.project_id} if instance.project_id else {}
+    increment_project_page_version([PROJECT_PAGE_VARIANT_TAGS], **project_filter)
@@ -1,48 +1,222 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from django.db.models import Max
 import elasticsearch
-from elasticsearch_dsl import Search, Q, Index, MultiSearch
+from elasticsearch.client.utils import _make_path
+from elasticsearch_dsl import Search, Q, Index
+from elasticsearch_dsl.aggs import Bucket
+import heapq
 import json
 import logging
-from pyliftover.liftover import LiftOver
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from sys import maxint
-import redis
+import threading
+import time
+import uuid
 
 import settings
 from reference_data.models import GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37, Omim, GeneConstraint
 from seqr.models import Sample, Individual
 from seqr.utils.xpos_utils import get_xpos, get_chrom_pos
 from seqr.utils.gene_utils import parse_locus_list_items
+from seqr.utils.interval_index import IntervalIndex
+from seqr.utils.liftover_utils import get_liftover
+from seqr.utils.redis_utils import get_redis_client, safe_redis_get_json, safe_redis_set_json, safe_redis_delete
+from seqr.utils.search_results_cache import SearchResultsCache
 from seqr.views.utils.json_utils import _to_camel_case
 
 logger = logging.getLogger(__name__)
 
 
 VARIANT_DOC_TYPE = 'variant'
-MAX_COMPOUND_HET_GENES = 1000
+# Compound het genes are loaded in pages of the composite gene aggregation, so there is no limit on the number of genes
+COMPOUND_HET_GENES_PAGE_SIZE = 1000
 
 XPOS_SORT_KEY = 'xpos'
+# variantId is unique within an index, so using it as a sort tiebreaker gives every hit a distinct search_after key
+VARIANT_ID_SORT_KEY = 'variantId'
+
+ES_EXPORT_BATCH_SIZE = 1000
+INDEX_SEARCH_TIMEOUT_BUFFER_SECONDS = 10
+
+
+ES_CLIENTS = {}
+ES_CLIENT_CHECKOUTS = defaultdict(int)
+ES_CLIENTS_LOCK = threading.Lock()
 
 
 def get_es_client(timeout=30):
-    return elasticsearch.Elasticsearch(host=settings.ELASTICSEARCH_SERVICE_HOSTNAME, timeout=timeout, retry_on_timeout=True)
+    """Returns the process-wide elasticsearch client for the given timeout.
+
+    Clients are thread-safe and hold a pool of keep-alive connections, so they are created once per process and shared
+    by every request instead of opening new connections for each search.
+    """
+    client_key = (settings.ELASTICSEARCH_SERVICE_HOSTNAME, timeout)
+    with ES_CLIENTS_LOCK:
+        client = ES_CLIENTS.get(client_key)
+        if client is None:
+            client = elasticsearch.Elasticsearch(
+                host=settings.ELASTICSEARCH_SERVICE_HOSTNAME,
+                timeout=timeout,
+                retry_on_timeout=True,
+                maxsize=settings.ELASTICSEARCH_CONNECTION_POOL_SIZE,
+                sniff_on_start=settings.ELASTICSEARCH_SNIFF,
+                sniff_on_connection_fail=settings.ELASTICSEARCH_SNIFF,
+                sniffer_timeout=settings.ELASTICSEARCH_SNIFFER_TIMEOUT if settings.ELASTICSEARCH_SNIFF else None,
+            )
+            ES_CLIENTS[client_key] = client
+        ES_CLIENT_CHECKOUTS[client_key] += 1
+    return client
+
+
+class _CompositeAgg(Bucket):
+    """The composite aggregation, which this version of elasticsearch_dsl predates."""
+    name = 'composite'
+
+
+class _OpaqueIdClient(object):
+    """Sends searches through a shared client tagged with an X-Opaque-Id header.
+
+    This version of the elasticsearch client can not set headers for a single request, and the header is what lets a
+    search find and cancel only the tasks it started.
+    """
+
+    def __init__(self, client, opaque_id):
+        self._client = client
+        self.opaque_id = opaque_id
+
+    def search(self, index=None, doc_type=None, body=None, **params):
+        return self._client.transport.perform_request(
+            'GET', _make_path(index, doc_type, '_search'), headers={'X-Opaque-Id': self.opaque_id}, params=params,
+            body=body)
+
+
+ES_SEARCH_POOL = None
+ES_SEARCH_POOL_LOCK = threading.Lock()
+
+# Compiled per-family genotype filters, cleared once full
+GENOTYPE_FILTER_CACHE = {}
+GENOTYPE_FILTER_CACHE_SIZE = 10000
+GENOTYPE_FILTER_CACHE_LOCK = threading.Lock()
+
+
+def _get_es_search_pool():
+    global ES_SEARCH_POOL
+    with ES_SEARCH_POOL_LOCK:
+        if ES_SEARCH_POOL is None:
+            ES_SEARCH_POOL = ThreadPool(settings.ELASTICSEARCH_SEARCH_THREADS)
+    return ES_SEARCH_POOL
+
+
+def get_es_client_stats():
+    stats = []
+    with ES_CLIENTS_LOCK:
+        for client_key, client in ES_CLIENTS.items():
+            host, timeout = client_key
+            connections = []
+            for connection in client.transport.connection_pool.connections:
+                pool = getattr(connection, 'pool', None)
+                if not pool:
+                    continue
+                connections.append({
+                    'host': connection.host,
+                    'maxsize': pool.pool.maxsize,
+                    'requests': pool.num_requests,
+                    'connectionsOpened': pool.num_connections,
+                    # Requests that found every pooled connection busy and had to open a new, discarded connection
+                    'poolExhaustedWaits': max(pool.num_connections - pool.pool.maxsize, 0),
+                })
+            stats.append({
+                'host': host,
+                'timeout': timeout,
+                'checkouts': ES_CLIENT_CHECKOUTS[client_key],
+                'connections': connections,
+            })
+    return stats
+
+
+INDEX_MAPPINGS_CACHE_KEY = 'index_mappings__{}'
+INDEX_MAPPINGS_REDIS_CACHE_SECONDS = 60 * 60 * 24
+# Other server processes only see an invalidation once their local copy expires
+INDEX_MAPPINGS_LOCAL_CACHE_SECONDS = 60 * 5
+INDEX_MAPPINGS_LOCAL_CACHE = {}
+
+
+def get_index_mappings(index_name, client):
+    """Returns the variant mapping metadata and field names for the given comma-separated index names or patterns.
+
+    Mappings only change when a new dataset is loaded, so they are cached per concrete index name in process and in
+    redis until clear_index_mappings_cache is called for that name. Aliases and wildcard patterns are always looked up,
+    as the concrete indices they resolve to can change without clear_index_mappings_cache being called for the pattern.
+
+    Returns:
+        dict: {concrete index name: {'meta': <variant mapping _meta>, 'fields': [<variant mapping field names>]}}
+    """
+    index_names = index_name.split(',')
+    mappings = {}
+    missing_index_names = []
+    for name in index_names:
+        cached_mappings = _get_cached_index_mappings(name)
+        if cached_mappings is None:
+            missing_index_names.append(name)
+        else:
+            mappings.update(cached_mappings)
+
+    if missing_index_names:
+        index = Index(','.join(missing_index_names), using=client)
+        try:
+            raw_mappings = index.get_mapping(doc_type=[VARIANT_DOC_TYPE])
+        except Exception as e:
+            raise InvalidIndexException('Error accessing index "{}": {}'.format(
+                index_name, e.error if hasattr(e, 'error') else e.message))
+
+        fetched_mappings = {}
+        for name, mapping in raw_mappings.items():
+            variant_mapping = mapping['mappings'].get(VARIANT_DOC_TYPE, {})
+            fetched_mappings[name] = {
+                'meta': variant_mapping.get('_meta', {}),
+                'fields': variant_mapping.get('properties', {}).keys(),
+            }
+        mappings.update(fetched_mappings)
+
+        for name in missing_index_names:
+            if name in fetched_mappings:
+                _set_cached_index_mappings(name, {name: fetched_mappings[name]})
+
+    return mappings
+
+
+def _get_cached_index_mappings(index_name):
+    cached_at, cached_mappings = INDEX_MAPPINGS_LOCAL_CACHE.get(index_name, (None, None))
+    if cached_at and time.time() - cached_at < INDEX_MAPPINGS_LOCAL_CACHE_SECONDS:
+        return cached_mappings
+
+    cached_mappings = safe_redis_get_json(INDEX_MAPPINGS_CACHE_KEY.format(index_name))
+    if cached_mappings is not None:
+        INDEX_MAPPINGS_LOCAL_CACHE[index_name] = (time.time(), cached_mappings)
+    return cached_mappings
+
+
+def _set_cached_index_mappings(index_name, mappings):
+    INDEX_MAPPINGS_LOCAL_CACHE[index_name] = (time.time(), mappings)
+    safe_redis_set_json(INDEX_MAPPINGS_CACHE_KEY.format(index_name), mappings, expire=INDEX_MAPPINGS_REDIS_CACHE_SECONDS)
+
+
+def clear_index_mappings_cache(index_name):
+    index_names = index_name.split(',')
+    for name in index_names:
+        INDEX_MAPPINGS_LOCAL_CACHE.pop(name, None)
+    safe_redis_delete(*[INDEX_MAPPINGS_CACHE_KEY.format(name) for name in index_names])
 
 
 def get_index_metadata(index_name, client):
-    index = Index(index_name, using=client)
-    try:
-        mappings = index.get_mapping(doc_type=[VARIANT_DOC_TYPE])
-    except Exception as e:
-        raise InvalidIndexException('Error accessing index "{}": {}'.format(
-            index_name, e.error if hasattr(e, 'error') else e.message))
     index_metadata = {}
-    for index_name, mapping in mappings.items():
-        variant_mapping = mapping['mappings'].get(VARIANT_DOC_TYPE, {})
+    for name, mapping in get_index_mappings(index_name, client).items():
         # TODO remove this check once all projects are migrated
-        if not variant_mapping['properties'].get('samples_num_alt_1'):
-            raise InvalidIndexException('Index "{}" does not have a valid schema'.format(index_name))
-        index_metadata[index_name] = variant_mapping.get('_meta', {})
-        index_metadata[index_name]['fields'] = variant_mapping['properties'].keys()
+        if 'samples_num_alt_1' not in mapping['fields']:
+            raise InvalidIndexException('Index "{}" does not have a valid schema'.format(name))
+        index_metadata[name] = dict(mapping['meta'])
+        index_metadata[name]['fields'] = mapping['fields']
     return index_metadata
 
 
@@ -59,41 +233,74 @@ def get_es_variants_for_variant_tuples(families, xpos_ref_alt_tuples):
     return variants
 
 
-def get_es_variants(search_model, sort=XPOS_SORT_KEY, page=1, num_results=100, load_all=False):
-    cache_key = 'search_results__{}__{}'.format(search_model.guid, sort)
-    redis_client = None
-    previous_search_results = {}
-    try:
-        redis_client = redis.StrictRedis(host=settings.REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
-        previous_search_results = json.loads(redis_client.get(cache_key) or '{}')
-    except Exception as e:
-        logger.warn("Unable to connect to redis host: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
+def get_es_variants(search_model, sort=XPOS_SORT_KEY, page=1, num_results=100, load_all=False, opaque_id=None):
+    """Returns the page of variants, the total number of results, and the indices with missing or partial results.
 
-    total_results = previous_search_results.get('total_results')
+    If given, every elasticsearch request made for the search is tagged with the opaque id, so they can be cancelled.
+    """
+    results_cache = SearchResultsCache(search_model.guid, sort)
+
+    total_results = results_cache.total_results
     if load_all:
         num_results = total_results or 10000
     start_index = (page-1)*num_results
     end_index = page * num_results
-    if previous_search_results.get('total_results') is not None:
-        end_index = min(end_index, previous_search_results['total_results'])
-
-    loaded_results = previous_search_results.get('all_results') or []
-    if len(loaded_results) >= end_index:
-        return loaded_results[start_index:end_index], total_results
+    if total_results is not None:
+        end_index = min(end_index, total_results)
 
-    grouped_results = previous_search_results.get('grouped_results')
-    if grouped_results:
-        results = _get_compound_het_page(grouped_results, start_index, end_index)
+    if results_cache.get_loaded_count('all_results') >= end_index:
+        results = results_cache.get_results(start_index, end_index)
         if results is not None:
-            return results, total_results
+            return results, total_results, []
+
+    if results_cache.get_loaded_count('grouped_results'):
+        grouped_results = results_cache.get_grouped_results(start_index, end_index)
+        if grouped_results is not None:
+            groups, skipped = grouped_results
+            results = _get_compound_het_page(groups, start_index, end_index, skipped=skipped)
+            if results is not None:
+                return results, total_results, []
+
+    previous_search_results = results_cache.load()
+
+    es_search = _get_es_search_for_model(
+        search_model, sort, previous_search_results=previous_search_results, opaque_id=opaque_id)
+
+    variant_results = es_search.search(page=page, num_results=num_results)
+
+    # Results that are missing indices which timed out are not cached, so those indices are searched again next time
+    if not es_search.incomplete_indices:
+        results_cache.save(es_search.previous_search_results)
+
+    search_model.save()
+
+    return variant_results, es_search.previous_search_results['total_results'], sorted(es_search.incomplete_indices)
+
+
+def iterate_es_variants(search_model, sort=XPOS_SORT_KEY, batch_size=ES_EXPORT_BATCH_SIZE):
+    """Yields batches of all the variants returned by the search, without loading the full result set into memory.
+
+    Compound het results are grouped by gene in a single aggregation with a fixed maximum size, so those searches are
+    loaded in full instead.
+    """
+    es_search = _get_es_search_for_model(search_model, sort)
+    if es_search.has_compound_het_search():
+        variants, _, _ = get_es_variants(search_model, sort=sort, load_all=True)
+        yield variants
+        return
+
+    for variants in es_search.iterate_results(batch_size=batch_size):
+        yield variants
+
 
+def _get_es_search_for_model(search_model, sort, previous_search_results=None, opaque_id=None):
     search = search_model.variant_search.search
 
     genes, intervals, invalid_items = parse_locus_list_items(search.get('locus', {}))
     if invalid_items:
         raise Exception('Invalid genes/intervals: {}'.format(', '.join(invalid_items)))
 
-    es_search = EsSearch(search_model.families.all(), previous_search_results=previous_search_results, skip_unaffected_families=search.get('inheritance'))
+    es_search = EsSearch(search_model.families.all(), previous_search_results=previous_search_results, skip_unaffected_families=search.get('inheritance'), opaque_id=opaque_id)
 
     es_search.sort(sort)
 
@@ -115,16 +322,7 @@ def get_es_variants(search_model, sort=XPOS_SORT_KEY, page=1, num_results=100, l
         quality_filter=search.get('qualityFilter'),
     )
 
-    variant_results = es_search.search(page=page, num_results=num_results)
-
-    try:
-        redis_client.set(cache_key, json.dumps(es_search.previous_search_results))
-    except Exception as e:
-        logger.warn("Unable to write to redis: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
-
-    search_model.save()
-
-    return variant_results, es_search.previous_search_results['total_results']
+    return es_search
 
 
 class InvalidIndexException(Exception):
@@ -146,14 +344,102 @@ def get_latest_loaded_samples(families=None):
     return [s for s in all_samples if s.loaded_date == sample_individual_max_loaded_date[s.individual.guid]]
 
 
+LoadedSample = namedtuple('LoadedSample', ['sample_id', 'individual'])
+LoadedSampleIndividual = namedtuple('LoadedSampleIndividual', ['guid', 'affected', 'sex'])
+
+LOADED_SAMPLES_VERSION_KEY = 'loaded_samples_version__{}'
+LOADED_SAMPLES_LOCAL_CACHE = {}
+MAX_LOADED_SAMPLES_LOCAL_CACHE_SIZE = 100
+
+
+def get_latest_loaded_samples_by_family_index(families):
+    """Returns the latest loaded sample for every individual in the given families, grouped for searching.
+
+    Results are memoized in process per family set, and are invalidated whenever reset_cached_loaded_samples is called
+    for one of the families' projects.
+
+    Returns:
+        dict: {elasticsearch index: {family guid: {sample id: LoadedSample}}}
+    """
+    if hasattr(families, 'values_list'):
+        family_project_ids = families.values_list('guid', 'project_id')
+    else:
+        family_project_ids = [(family.guid, family.project_id) for family in families]
+    family_guids = tuple(sorted({family_guid for family_guid, _ in family_project_ids}))
+    project_ids = sorted({project_id for _, project_id in family_project_ids})
+
+    versions = None
+    try:
+        versions = tuple(get_redis_client().mget(
+            [LOADED_SAMPLES_VERSION_KEY.format(project_id) for project_id in project_ids]
+        ))
+    except Exception as e:
+        logger.warn('Unable to fetch loaded sample versions from redis: {}'.format(e))
+
+    cached_versions, samples_by_family_index = LOADED_SAMPLES_LOCAL_CACHE.get(family_guids, (None, None))
+    if versions is None or cached_versions != versions:
+        samples_by_family_index = _get_latest_loaded_samples_by_family_index(family_guids)
+        if versions is not None:
+            if len(LOADED_SAMPLES_LOCAL_CACHE) >= MAX_LOADED_SAMPLES_LOCAL_CACHE_SIZE:
+                LOADED_SAMPLES_LOCAL_CACHE.clear()
+            LOADED_SAMPLES_LOCAL_CACHE[family_guids] = (versions, samples_by_family_index)
+
+    # Searches remove families from the returned mapping, so do not expose the cached mapping directly
+    return {
+        index: {family_guid: dict(samples_by_id) for family_guid, samples_by_id in family_samples.items()}
+        for index, family_samples in samples_by_family_index.items()
+    }
+
+
+def _get_latest_loaded_samples_by_family_index(family_guids):
+    samples = Sample.objects.filter(
+        dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS,
+        sample_status=Sample.SAMPLE_STATUS_LOADED,
+        elasticsearch_index__isnull=False,
+        individual__family__guid__in=family_guids,
+    ).values(
+        'sample_id', 'elasticsearch_index', 'loaded_date', 'individual__guid', 'individual__affected',
+        'individual__sex', 'individual__family__guid',
+    )
+
+    individual_max_loaded_date = {}
+    for sample in samples:
+        max_loaded_date = individual_max_loaded_date.get(sample['individual__guid'])
+        if sample['loaded_date'] and (max_loaded_date is None or sample['loaded_date'] > max_loaded_date):
+            individual_max_loaded_date[sample['individual__guid']] = sample['loaded_date']
+
+    samples_by_family_index = defaultdict(lambda: defaultdict(dict))
+    for sample in samples:
+        if sample['loaded_date'] == individual_max_loaded_date.get(sample['individual__guid']):
+            individual = LoadedSampleIndividual(
+                guid=sample['individual__guid'], affected=sample['individual__affected'], sex=sample['individual__sex'],
+            )
+            samples_by_family_index[sample['elasticsearch_index']][sample['individual__family__guid']][
+                sample['sample_id']] = LoadedSample(sample_id=sample['sample_id'], individual=individual)
+
+    return {index: dict(family_samples) for index, family_samples in samples_by_family_index.items()}
+
+
+def reset_cached_loaded_samples(project_ids):
+    """Invalidates the memoized loaded samples for the given projects in every server process.
+
+    Should be called whenever samples are loaded or deleted, or when an individual's family, sex or affected status
+    changes.
+    """
+    try:
+        redis_client = get_redis_client()
+        for project_id in set(project_ids):
+            redis_client.incr(LOADED_SAMPLES_VERSION_KEY.format(project_id))
+    except Exception as e:
+        logger.warn('Unable to reset cached loaded samples: {}'.format(e))
+
+
 class EsSearch(object):
 
-    def __init__(self, families, previous_search_results=None, skip_unaffected_families=False):
+    def __init__(self, families, previous_search_results=None, skip_unaffected_families=False, opaque_id=None):
         self._client = get_es_client()
 
-        self.samples_by_family_index = defaultdict(lambda: defaultdict(dict))
-        for s in get_latest_loaded_samples(families):
-            self.samples_by_family_index[s.elasticsearch_index][s.individual.family.guid][s.sample_id] = s
+        self.samples_by_family_index = get_latest_loaded_samples_by_family_index(families)
 
         if skip_unaffected_families:
             for index, family_samples in self.samples_by_family_index.items():
@@ -176,7 +462,14 @@ class EsSearch(object):
             ))
 
         self.previous_search_results = previous_search_results or {}
-
+        self.incomplete_indices = set()
+        self._index_search_deadline = None
+        self._genotype_filter_build_ms = 0
+
+        # Every request made for this search is tagged with this id so only its own tasks are cancelled on timeout
+        self._opaque_id = opaque_id or new_search_opaque_id()
+        self._hit_parsers = {}
+        self._compound_het_queries = {}
         self._search = Search()
         self._index_searches = defaultdict(list)
         self._sort = None
@@ -218,6 +511,7 @@ class EsSearch(object):
         if quality_filter and quality_filter.get('vcf_filter') is not None:
             self.filter(~Q('exists', field='filters'))
 
+        build_start = time.time()
         for index, family_samples_by_id in self.samples_by_family_index.items():
             if not inheritance and not quality_filter['min_ab'] and not quality_filter['min_gq']:
                 search_sample_count = sum(len(samples) for samples in family_samples_by_id.values())
@@ -243,13 +537,20 @@ class EsSearch(object):
                 )
 
             if compound_het_q and not has_previous_compound_hets:
-                compound_het_search = self._search.filter(compound_het_q)
-                compound_het_search.aggs.bucket(
-                    'genes', 'terms', field='geneIds', min_doc_count=2, size=MAX_COMPOUND_HET_GENES+1
-                ).metric(
-                    'vars_by_gene', 'top_hits', size=100, sort=self._sort, _source=QUERY_FIELD_NAMES
-                )
-                self._index_searches[index].append(compound_het_search)
+                self._compound_het_queries[index] = compound_het_q
+                self._index_searches[index].append(self._get_compound_het_search(index))
+
+        self._genotype_filter_build_ms = (time.time() - build_start) * 1000
+
+    def _get_compound_het_search(self, index, after=None):
+        compound_het_search = self._search.filter(self._compound_het_queries[index])
+        genes_agg_params = {'size': COMPOUND_HET_GENES_PAGE_SIZE, 'sources': [{'gene': {'terms': {'field': 'geneIds'}}}]}
+        if after:
+            genes_agg_params['after'] = after
+        compound_het_search.aggs.bucket('genes', 'composite', **genes_agg_params).metric(
+            'vars_by_gene', 'top_hits', size=100, sort=self._sort, _source=QUERY_FIELD_NAMES
+        )
+        return compound_het_search
 
     def search(self, page=1, num_results=100):
         indices = self.samples_by_family_index.keys()
@@ -312,7 +613,7 @@ class EsSearch(object):
         if not self.previous_search_results.get('loaded_variant_counts'):
             self.previous_search_results['loaded_variant_counts'] = {}
 
-        ms = MultiSearch()
+        index_searches = []
         for index_name in indices:
             start_index = 0
             if self.previous_search_results['loaded_variant_counts'].get(index_name):
@@ -323,28 +624,31 @@ class EsSearch(object):
             else:
                 self.previous_search_results['loaded_variant_counts'][index_name] = {'loaded': 0, 'total': 0}
 
-            searches = self._get_paginated_searches(index_name, page, num_results, start_index=start_index)
-            ms = ms.index(index_name)
-            for search in searches:
-                ms = ms.add(search)
+            searches = self._get_paginated_searches(
+                index_name, page, num_results, start_index=start_index, tiebreak_sort=True,
+                search_after=self.previous_search_results['loaded_variant_counts'][index_name].get('search_after'),
+            )
+            index_searches += [(index_name, search) for search in searches]
 
-        responses = self._execute_search(ms)
+        responses = self._execute_index_searches(index_searches)
 
-        new_results = []
+        sorted_new_results = []
         compound_het_results = self.previous_search_results.get('compound_het_results', [])
-        for response in responses:
+        for index_name, response in responses:
             response_hits, response_total, is_compound_het = self._parse_response(response)
             if not response_total:
                 continue
 
-            index_name = response.hits[0].meta.index
             if is_compound_het:
                 compound_het_results += response_hits
                 self.previous_search_results['loaded_variant_counts']['{}_compound_het'.format(index_name)] = {'total': response_total}
             else:
-                new_results += response_hits
+                sorted_new_results.append(response_hits)
                 self.previous_search_results['loaded_variant_counts'][index_name]['total'] = response_total
                 self.previous_search_results['loaded_variant_counts'][index_name]['loaded'] += len(response_hits)
+                if response_hits:
+                    self.previous_search_results['loaded_variant_counts'][index_name]['search_after'] = \
+                        list(response.hits[-1].meta.sort)
 
         self.previous_search_results['total_results'] = sum(counts['total'] for counts in self.previous_search_results['loaded_variant_counts'].values())
 
@@ -353,12 +657,13 @@ class EsSearch(object):
         previous_page_record_count = (page - 1) * num_results
         if len(all_loaded_results) >= previous_page_record_count:
             loaded_results = all_loaded_results[:previous_page_record_count]
-            new_results += all_loaded_results[previous_page_record_count:]
+            sorted_new_results.append(all_loaded_results[previous_page_record_count:])
         else:
             loaded_results = []
-            new_results += self.previous_search_results.get('variant_results', [])
+            sorted_new_results.append(self.previous_search_results.get('variant_results', []))
 
-        new_results = sorted(new_results, key=lambda variant: variant['_sort'])
+        # Each index's hits and the previously loaded results are already sorted, so they only need to be merged
+        new_results = list(_merge_sorted_results(sorted_new_results))
         variant_results = self._deduplicate_results(new_results)
 
         if compound_het_results or self.previous_search_results.get('grouped_results'):
@@ -369,7 +674,53 @@ class EsSearch(object):
             self.previous_search_results['all_results'] = loaded_results + variant_results
             return variant_results[:num_results]
 
-    def _get_paginated_searches(self, index_name, page, num_results, start_index=None):
+    def has_compound_het_search(self):
+        return any(search.aggs.to_dict() for searches in self._index_searches.values() for search in searches)
+
+    def iterate_results(self, batch_size=ES_EXPORT_BATCH_SIZE):
+        """Yields batches of all the sorted, deduplicated results for a search with no compound het aggregations.
+
+        Each index is paged through with search_after and the sorted index results are merged as they are loaded, so
+        memory use is bounded by the batch size regardless of the total number of results.
+        """
+        index_results = [
+            self._iterate_index_results(index_name, batch_size) for index_name in self.samples_by_family_index.keys()
+        ]
+
+        variant_results = []
+        for variant in _merge_sorted_results(index_results):
+            if variant_results and variant_results[-1]['variantId'] == variant['variantId']:
+                variant_results[-1]['genotypes'].update(variant['genotypes'])
+                variant_results[-1]['familyGuids'] = sorted(set(variant_results[-1]['familyGuids'] + variant['familyGuids']))
+                continue
+            if len(variant_results) >= batch_size:
+                yield variant_results
+                variant_results = []
+            variant_results.append(variant)
+
+        if variant_results:
+            yield variant_results
+
+    def _iterate_index_results(self, index_name, batch_size):
+        search = self._index_searches.get(index_name, [self._search])[0]
+        search = search.index(index_name).source(QUERY_FIELD_NAMES).sort(*(self._sort + [VARIANT_ID_SORT_KEY]))
+
+        search_after = None
+        while True:
+            page_search = search[:batch_size]
+            if search_after:
+                page_search = page_search.extra(search_after=search_after)
+            logger.info('Loading {} records after {}'.format(index_name, search_after))
+
+            hits = list(self._execute_search(page_search))
+            for hit, variant in zip(hits, self._parse_hits(hits)):
+                search_after = list(hit.meta.sort)
+                yield variant
+
+            if len(hits) < batch_size:
+                return
+
+    def _get_paginated_searches(self, index_name, page, num_results, start_index=None, search_after=None, tiebreak_sort=False):
         searches = []
         for search in self._index_searches.get(index_name, [self._search]):
             search = search.index(index_name)
@@ -383,22 +734,87 @@ class EsSearch(object):
                 if start_index is None:
                     start_index = end_index - num_results
 
-                search = search[start_index:end_index]
+                if tiebreak_sort:
+                    search = search.sort(*(self._sort + [VARIANT_ID_SORT_KEY]))
+                if search_after:
+                    # Resume after the last loaded hit instead of paging from the start of the index
+                    search = search.extra(search_after=search_after)[:end_index - start_index]
+                else:
+                    search = search[start_index:end_index]
                 search = search.source(QUERY_FIELD_NAMES)
                 logger.info('Loading {} records {}-{}'.format(index_name, start_index, end_index))
 
             searches.append(search)
         return searches
 
-    def _execute_search(self, search):
-        logger.debug(json.dumps(search.to_dict(), indent=2))
+    def _execute_search(self, search, opaque_id=None):
+        opaque_id = opaque_id or self._opaque_id
+        query_body = search.to_dict()
+        logger.info('ES query size for {}: {} bytes, genotype filter build: {:.1f} ms'.format(
+            opaque_id, len(json.dumps(query_body)), self._genotype_filter_build_ms))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(query_body, indent=2))
         try:
-            return search.using(self._client).execute()
+            return search.using(_OpaqueIdClient(self._client, opaque_id)).execute()
         except elasticsearch.exceptions.ConnectionTimeout as e:
-            canceled = self._delete_long_running_tasks()
-            logger.error('ES Query Timeout. Canceled {} long running searches'.format(canceled))
+            canceled = self._cancel_search_tasks(opaque_id)
+            logger.error('ES Query Timeout. Canceled {} searches for {}'.format(canceled, opaque_id))
             raise e
 
+    def _execute_index_searches(self, index_searches, deadline=None):
+        """Runs the searches for each index concurrently and returns (index name, response) for those returned in time.
+
+        Each index is searched with its own timeout. An index whose search does not return in time has its tasks
+        cancelled and is left out of the responses, and it is added to incomplete_indices along with any index that only
+        returned partial results. Follow up searches for more results can be given the deadline of the searches they
+        continue, so they do not extend the time spent on the index.
+        """
+        timeout = settings.ELASTICSEARCH_INDEX_SEARCH_TIMEOUT
+        if not deadline:
+            # Elasticsearch stops collecting hits at the search timeout, so the request should return shortly after it
+            deadline = time.time() + timeout + INDEX_SEARCH_TIMEOUT_BUFFER_SECONDS
+            self._index_search_deadline = deadline
+        pool = _get_es_search_pool()
+
+        async_results = []
+        for index_name, search in index_searches:
+            search = search.extra(timeout='{}s'.format(timeout)).params(
+                request_timeout=timeout + INDEX_SEARCH_TIMEOUT_BUFFER_SECONDS)
+            if settings.ELASTICSEARCH_INDEX_SEARCH_TERMINATE_AFTER:
+                search = search.extra(terminate_after=settings.ELASTICSEARCH_INDEX_SEARCH_TERMINATE_AFTER)
+            async_results.append(
+                (index_name, pool.apply_async(self._execute_index_search, (index_name, search, deadline))))
+
+        responses = []
+        for index_name, async_result in async_results:
+            try:
+                response = async_result.get(max(deadline - time.time(), 0))
+            except multiprocessing.TimeoutError:
+                canceled = self._cancel_search_tasks(self._get_index_opaque_id(index_name))
+                logger.error('ES Query Timeout for {}. Canceled {} searches'.format(index_name, canceled))
+                response = None
+
+            if response is None:
+                self.incomplete_indices.add(index_name)
+                continue
+            if response.timed_out or getattr(response, 'terminated_early', False):
+                logger.warn('ES returned partial results for {}'.format(index_name))
+                self.incomplete_indices.add(index_name)
+            responses.append((index_name, response))
+        return responses
+
+    def _execute_index_search(self, index_name, search, deadline):
+        if time.time() > deadline:
+            # The search waited for a free thread for longer than its timeout
+            return None
+        try:
+            return self._execute_search(search, opaque_id=self._get_index_opaque_id(index_name))
+        except elasticsearch.exceptions.ConnectionTimeout:
+            return None
+
+    def _get_index_opaque_id(self, index_name):
+        return '{}__{}'.format(self._opaque_id, index_name)
+
     def _parse_response(self, response):
         if hasattr(response.aggregations, 'genes') and response.hits:
             response_hits, response_total = self._parse_compound_het_response(response)
@@ -407,24 +823,19 @@ class EsSearch(object):
         response_total = response.hits.total
         logger.info('Total hits: {} ({} seconds)'.format(response_total, response.took / 1000.0))
 
-        return [self._parse_hit(hit) for hit in response], response_total, False
+        return self._parse_hits(response), response_total, False
 
     def _parse_compound_het_response(self, response):
-        if len(response.aggregations.genes.buckets) > MAX_COMPOUND_HET_GENES:
-            raise Exception('This search returned too many compound heterozygous variants. Please add stricter filters')
-
         index_name = response.hits[0].meta.index
-
-        family_unaffected_individual_guids = {
-            family_guid: {sample.individual.guid for sample in samples_by_id.values() if
-                          sample.individual.affected == UNAFFECTED}
-            for family_guid, samples_by_id in self.samples_by_family_index[index_name].items()
-        }
+        family_masks = _CompoundHetFamilyMasks(self.samples_by_family_index[index_name])
 
         variants_by_gene = {}
-        for gene_agg in response.aggregations.genes.buckets:
-            gene_variants = [self._parse_hit(hit) for hit in gene_agg['vars_by_gene']]
-            gene_id = gene_agg['key']
+        for gene_agg in self._iterate_compound_het_genes(index_name, response):
+            # Genes with a single variant are also returned, as the composite aggregation has no minimum doc count
+            if gene_agg['doc_count'] < 2:
+                continue
+            gene_variants = self._parse_hits(gene_agg['vars_by_gene'])
+            gene_id = gene_agg['key']['gene']
 
             if gene_id in variants_by_gene:
                 continue
@@ -459,27 +870,12 @@ class EsSearch(object):
                         if variant_ids == [variant['variantId'] for variant in variants_by_gene.get(gene, [])]:
                             continue
 
-            family_guids = set(gene_variants[0]['familyGuids'])
-            for variant in gene_variants[1:]:
-                family_guids = family_guids.intersection(set(variant['familyGuids']))
-
-            invalid_family_guids = set()
-            for family_guid in family_guids:
-                for individual_guid in family_unaffected_individual_guids[family_guid]:
-                    # To be compound het all unaffected individuals need to be hom ref for at least one of the variants
-                    is_family_compound_het = any(
-                        variant['genotypes'].get(individual_guid, {}).get('numAlt') != 1 for variant in
-                        gene_variants)
-                    if not is_family_compound_het:
-                        invalid_family_guids.add(family_guid)
-                        break
-
-            family_guids -= invalid_family_guids
+            family_guids = family_masks.get_compound_het_family_guids(gene_variants)
             if not family_guids:
                 continue
 
             for variant in gene_variants:
-                variant['familyGuids'] = list(family_guids)
+                variant['familyGuids'] = family_guids
 
             variants_by_gene[gene_id] = gene_variants
 
@@ -488,9 +884,51 @@ class EsSearch(object):
 
         return [{k: v} for k, v in variants_by_gene.items()], total_compound_het_results
 
+    def _iterate_compound_het_genes(self, index_name, response):
+        """Yields the gene buckets from every page of a compound het search, starting with the given response.
+
+        Each following page is only requested once the previous page has been consumed, so only one page of hits is held
+        at a time. Following pages share the deadline of the index's first search, and if it expires the index is marked
+        as incomplete and only the genes loaded so far are returned.
+        """
+        while True:
+            gene_buckets = response.aggregations.genes.buckets
+            for gene_agg in gene_buckets:
+                yield gene_agg
+            if len(gene_buckets) < COMPOUND_HET_GENES_PAGE_SIZE:
+                return
+
+            after = {'gene': gene_buckets[-1]['key']['gene']}
+            logger.info('Loading compound het genes for {} after {}'.format(index_name, after['gene']))
+            responses = self._execute_index_searches(
+                [(index_name, self._get_compound_het_search(index_name, after=after).index(index_name)[:1])],
+                deadline=self._index_search_deadline,
+            )
+            if not responses:
+                return
+            _, response = responses[0]
+
+    def _get_hit_parser(self, index_name):
+        hit_parser = self._hit_parsers.get(index_name)
+        if not hit_parser:
+            hit_parser = _HitParser(self.index_metadata[index_name])
+            self._hit_parsers[index_name] = hit_parser
+        return hit_parser
+
+    def _parse_hits(self, raw_hits):
+        raw_hits = list(raw_hits)
+        hits_by_index = defaultdict(list)
+        for raw_hit in raw_hits:
+            hits_by_index[raw_hit.meta.index].append(raw_hit)
+        for index_name, index_hits in hits_by_index.items():
+            self._get_hit_parser(index_name).lift_over(index_hits)
+        return [self._parse_hit(raw_hit) for raw_hit in raw_hits]
+
     def _parse_hit(self, raw_hit):
-        hit = {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
         index_name = raw_hit.meta.index
+        hit_parser = self._get_hit_parser(index_name)
+
+        hit = hit_parser.get_source(raw_hit)
         index_family_samples = self.samples_by_family_index[index_name]
 
         if hasattr(raw_hit.meta, 'matched_queries'):
@@ -507,66 +945,17 @@ class EsSearch(object):
         for family_guid in family_guids:
             samples_by_id = index_family_samples[family_guid]
             genotypes.update({
-                samples_by_id[genotype_hit['sample_id']].individual.guid: _get_field_values(genotype_hit, GENOTYPE_FIELDS_CONFIG)
+                samples_by_id[genotype_hit['sample_id']].individual.guid: hit_parser.parse_genotype(genotype_hit)
                 for genotype_hit in hit[GENOTYPES_FIELD_KEY] if genotype_hit['sample_id'] in samples_by_id
             })
 
-        genome_version = self.index_metadata[index_name].get('genomeVersion')
-        lifted_over_genome_version = None
-        lifted_over_chrom = None
-        lifted_over_pos = None
-        liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
-        if liftover_grch38_to_grch37 and genome_version == GENOME_VERSION_GRCh38:
-            if liftover_grch38_to_grch37:
-                grch37_coord = liftover_grch38_to_grch37.convert_coordinate(
-                    'chr{}'.format(hit['contig'].lstrip('chr')), int(hit['start'])
-                )
-                if grch37_coord and grch37_coord[0]:
-                    lifted_over_genome_version = GENOME_VERSION_GRCh37
-                    lifted_over_chrom = grch37_coord[0][0].lstrip('chr')
-                    lifted_over_pos = grch37_coord[0][1]
-
-        populations = {
-            population: _get_field_values(
-                hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
-                lookup_field_prefix=population,
-                existing_fields=self.index_metadata[index_name]['fields'],
-                get_addl_fields=lambda field, field_config:
-                [pop_config.get(field)] + ['{}_{}'.format(population, custom_field) for custom_field in
-                                           field_config.get('fields', [])],
-            )
-            for population, pop_config in POPULATIONS.items()
-        }
-
-        sorted_transcripts = [
-            {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
-            for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
-        ]
-        transcripts = defaultdict(list)
-        for transcript in sorted_transcripts:
-            transcripts[transcript['geneId']].append(transcript)
-
-        result = _get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
-        result.update({
-            field_name: _get_field_values(hit, fields, lookup_field_prefix=field_name)
-            for field_name, fields in NESTED_FIELDS.items()
-        })
+        result = hit_parser.parse(hit)
         if hasattr(raw_hit.meta, 'sort'):
-            result['_sort'] = [_parse_es_sort(sort, self._sort[i]) for i, sort in enumerate(raw_hit.meta.sort)]
+            result['_sort'] = [_parse_es_sort(sort, sort_config) for sort, sort_config in zip(raw_hit.meta.sort, self._sort)]
 
         result.update({
             'familyGuids': sorted(family_guids),
             'genotypes': genotypes,
-            'genomeVersion': genome_version,
-            'liftedOverGenomeVersion': lifted_over_genome_version,
-            'liftedOverChrom': lifted_over_chrom,
-            'liftedOverPos': lifted_over_pos,
-            'mainTranscript': sorted_transcripts[0] if len(sorted_transcripts) else {},
-            'populations': populations,
-            'predictions': _get_field_values(
-                hit, PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower()
-            ),
-            'transcripts': transcripts,
         })
         return result
 
@@ -653,14 +1042,28 @@ class EsSearch(object):
 
         return flattened_variant_results
 
-    def _delete_long_running_tasks(self):
-        search_tasks = self._client.tasks.list(actions='*search', group_by='parents')
-        canceled = 0
+    def _cancel_search_tasks(self, opaque_id):
+        """Cancels the running tasks started by this search's requests with the given opaque id or its index ids."""
+        return cancel_search_tasks(opaque_id, client=self._client)
+
+
+def new_search_opaque_id():
+    return 'seqr-search-{}'.format(uuid.uuid4().hex)
+
+
+def cancel_search_tasks(opaque_id, client=None):
+    """Cancels the running search tasks tagged with the given opaque id or any of its per-index ids."""
+    client = client or get_es_client()
+    canceled = 0
+    try:
+        search_tasks = client.tasks.list(actions='*search', group_by='parents')
         for parent_id, task in search_tasks['tasks'].items():
-            if task['running_time_in_nanos'] > 10 ** 11:
+            if task.get('headers', {}).get('X-Opaque-Id', '').startswith(opaque_id):
                 canceled += 1
-                self._client.tasks.cancel(parent_task_id=parent_id)
-        return canceled
+                client.tasks.cancel(parent_task_id=parent_id)
+    except elasticsearch.exceptions.TransportError as e:
+        logger.warn('Unable to cancel searches for {}: {}'.format(opaque_id, e))
+    return canceled
 
 
 def _variant_id_filter(xpos_ref_alt_tuples):
@@ -693,6 +1096,7 @@ GENOTYPE_QUERY_MAP = {
     HAS_ALT: {'allowed_num_alt': ['num_alt_1', 'num_alt_2']},
     HAS_REF: {'not_allowed_num_alt': ['no_call', 'num_alt_2']},
 }
+NUM_ALT_FIELDS = ['no_call', 'num_alt_1', 'num_alt_2']
 
 RECESSIVE = 'recessive'
 X_LINKED_RECESSIVE = 'x_linked_recessive'
@@ -723,43 +1127,8 @@ def _genotype_inheritance_filter(inheritance_mode, inheritance_filter, family_sa
 
     genotypes_q = None
     for family_guid in sorted(family_samples_by_id.keys()):
-        samples_by_id = family_samples_by_id[family_guid]
-        # Filter samples by quality
-        quality_q = None
-        if quality_filter.get('min_ab') or quality_filter.get('min_gq'):
-            quality_q = Q()
-            for sample_id in samples_by_id.keys():
-                if quality_filter['min_ab']:
-                    q = _build_or_filter('term', [
-                        {'samples_ab_{}_to_{}'.format(i, i + 5): sample_id} for i in range(0, quality_filter['min_ab'], 5)
-                    ])
-                    #  AB only relevant for hets
-                    quality_q &= ~Q(q) | ~Q('term', samples_num_alt_1=sample_id)
-                if quality_filter['min_gq']:
-                    quality_q &= ~Q(_build_or_filter('term', [
-                        {'samples_gq_{}_to_{}'.format(i, i + 5): sample_id} for i in range(0, quality_filter['min_gq'], 5)
-                    ]))
-
-        # Filter samples by inheritance
-        if inheritance_filter:
-            family_samples_q = _family_genotype_inheritance_filter(
-                inheritance_mode, inheritance_filter, samples_by_id
-            )
-
-            # For recessive search, should be hom recessive, x-linked recessive, or compound het
-            if inheritance_mode == RECESSIVE:
-                x_linked_q = _family_genotype_inheritance_filter(X_LINKED_RECESSIVE, inheritance_filter, samples_by_id)
-                family_samples_q |= x_linked_q
-        else:
-            # If no inheritance specified only return variants where at least one of the requested samples has an alt allele
-            sample_ids = samples_by_id.keys()
-            family_samples_q = Q('terms', samples_num_alt_1=sample_ids) | Q('terms', samples_num_alt_2=sample_ids)
-
-        sample_queries = [family_samples_q]
-        if quality_q:
-            sample_queries.append(quality_q)
-
-        family_samples_q = Q('bool', must=sample_queries, _name=family_guid)
+        family_samples_q = _get_family_genotype_filter(
+            family_guid, inheritance_mode, inheritance_filter, family_samples_by_id[family_guid], quality_filter)
         if not genotypes_q:
             genotypes_q = family_samples_q
         else:
@@ -768,6 +1137,82 @@ def _genotype_inheritance_filter(inheritance_mode, inheritance_filter, family_sa
     return genotypes_q
 
 
+def _get_family_genotype_filter(family_guid, inheritance_mode, inheritance_filter, samples_by_id, quality_filter):
+    """Returns the compiled genotype and quality filter for a family, reusing the cached filter if one exists.
+
+    Filters are cached by everything that goes in to them, including the affected status and sex of the family members,
+    so an edited individual gets a new filter. Elasticsearch_dsl combines queries by cloning them, so the same cached
+    query can safely be used in any number of searches.
+    """
+    affected_status = inheritance_filter.get('affected') or {}
+    genotypes = inheritance_filter.get('genotype') or {}
+    samples_key = tuple(sorted(
+        (sample_id, sample.individual.guid, affected_status.get(sample.individual.guid) or sample.individual.affected,
+         sample.individual.sex, genotypes.get(sample.individual.guid))
+        for sample_id, sample in samples_by_id.items()
+    ))
+    # The per-individual filters are already part of the sample key, but whether they are set at all changes the filter
+    mode_filter_key = tuple(sorted(
+        (key, None if key in {'affected', 'genotype'} else value) for key, value in inheritance_filter.items()
+    ))
+    cache_key = (
+        family_guid, inheritance_mode, mode_filter_key, samples_key, quality_filter.get('min_ab'), quality_filter.get('min_gq'),
+    )
+
+    with GENOTYPE_FILTER_CACHE_LOCK:
+        family_q = GENOTYPE_FILTER_CACHE.get(cache_key)
+    if family_q is None:
+        family_q = _compile_family_genotype_filter(
+            family_guid, inheritance_mode, inheritance_filter, samples_by_id, quality_filter)
+        with GENOTYPE_FILTER_CACHE_LOCK:
+            if len(GENOTYPE_FILTER_CACHE) >= GENOTYPE_FILTER_CACHE_SIZE:
+                GENOTYPE_FILTER_CACHE.clear()
+            GENOTYPE_FILTER_CACHE[cache_key] = family_q
+    return family_q
+
+
+def _compile_family_genotype_filter(family_guid, inheritance_mode, inheritance_filter, samples_by_id, quality_filter):
+    # Filter samples by quality
+    quality_q = None
+    if quality_filter.get('min_ab') or quality_filter.get('min_gq'):
+        sample_ids = sorted(samples_by_id.keys())
+        ab_qs = []
+        if quality_filter['min_ab']:
+            for sample_id in sample_ids:
+                q = _build_or_filter('term', [
+                    {'samples_ab_{}_to_{}'.format(i, i + 5): sample_id} for i in range(0, quality_filter['min_ab'], 5)
+                ])
+                #  AB only relevant for hets
+                ab_qs.append(~Q(q) | ~Q('term', samples_num_alt_1=sample_id))
+        # GQ is checked for every sample, so each bucket is a single query across all the samples in the family
+        gq_qs = [
+            _sample_terms_q('samples_gq_{}_to_{}'.format(i, i + 5), sample_ids)
+            for i in range(0, quality_filter['min_gq'], 5)
+        ]
+        quality_q = Q('bool', must=ab_qs, must_not=gq_qs)
+
+    # Filter samples by inheritance
+    if inheritance_filter:
+        family_samples_q = _family_genotype_inheritance_filter(
+            inheritance_mode, inheritance_filter, samples_by_id
+        )
+
+        # For recessive search, should be hom recessive, x-linked recessive, or compound het
+        if inheritance_mode == RECESSIVE:
+            x_linked_q = _family_genotype_inheritance_filter(X_LINKED_RECESSIVE, inheritance_filter, samples_by_id)
+            family_samples_q |= x_linked_q
+    else:
+        # If no inheritance specified only return variants where at least one of the requested samples has an alt allele
+        sample_ids = samples_by_id.keys()
+        family_samples_q = Q('terms', samples_num_alt_1=sample_ids) | Q('terms', samples_num_alt_2=sample_ids)
+
+    sample_queries = [family_samples_q]
+    if quality_q:
+        sample_queries.append(quality_q)
+
+    return Q('bool', must=sample_queries, _name=family_guid)
+
+
 def _family_genotype_inheritance_filter(inheritance_mode, inheritance_filter, samples_by_id):
     samples_q = Q()
 
@@ -785,7 +1230,10 @@ def _family_genotype_inheritance_filter(inheritance_mode, inheritance_filter, sa
             if individual_affected_status[individual.guid] == UNAFFECTED and individual.sex == Individual.SEX_MALE:
                 individual_genotype_filter[individual.guid] = REF_REF
 
-    for sample_id, sample in samples_by_id.items():
+    # A variant is excluded if any sample has any of its not allowed genotypes, so these are grouped in to a single
+    # terms query per genotype across samples
+    not_allowed_sample_ids = defaultdict(list)
+    for sample_id, sample in sorted(samples_by_id.items()):
 
         individual_guid = sample.individual.guid
         affected = individual_affected_status[individual_guid]
@@ -794,27 +1242,46 @@ def _family_genotype_inheritance_filter(inheritance_mode, inheritance_filter, sa
 
         if genotype:
             not_allowed_num_alt = GENOTYPE_QUERY_MAP[genotype].get('not_allowed_num_alt')
-            num_alt_to_filter = not_allowed_num_alt or GENOTYPE_QUERY_MAP[genotype].get('allowed_num_alt')
-            sample_filters = [{'samples_{}'.format(num_alt): sample_id} for num_alt in num_alt_to_filter]
-
-            sample_q = _build_or_filter('term', sample_filters)
             if not_allowed_num_alt:
-                sample_q = ~Q(sample_q)
+                for num_alt in not_allowed_num_alt:
+                    not_allowed_sample_ids[num_alt].append(sample_id)
+            else:
+                samples_q &= _build_or_filter('term', [
+                    {'samples_{}'.format(num_alt): sample_id}
+                    for num_alt in GENOTYPE_QUERY_MAP[genotype]['allowed_num_alt']
+                ])
 
-            samples_q &= sample_q
+    if not_allowed_sample_ids:
+        samples_q &= Q('bool', must_not=[
+            _sample_terms_q('samples_{}'.format(num_alt), not_allowed_sample_ids[num_alt])
+            for num_alt in NUM_ALT_FIELDS if not_allowed_sample_ids.get(num_alt)
+        ])
 
     return samples_q
 
 
+def _sample_terms_q(field, sample_ids):
+    if len(sample_ids) == 1:
+        return Q('term', **{field: sample_ids[0]})
+    return Q('terms', **{field: sample_ids})
+
+
 def _location_filter(genes, intervals, location_filter):
     q = None
     if intervals:
+        # Overlapping and adjacent intervals are merged so each covered region is a single range query
+        interval_index = IntervalIndex(
+            (interval['chrom'], interval['start'], interval['end'], None) for interval in intervals)
+        chroms = []
+        for interval in intervals:
+            if interval['chrom'] not in chroms:
+                chroms.append(interval['chrom'])
         q = _build_or_filter('range', [{
             'xpos': {
-                'gte': get_xpos(interval['chrom'], interval['start']),
-                'lte': get_xpos(interval['chrom'], interval['end'])
+                'gte': get_xpos(chrom, start),
+                'lte': get_xpos(chrom, end)
             }
-        } for interval in intervals])
+        } for chrom in chroms for start, end in interval_index.get_merged_intervals(chrom)])
 
     if genes:
         gene_q = Q('terms', geneIds=genes.keys())
@@ -1102,12 +1569,70 @@ for population, pop_config in POPULATIONS.items():
         QUERY_FIELD_NAMES += ['{}_{}'.format(population, custom_field) for custom_field in field_config.get('fields', [])]
 
 
+class _CompoundHetFamilyMasks(object):
+    """Bitsets for checking compound het constraints for every family in an index at once.
+
+    Each family and each unaffected individual is assigned a bit, so the families a group of variants is compound het
+    in are found by AND-ing per-variant masks instead of looping over every family and unaffected individual.
+    """
+
+    def __init__(self, samples_by_family):
+        self.family_bits = {}
+        self.unaffected_bits = {}
+        self.family_unaffected_masks = {}
+        for i, (family_guid, samples_by_id) in enumerate(sorted(samples_by_family.items())):
+            self.family_bits[family_guid] = 1 << i
+            self.family_unaffected_masks[family_guid] = 0
+            for sample in samples_by_id.values():
+                if sample.individual.affected == UNAFFECTED:
+                    bit = self.unaffected_bits.setdefault(sample.individual.guid, 1 << len(self.unaffected_bits))
+                    self.family_unaffected_masks[family_guid] |= bit
+        self._sorted_family_bits = sorted(self.family_bits.items())
+
+    def get_compound_het_family_guids(self, gene_variants):
+        """Returns the sorted families in which all the given variants form a valid compound het."""
+        family_mask = -1
+        unaffected_het_mask = -1
+        for variant in gene_variants:
+            family_mask &= self._get_family_mask(variant)
+            unaffected_het_mask &= self._get_unaffected_het_mask(variant)
+            if not family_mask:
+                return []
+
+        # To be compound het all unaffected individuals need to be hom ref for at least one of the variants, so a family
+        # is excluded if any of its unaffected individuals is het for every variant
+        return [
+            family_guid for family_guid, bit in self._sorted_family_bits
+            if family_mask & bit and not unaffected_het_mask & self.family_unaffected_masks[family_guid]
+        ]
+
+    def _get_family_mask(self, variant):
+        mask = 0
+        for family_guid in variant['familyGuids']:
+            mask |= self.family_bits.get(family_guid, 0)
+        return mask
+
+    def _get_unaffected_het_mask(self, variant):
+        mask = 0
+        for individual_guid, genotype in variant['genotypes'].items():
+            if genotype.get('numAlt') == 1:
+                mask |= self.unaffected_bits.get(individual_guid, 0)
+        return mask
+
+
 def _sort_compound_hets(grouped_variants):
     return sorted(grouped_variants, key=lambda variants: variants.values()[0][0]['_sort'])
 
 
-def _get_compound_het_page(grouped_variants, start_index, end_index):
-    skipped = 0
+def _merge_sorted_results(sorted_results):
+    # Duplicate variants from different indices have the same sort, so the variant ID keeps them adjacent
+    return (variant for _, _, _, variant in heapq.merge(*[
+        ((variant['_sort'], variant['variantId'], i, variant) for variant in results)
+        for i, results in enumerate(sorted_results)
+    ]))
+
+
+def _get_compound_het_page(grouped_variants, start_index, end_index, skipped=0):
     variant_results = []
     for i, variants in enumerate(grouped_variants):
         if skipped < start_index:
@@ -1119,18 +1644,6 @@ def _get_compound_het_page(grouped_variants, start_index, end_index):
     return None
 
 
-#  TODO move liftover to hail pipeline once upgraded to 0.2
-LIFTOVER_GRCH38_TO_GRCH37 = None
-def _liftover_grch38_to_grch37():
-    global LIFTOVER_GRCH38_TO_GRCH37
-    if not LIFTOVER_GRCH38_TO_GRCH37:
-        try:
-            LIFTOVER_GRCH38_TO_GRCH37 = LiftOver('hg38', 'hg19')
-        except Exception as e:
-            logger.warn('WARNING: Unable to set up liftover. {}'.format(e))
-    return LIFTOVER_GRCH38_TO_GRCH37
-
-
 def _parse_es_sort(sort, sort_config):
     if hasattr(sort_config, 'values') and any(cfg.get('order') == 'desc' for cfg in sort_config.values()):
         if sort == 'Infinity':
@@ -1151,21 +1664,113 @@ def _parse_es_sort(sort, sort_config):
     return sort
 
 
-def _get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
-    return {
-        field_config.get('response_key', format_response_key(field)): _value_if_has_key(
-            hit,
-            (get_addl_fields(field, field_config) if get_addl_fields else []) +
-            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
-            existing_fields=existing_fields,
-            **field_config
-        )
-        for field, field_config in field_configs.items()
-    }
+class _HitParser(object):
+    """Maps the source of raw hits from a single index to the variant response shape.
+
+    The response keys, lookup keys and missing values for every field depend only on the index's fields, so they are
+    compiled once per index instead of evaluating the field configs for every hit.
+    """
 
+    def __init__(self, index_metadata):
+        existing_fields = set(index_metadata['fields'])
+        self.genome_version = index_metadata.get('genomeVersion')
+        #  TODO move liftover to hail pipeline once upgraded to 0.2
+        self.liftover_grch38_to_grch37 = get_liftover(GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37) \
+            if self.genome_version == GENOME_VERSION_GRCh38 else None
 
-def _value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
-    for key in keys:
-        if key in hit:
-            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
-    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+        self.query_fields = set(QUERY_FIELD_NAMES)
+        self.core_fields = _compile_field_configs(CORE_FIELDS_CONFIG, format_response_key=str)
+        self.nested_fields = [
+            (field_name, _compile_field_configs(fields, lookup_field_prefix=field_name))
+            for field_name, fields in NESTED_FIELDS.items()
+        ]
+        self.population_fields = [
+            (population, _compile_field_configs(
+                POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+                lookup_field_prefix=population, existing_fields=existing_fields,
+                get_addl_fields=lambda field, field_config: [pop_config.get(field)] + [
+                    '{}_{}'.format(population, custom_field) for custom_field in field_config.get('fields', [])],
+            ))
+            for population, pop_config in POPULATIONS.items()
+        ]
+        self.prediction_fields = _compile_field_configs(
+            PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower())
+        self.genotype_fields = _compile_field_configs(GENOTYPE_FIELDS_CONFIG)
+        self.transcript_keys = {}
+
+    def get_source(self, raw_hit):
+        return {k: raw_hit[k] for k in raw_hit if k in self.query_fields}
+
+    def lift_over(self, hits):
+        """Converts the coordinates of all the given hits in one batch, so parsing each hit hits the liftover cache."""
+        if self.liftover_grch38_to_grch37:
+            self.liftover_grch38_to_grch37.convert_coordinates([(hit['contig'], hit['start']) for hit in hits])
+
+    def parse_genotype(self, genotype_hit):
+        return _get_compiled_field_values(genotype_hit, self.genotype_fields)
+
+    def parse(self, hit):
+        lifted_over_genome_version = None
+        lifted_over_chrom = None
+        lifted_over_pos = None
+        if self.liftover_grch38_to_grch37:
+            grch37_coord = self.liftover_grch38_to_grch37.convert_coordinate(hit['contig'], hit['start'])
+            if grch37_coord:
+                lifted_over_genome_version = GENOME_VERSION_GRCh37
+                lifted_over_chrom, lifted_over_pos = grch37_coord
+
+        sorted_transcripts = [self._parse_transcript(transcript) for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []]
+        transcripts = defaultdict(list)
+        for transcript in sorted_transcripts:
+            transcripts[transcript['geneId']].append(transcript)
+
+        result = _get_compiled_field_values(hit, self.core_fields)
+        result.update({
+            field_name: _get_compiled_field_values(hit, fields) for field_name, fields in self.nested_fields
+        })
+        result.update({
+            'genomeVersion': self.genome_version,
+            'liftedOverGenomeVersion': lifted_over_genome_version,
+            'liftedOverChrom': lifted_over_chrom,
+            'liftedOverPos': lifted_over_pos,
+            'mainTranscript': sorted_transcripts[0] if len(sorted_transcripts) else {},
+            'populations': {
+                population: _get_compiled_field_values(hit, fields) for population, fields in self.population_fields
+            },
+            'predictions': _get_compiled_field_values(hit, self.prediction_fields),
+            'transcripts': transcripts,
+        })
+        return result
+
+    def _parse_transcript(self, transcript):
+        transcript = transcript.to_dict()
+        for k in transcript.keys():
+            if k not in self.transcript_keys:
+                self.transcript_keys[k] = _to_camel_case(k)
+        return {self.transcript_keys[k]: v for k, v in transcript.items()}
+
+
+def _compile_field_configs(field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
+    compiled_fields = []
+    for field, field_config in field_configs.items():
+        keys = [key for key in (get_addl_fields(field, field_config) if get_addl_fields else []) if key] + \
+               ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field]
+        default_value = field_config.get('default_value')
+        missing_value = default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+        compiled_fields.append((
+            field_config.get('response_key', format_response_key(field)), keys, field_config.get('format_value'),
+            default_value, missing_value,
+        ))
+    return compiled_fields
+
+
+def _get_compiled_field_values(hit, compiled_fields):
+    values = {}
+    for response_key, keys, format_value, default_value, missing_value in compiled_fields:
+        values[response_key] = missing_value
+        for key in keys:
+            if key in hit:
+                value = hit[key]
+                values[response_key] = format_value(default_value if value is None else value) if format_value else value
+                break
+    return values
@@ -1,12 +1,17 @@
 from copy import deepcopy
+import elasticsearch
 import mock
 import json
+from multiprocessing.pool import ThreadPool
 
 from django.test import TestCase
 
 from seqr.models import Family, Sample, VariantSearch, VariantSearchResults
 from seqr.utils.es_utils import get_es_variants_for_variant_tuples, get_single_es_variant, get_es_variants, \
-    _genotype_inheritance_filter
+    iterate_es_variants, get_es_client, get_index_mappings, clear_index_mappings_cache, _genotype_inheritance_filter, \
+    get_latest_loaded_samples_by_family_index, reset_cached_loaded_samples, ES_CLIENTS, ES_CLIENT_CHECKOUTS, \
+    INDEX_MAPPINGS_LOCAL_CACHE, LOADED_SAMPLES_LOCAL_CACHE, VARIANT_ID_SORT_KEY, LoadedSample, LoadedSampleIndividual
+from seqr.utils.search_results_cache import SearchResultsCache
 
 INDEX_NAME = 'test_index'
 SECOND_INDEX_NAME = 'test_index_second'
@@ -675,20 +680,14 @@ COMPOUND_HET_INHERITANCE_QUERY = {
                 'must': [
                     {'bool': {
                         'must_not': [
-                            {'term': {'samples_no_call': 'HG00732'}},
-                            {'term': {'samples_num_alt_2': 'HG00732'}},
-                            {'term': {'samples_no_call': 'HG00733'}},
-                            {'term': {'samples_num_alt_2': 'HG00733'}}
+                            {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                            {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                         ],
                         'must': [{'term': {'samples_num_alt_1': 'HG00731'}}]
                     }},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00733'}},
+                        {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                        {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
                     ]}},
                 ]
             }},
@@ -716,32 +715,24 @@ RECESSIVE_INHERITANCE_QUERY = {
                         'should': [
                             {'bool': {
                                 'must_not': [
-                                    {'term': {'samples_no_call': 'HG00732'}},
-                                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                                    {'term': {'samples_no_call': 'HG00733'}},
-                                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                                 ],
                                 'must': [{'term': {'samples_num_alt_2': 'HG00731'}}]
                             }},
                             {'bool': {
                                 'must_not': [
-                                    {'term': {'samples_no_call': 'HG00732'}},
+                                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
                                     {'term': {'samples_num_alt_1': 'HG00732'}},
-                                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                                    {'term': {'samples_no_call': 'HG00733'}},
-                                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                                 ],
                                 'must': [{'match': {'contig': 'X'}}, {'term': {'samples_num_alt_2': 'HG00731'}}]
                             }}
                         ]
                     }},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00733'}},
+                        {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                        {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
                     ]}},
                 ]
             }},
@@ -770,25 +761,36 @@ RECESSIVE_INHERITANCE_QUERY = {
 REDIS_CACHE = {}
 def _set_cache(k, v):
     REDIS_CACHE[k] = v
+def _delete_cache(*keys):
+    for k in keys:
+        REDIS_CACHE.pop(k, None)
+def _incr_cache(k):
+    REDIS_CACHE[k] = str(int(REDIS_CACHE.get(k) or 0) + 1)
 MOCK_REDIS = mock.MagicMock()
 MOCK_REDIS.get.side_effect = REDIS_CACHE.get
 MOCK_REDIS.set.side_effect =_set_cache
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(k) for k in keys]
+MOCK_REDIS.incr.side_effect = _incr_cache
+MOCK_REDIS.delete.side_effect = _delete_cache
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
 
 
 class MockHit:
 
-    def __init__(self, matched_queries=None, _source=None, increment_sort=False, no_matched_queries=False, sort=None, index=INDEX_NAME):
+    def __init__(self, matched_queries=None, _source=None, increment_sort=False, no_matched_queries=False, sort_keys=None, index=INDEX_NAME):
         self.meta = mock.MagicMock()
         if no_matched_queries:
             del self.meta.matched_queries
         else:
             self.meta.matched_queries = matched_queries[index]
         self.meta.index = index
-        if sort or increment_sort:
+        if sort_keys or increment_sort:
             sort = _source['xpos']
             if increment_sort:
                 sort += 100
             self.meta.sort = [sort]
+            if VARIANT_ID_SORT_KEY in (sort_keys or []):
+                self.meta.sort.append(_source['variantId'])
         else:
             del self.meta.sort
         self._dict = _source
@@ -817,50 +819,64 @@ def create_mock_response(search, index=INDEX_NAME):
 
     mock_response = mock.MagicMock()
     mock_response.hits.total = 5
+    mock_response.timed_out = False
+    mock_response.terminated_early = False
     hits = []
     for index_name in sorted(indices):
         hits += [
-            MockHit(no_matched_queries=no_matched_queries, sort=search.get('sort'), index=index_name, **var)
+            MockHit(no_matched_queries=no_matched_queries, sort_keys=search.get('sort'), index=index_name, **var)
             for var in deepcopy(INDEX_ES_VARIANTS[index_name])
         ]
+    if search.get('search_after'):
+        hits = [hit for hit in hits if hit.meta.sort > search['search_after']]
     mock_response.__iter__.return_value = hits
     mock_response.hits.__getitem__.side_effect = hits.__getitem__
 
     if search.get('aggs'):
         index_vars = COMPOUND_HET_INDEX_VARIANTS.get(index, {})
+        genes_agg = search['aggs']['genes']['composite']
+        gene_ids = [
+            gene_id for gene_id in ['ENSG00000135953', 'ENSG00000228198']
+            if gene_id > genes_agg.get('after', {}).get('gene', '')
+        ][:genes_agg['size']]
         mock_response.aggregations.genes.buckets = [{
-            'key': gene_id,
+            'key': {'gene': gene_id},
+            'doc_count': len(index_vars.get(gene_id, ES_VARIANTS)),
             'vars_by_gene': [MockHit(increment_sort=True, index=index, **var) for var in deepcopy(index_vars.get(gene_id, ES_VARIANTS))]
-        } for gene_id in ['ENSG00000135953', 'ENSG00000228198']]
+        } for gene_id in gene_ids]
     else:
         del mock_response.aggregations.genes
     return mock_response
 
 
-@mock.patch('seqr.utils.es_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
 @mock.patch('seqr.utils.es_utils.get_index_metadata', lambda index_name, client: {k: {'genomeVersion': '37', 'fields': MAPPING_FIELDS} for k in index_name.split(',')})
 class EsUtilsTest(TestCase):
     fixtures = ['users', '1kg_project', 'reference_data']
 
     def setUp(self):
+        LOADED_SAMPLES_LOCAL_CACHE.clear()
         self.families = Family.objects.filter(guid__in=['F000003_3', 'F000002_2', 'F000005_5'])
         self.executed_search = None
         self.searched_indices = []
+        self.executed_index_searches = []
 
-        def mock_execute_search(search):
+        def mock_execute_search(search, opaque_id=None):
             self.executed_search = deepcopy(search.to_dict())
             self.searched_indices += search._index
-
-            if isinstance(self.executed_search, list):
-                return [create_mock_response(search, index=self.executed_search[i-1]['index'][0])
-                        for i, search in enumerate(self.executed_search) if search.get('query')]
-            else:
-                return create_mock_response(self.executed_search, index=self.searched_indices[0])
+            self.executed_index_searches.append((search._index, self.executed_search))
+            return create_mock_response(self.executed_search, index=search._index[0])
 
         patcher = mock.patch('seqr.utils.es_utils.EsSearch._execute_search')
-        patcher.start().side_effect = mock_execute_search
+        self.mock_execute_search = patcher.start()
+        self.mock_execute_search.side_effect = mock_execute_search
         self.addCleanup(patcher.stop)
 
+        # Run the concurrent index searches one at a time so they are executed in a consistent order
+        pool_patcher = mock.patch('seqr.utils.es_utils._get_es_search_pool', lambda: ThreadPool(1))
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+
     def assertExecutedSearch(self, filters=None, start_index=0, size=2, sort=None, gene_aggs=False, index=INDEX_NAME):
         self.assertIsInstance(self.executed_search, dict)
         self.assertEqual(self.searched_indices, [index])
@@ -869,15 +885,16 @@ class EsUtilsTest(TestCase):
         )
         self.executed_search = None
         self.searched_indices = []
+        self.executed_index_searches = []
 
     def assertExecutedSearches(self, searches):
-        self.assertIsInstance(self.executed_search, list)
-        self.assertEqual(len(self.executed_search), len(searches)*2)
-        for i, expected_search in enumerate(searches):
-            self.assertDictEqual(self.executed_search[i*2], {'index': [expected_search.get('index', INDEX_NAME)]})
-            self.assertSameSearch(self.executed_search[(i*2)+1], expected_search)
+        self.assertEqual(len(self.executed_index_searches), len(searches))
+        for (index, executed_search), expected_search in zip(self.executed_index_searches, searches):
+            self.assertListEqual(index, [expected_search.get('index', INDEX_NAME)])
+            self.assertSameSearch(executed_search, dict(expected_search, timeout='20s'))
         self.executed_search = None
         self.searched_indices = []
+        self.executed_index_searches = []
 
     def assertSameSearch(self, executed_search, expected_search_params):
         expected_search = {
@@ -893,9 +910,17 @@ class EsUtilsTest(TestCase):
         if expected_search_params.get('sort'):
             expected_search['sort'] = expected_search_params['sort']
 
+        if expected_search_params.get('search_after'):
+            expected_search['search_after'] = expected_search_params['search_after']
+
+        if expected_search_params.get('timeout'):
+            expected_search['timeout'] = expected_search_params['timeout']
+
         if expected_search_params.get('gene_aggs'):
             expected_search['aggs'] = {
-                'genes': {'terms': {'field': 'geneIds', 'min_doc_count': 2, 'size': 1001}, 'aggs': {
+                'genes': {'composite': {
+                    'sources': [{'gene': {'terms': {'field': 'geneIds'}}}], 'size': 1000,
+                }, 'aggs': {
                     'vars_by_gene': {
                         'top_hits': {'sort': expected_search_params['sort'], '_source': mock.ANY, 'size': 100}
                     }
@@ -910,7 +935,7 @@ class EsUtilsTest(TestCase):
         self.assertSetEqual(SOURCE_FIELDS, set(source))
 
     def assertCachedResults(self, results_model, expected_results, sort='xpos'):
-        self.assertDictEqual(json.loads(REDIS_CACHE.get('search_results__{}__{}'.format(results_model.guid, sort))), expected_results)
+        self.assertDictEqual(SearchResultsCache(results_model.guid, sort).load(), expected_results)
 
     def test_get_es_variants_for_variant_tuples(self):
         variants = get_es_variants_for_variant_tuples(
@@ -938,7 +963,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(self.families)
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertDictEqual(variants[0], PARSED_VARIANTS[0])
         self.assertDictEqual(variants[1], PARSED_VARIANTS[1])
@@ -949,31 +974,94 @@ class EsUtilsTest(TestCase):
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'])
 
         # does not save non-consecutive pages
-        variants, total_results = get_es_variants(results_model, page=3, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, page=3, num_results=2)
         self.assertEqual(total_results, 5)
         self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=2)
 
         # test pagination
-        variants, total_results = get_es_variants(results_model, page=2, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, page=2, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertEqual(total_results, 5)
         self.assertCachedResults(results_model, {'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5})
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=2, size=2)
 
         # test does not re-fetch page
-        variants, total_results = get_es_variants(results_model, page=1, num_results=3)
+        variants, total_results, _ = get_es_variants(results_model, page=1, num_results=3)
         self.assertIsNone(self.executed_search)
         self.assertEqual(len(variants), 3)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS[:1])
         self.assertEqual(total_results, 5)
 
         # test load_all
-        variants, _ = get_es_variants(results_model, page=1, load_all=True)
+        variants, _, _ = get_es_variants(results_model, page=1, load_all=True)
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=1)
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
+    @mock.patch('seqr.utils.search_results_cache.SEARCH_RESULTS_CHUNK_SIZE', 2)
+    def test_get_es_variants_cached_chunks(self):
+        search_model = VariantSearch.objects.create(search={})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+
+        get_es_variants(results_model, num_results=2)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'])
+        self.assertListEqual(
+            sorted(k for k in REDIS_CACHE.keys() if k.startswith(cache_key)),
+            [cache_key, '{}__all_results__0'.format(cache_key)])
+        header = json.loads(REDIS_CACHE[cache_key])
+        self.assertDictEqual(header['search_state'], {'total_results': 5})
+        self.assertEqual(header['lists']['all_results']['length'], 2)
+
+        MOCK_REDIS.set.reset_mock()
+        get_es_variants(results_model, page=2, num_results=2)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=2, size=2)
+        self.assertListEqual(
+            sorted(call[0][0] for call in MOCK_REDIS.set.call_args_list),
+            [cache_key, '{}__all_results__1'.format(cache_key)])
+
+        # only fetches the chunks needed for the requested page
+        MOCK_REDIS.mget.reset_mock()
+        variants, total_results, _ = get_es_variants(results_model, page=2, num_results=2)
+        self.assertIsNone(self.executed_search)
+        self.assertListEqual(variants, PARSED_VARIANTS)
+        self.assertEqual(total_results, 5)
+        MOCK_REDIS.mget.assert_called_once_with(['{}__all_results__1'.format(cache_key)])
+
+        # treats evicted chunks as a cache miss
+        REDIS_CACHE.pop('{}__all_results__0'.format(cache_key))
+        variants, total_results, _ = get_es_variants(results_model, page=1, num_results=2)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'])
+        self.assertListEqual(variants, PARSED_VARIANTS)
+        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
+
+    def test_iterate_es_variants(self):
+        search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(Family.objects.all())
+
+        variant_batches = list(iterate_es_variants(results_model, batch_size=3))
+        self.assertEqual(len(variant_batches), 1)
+        self.assertListEqual(variant_batches[0], [PARSED_VARIANTS[0], PARSED_MULTI_INDEX_VARIANT])
+
+        self.assertSetEqual(set(self.searched_indices), {INDEX_NAME, SECOND_INDEX_NAME})
+        self.assertListEqual(self.executed_search['sort'], ['xpos', 'variantId'])
+        self.assertEqual(self.executed_search['size'], 3)
+
+        # Each index is paged through after the full sort values of its last loaded hit
+        self.executed_index_searches = []
+        variant_batches = list(iterate_es_variants(results_model, batch_size=1))
+        self.assertListEqual(variant_batches, [[PARSED_VARIANTS[0]], [PARSED_MULTI_INDEX_VARIANT]])
+        self.assertListEqual(
+            sorted((index, search.get('search_after')) for index, search in self.executed_index_searches), [
+                ([INDEX_NAME], None),
+                ([INDEX_NAME], [2103343353, '2-103343353-GAGA-G']),
+                ([SECOND_INDEX_NAME], None),
+                ([SECOND_INDEX_NAME], [2103343353, '2-103343353-GAGA-G']),
+            ])
+
     def test_filtered_get_es_variants(self):
         search_model = VariantSearch.objects.create(search={
             'locus': {'rawItems': 'DDX11L1, chr2:1234-5678'},
@@ -999,7 +1087,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(self.families)
 
-        variants, total_results = get_es_variants(results_model, sort='protein_consequence', num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, sort='protein_consequence', num_results=2)
         self.assertListEqual(variants, PARSED_VARIANTS)
         self.assertEqual(total_results, 5)
 
@@ -1115,12 +1203,9 @@ class EsUtilsTest(TestCase):
                             {'bool': {
                                 'minimum_should_match': 1,
                                 'must_not': [
-                                    {'term': {'samples_no_call': 'HG00732'}},
-                                    {'term': {'samples_num_alt_1': 'HG00732'}},
-                                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                                    {'term': {'samples_no_call': 'HG00733'}},
-                                    {'term': {'samples_num_alt_1': 'HG00733'}},
-                                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                                    {'terms': {'samples_num_alt_1': ['HG00732', 'HG00733']}},
+                                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                                 ],
                                 'should': [
                                     {'term': {'samples_num_alt_1': 'HG00731'}},
@@ -1128,30 +1213,24 @@ class EsUtilsTest(TestCase):
                                 ]
                             }},
                             {'bool': {
-                                'minimum_should_match': 1,
-                                'should': [
-                                    {'bool': {
-                                        'must_not': [
-                                            {'term': {'samples_ab_0_to_5': 'HG00731'}},
-                                            {'term': {'samples_ab_5_to_10': 'HG00731'}},
-                                        ]
-                                    }},
-                                    {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'HG00731'}}]}}
-                                ],
                                 'must_not': [
-                                    {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00731'}},
-                                    {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00732'}},
-                                    {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00733'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00733'}},
+                                    {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                                    {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
+                                    {'terms': {'samples_gq_10_to_15': ['HG00731', 'HG00732', 'HG00733']}},
                                 ],
                                 'must': [
                                     {'bool': {
-                                        'minimum_should_match': 1,
+                                        'should': [
+                                            {'bool': {
+                                                'must_not': [
+                                                    {'term': {'samples_ab_0_to_5': 'HG00731'}},
+                                                    {'term': {'samples_ab_5_to_10': 'HG00731'}},
+                                                ]
+                                            }},
+                                            {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'HG00731'}}]}}
+                                        ]
+                                    }},
+                                    {'bool': {
                                         'should': [
                                             {'bool': {
                                                 'must_not': [
@@ -1163,7 +1242,6 @@ class EsUtilsTest(TestCase):
                                         ]
                                     }},
                                     {'bool': {
-                                        'minimum_should_match': 1,
                                         'should': [
                                             {'bool': {
                                                 'must_not': [
@@ -1186,21 +1264,22 @@ class EsUtilsTest(TestCase):
                                 {'term': {'samples_num_alt_2': 'NA20870'}}
                             ]}},
                             {'bool': {
-                                'minimum_should_match': 1,
-                                'should': [
-                                    {'bool': {
-                                        'must_not': [
-                                            {'term': {'samples_ab_0_to_5': 'NA20870'}},
-                                            {'term': {'samples_ab_5_to_10': 'NA20870'}},
-                                        ]
-                                    }},
-                                    {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'NA20870'}}]}}
-                                ],
                                 'must_not': [
                                     {'term': {'samples_gq_0_to_5': 'NA20870'}},
                                     {'term': {'samples_gq_5_to_10': 'NA20870'}},
                                     {'term': {'samples_gq_10_to_15': 'NA20870'}},
-                                ]
+                                ],
+                                'must': [{'bool': {
+                                    'should': [
+                                        {'bool': {
+                                            'must_not': [
+                                                {'term': {'samples_ab_0_to_5': 'NA20870'}},
+                                                {'term': {'samples_ab_5_to_10': 'NA20870'}},
+                                            ]
+                                        }},
+                                        {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'NA20870'}}]}}
+                                    ]
+                                }}]
                             }}
                         ],
                         '_name': 'F000003_3'
@@ -1218,7 +1297,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(self.families)
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertListEqual(variants, PARSED_COMPOUND_HET_VARIANTS)
         self.assertEqual(total_results, 2)
@@ -1240,6 +1319,52 @@ class EsUtilsTest(TestCase):
         get_es_variants(results_model, page=2, num_results=2)
         self.assertIsNone(self.executed_search)
 
+    @mock.patch('seqr.utils.es_utils.COMPOUND_HET_GENES_PAGE_SIZE', 1)
+    def test_compound_het_get_es_variants_gene_pages(self):
+        search_model = VariantSearch.objects.create(search={
+            'qualityFilter': {'min_gq': 10},
+            'annotations': {'other': []},
+            'inheritance': {'mode': 'compound_het'},
+        })
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
+        self.assertListEqual(variants, PARSED_COMPOUND_HET_VARIANTS)
+        self.assertEqual(total_results, 2)
+
+        # Each page of genes is requested after the last gene of the previous page
+        self.assertEqual(len(self.executed_index_searches), 3)
+        gene_aggs = [search['aggs']['genes']['composite'] for _, search in self.executed_index_searches]
+        self.assertListEqual([agg['size'] for agg in gene_aggs], [1, 1, 1])
+        self.assertListEqual(
+            [agg.get('after') for agg in gene_aggs], [None, {'gene': 'ENSG00000135953'}, {'gene': 'ENSG00000228198'}])
+        for index, search in self.executed_index_searches:
+            self.assertListEqual(index, [INDEX_NAME])
+            self.assertEqual(search['size'], 1)
+        self.executed_index_searches = []
+
+        # Following pages that do not return in time are skipped and the index is flagged as incomplete
+        execute_search = self.mock_execute_search.side_effect
+
+        def mock_execute_search(search, opaque_id=None):
+            response = execute_search(search, opaque_id=opaque_id)
+            if search.to_dict()['aggs']['genes']['composite'].get('after'):
+                raise elasticsearch.exceptions.ConnectionTimeout('TIMEOUT', 'timed out', None)
+            return response
+        self.mock_execute_search.side_effect = mock_execute_search
+
+        REDIS_CACHE.pop('search_results__{}__xpos'.format(results_model.guid))
+        variants, total_results, incomplete_indices = get_es_variants(results_model, num_results=2)
+        self.assertListEqual(
+            [(variant['variantId'], variant['mainTranscript']['geneId']) for variant in variants],
+            [('1-248367227-TC-T', 'ENSG00000135953'), ('2-103343353-GAGA-G', 'ENSG00000135953')])
+        self.assertEqual(total_results, 2)
+        self.assertListEqual(incomplete_indices, [INDEX_NAME])
+        self.assertEqual(len(self.executed_index_searches), 2)
+        self.assertCachedResults(results_model, {})
+        self.executed_index_searches = []
+
     def test_recessive_get_es_variants(self):
         search_model = VariantSearch.objects.create(search={
             'annotations': {'frameshift': ['frameshift_variant']},
@@ -1249,7 +1374,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(self.families)
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 3)
         self.assertDictEqual(variants[0], PARSED_VARIANTS[0])
         self.assertDictEqual(variants[1], PARSED_COMPOUND_HET_VARIANTS[0])
@@ -1261,7 +1386,7 @@ class EsUtilsTest(TestCase):
             'variant_results': [PARSED_VARIANTS[1]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 0,
-            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 2, 'total': 5}},
+            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']}},
             'total_results': 7,
         })
 
@@ -1269,7 +1394,7 @@ class EsUtilsTest(TestCase):
         pass_filter_query = {'bool': {'must_not': [{'exists': {'field': 'filters'}}]}}
 
         self.assertExecutedSearches([
-            dict(filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=2, sort=['xpos']),
+            dict(filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=2, sort=['xpos', 'variantId']),
             dict(
                 filters=[annotation_query, pass_filter_query, COMPOUND_HET_INHERITANCE_QUERY],
                 gene_aggs=True,
@@ -1281,23 +1406,26 @@ class EsUtilsTest(TestCase):
 
         # test pagination
 
-        variants, total_results = get_es_variants(results_model, page=3, num_results=2)
-        self.assertEqual(len(variants), 2)
-        self.assertListEqual(variants, PARSED_VARIANTS)
-        self.assertEqual(total_results, 6)
+        # No more hits are returned after the last loaded variant, so only the previously loaded variant is left
+        variants, total_results, _ = get_es_variants(results_model, page=3, num_results=2)
+        self.assertListEqual(variants, [PARSED_VARIANTS[1]])
+        self.assertEqual(total_results, 7)
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
             'variant_results': [],
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS},
-                {'null': [PARSED_VARIANTS[0]]}, {'null': [PARSED_VARIANTS[1]]}],
-            'duplicate_doc_count': 1,
-            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 4, 'total': 5}},
-            'total_results': 6,
+                {'null': [PARSED_VARIANTS[1]]}],
+            'duplicate_doc_count': 0,
+            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']}},
+            'total_results': 7,
         })
 
-        self.assertExecutedSearches([dict(filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], start_index=2, size=4, sort=['xpos'])])
+        self.assertExecutedSearches([dict(
+            filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=4,
+            sort=['xpos', 'variantId'], search_after=[2103343353, '2-103343353-GAGA-G'],
+        )])
 
         get_es_variants(results_model, page=2, num_results=2)
         self.assertIsNone(self.executed_search)
@@ -1307,7 +1435,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(Family.objects.filter(project__guid='R0001_1kg'))
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         self.assertListEqual(variants, PARSED_VARIANTS)
         self.assertEqual(total_results, 5)
 
@@ -1322,7 +1450,7 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(Family.objects.filter(guid__in=['F000011_11', 'F000003_3', 'F000002_2']))
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 3)
         self.assertDictEqual(variants[0], PARSED_VARIANTS[0])
         self.assertDictEqual(variants[1], PARSED_COMPOUND_HET_VARIANTS_PROJECT_2[0])
@@ -1335,9 +1463,9 @@ class EsUtilsTest(TestCase):
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2}],
             'duplicate_doc_count': 3,
             'loaded_variant_counts': {
-                SECOND_INDEX_NAME: {'loaded': 1, 'total': 5},
+                SECOND_INDEX_NAME: {'loaded': 1, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 4},
-                INDEX_NAME: {'loaded': 2, 'total': 5},
+                INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 2},
             },
             'total_results': 13,
@@ -1366,12 +1494,12 @@ class EsUtilsTest(TestCase):
                     ],
                     '_name': 'F000011_11'
                 }}
-            ], start_index=0, size=2, sort=['xpos'], index=SECOND_INDEX_NAME)
+            ], start_index=0, size=2, sort=['xpos', 'variantId'], index=SECOND_INDEX_NAME)
         project_1_search = dict(
             filters=[
                 annotation_query,
                 RECESSIVE_INHERITANCE_QUERY,
-            ], start_index=0, size=2, sort=['xpos'], index=INDEX_NAME)
+            ], start_index=0, size=2, sort=['xpos', 'variantId'], index=INDEX_NAME)
         self.assertExecutedSearches([
             project_2_search,
             dict(
@@ -1398,10 +1526,9 @@ class EsUtilsTest(TestCase):
         ])
 
         # test pagination
-        variants, total_results = get_es_variants(results_model, num_results=2, page=2)
-        self.assertEqual(len(variants), 3)
-        self.assertListEqual(variants, [PARSED_VARIANTS[0]] + PARSED_COMPOUND_HET_VARIANTS_MULTI_PROJECT)
-        self.assertEqual(total_results, 11)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2, page=2)
+        self.assertListEqual(variants, PARSED_COMPOUND_HET_VARIANTS_MULTI_PROJECT)
+        self.assertEqual(total_results, 13)
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
@@ -1409,30 +1536,73 @@ class EsUtilsTest(TestCase):
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]},
                 {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2},
-                {'null': [PARSED_VARIANTS[0]]},
                 {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS_MULTI_PROJECT}
             ],
-            'duplicate_doc_count': 5,
+            'duplicate_doc_count': 3,
             'loaded_variant_counts': {
-                SECOND_INDEX_NAME: {'loaded': 2, 'total': 5},
+                SECOND_INDEX_NAME: {'loaded': 1, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 4},
-                INDEX_NAME: {'loaded': 4, 'total': 5},
+                INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353, '2-103343353-GAGA-G']},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 2},
             },
-            'total_results': 11,
+            'total_results': 13,
         })
 
-        project_2_search['start_index'] = 1
         project_2_search['size'] = 3
-        project_1_search['start_index'] = 2
+        project_2_search['search_after'] = [2103343353, '2-103343353-GAGA-G']
+        project_1_search['search_after'] = [2103343353, '2-103343353-GAGA-G']
         self.assertExecutedSearches([project_2_search, project_1_search])
 
+    def test_multi_project_get_es_variants_index_timeout(self):
+        search_model = VariantSearch.objects.create(search={
+            'annotations': {'frameshift': ['frameshift_variant']}, 'qualityFilter': {'min_gq': 10},
+        })
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(Family.objects.filter(guid__in=['F000011_11', 'F000003_3', 'F000002_2']))
+
+        execute_search = self.mock_execute_search.side_effect
+
+        def mock_execute_search(search, opaque_id=None):
+            response = execute_search(search, opaque_id=opaque_id)
+            if search._index == [SECOND_INDEX_NAME]:
+                raise elasticsearch.exceptions.ConnectionTimeout('TIMEOUT', 'timed out', None)
+            return response
+        self.mock_execute_search.side_effect = mock_execute_search
+
+        variants, total_results, incomplete_indices = get_es_variants(results_model, num_results=2)
+        self.assertListEqual(incomplete_indices, [SECOND_INDEX_NAME])
+        self.assertListEqual([variant['variantId'] for variant in variants], ['1-248367227-TC-T', '2-103343353-GAGA-G'])
+        self.assertEqual(total_results, 5)
+        # Each index is searched with its own opaque id so only its tasks are cancelled
+        opaque_ids = [call_args[1]['opaque_id'] for call_args in self.mock_execute_search.call_args_list]
+        self.assertTrue(opaque_ids[0].endswith('__{}'.format(SECOND_INDEX_NAME)))
+        self.assertTrue(opaque_ids[1].endswith('__{}'.format(INDEX_NAME)))
+        self.assertEqual(opaque_ids[0].split('__')[0], opaque_ids[1].split('__')[0])
+        self.executed_index_searches = []
+
+        # Incomplete results are not cached
+        self.assertCachedResults(results_model, {})
+
+        # Indices that only return partial results are included but still flagged
+        def mock_partial_execute_search(search, opaque_id=None):
+            response = execute_search(search, opaque_id=opaque_id)
+            response.timed_out = search._index == [INDEX_NAME]
+            return response
+        self.mock_execute_search.side_effect = mock_partial_execute_search
+
+        variants, total_results, incomplete_indices = get_es_variants(results_model, num_results=2)
+        self.assertListEqual(incomplete_indices, [INDEX_NAME])
+        self.assertListEqual([variant['variantId'] for variant in variants], ['1-248367227-TC-T', '2-103343353-GAGA-G'])
+        self.assertEqual(total_results, 9)
+        self.assertCachedResults(results_model, {})
+        self.executed_index_searches = []
+
     def test_multi_project_all_samples_all_inheritance_get_es_variants(self):
         search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(Family.objects.all())
 
-        variants, total_results = get_es_variants(results_model, num_results=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2)
         expected_variants = [PARSED_VARIANTS[0], PARSED_MULTI_INDEX_VARIANT]
         self.assertListEqual(variants, expected_variants)
         self.assertEqual(total_results, 4)
@@ -1451,7 +1621,7 @@ class EsUtilsTest(TestCase):
         )
 
         # test pagination
-        variants, total_results = get_es_variants(results_model, num_results=2, page=2)
+        variants, total_results, _ = get_es_variants(results_model, num_results=2, page=2)
         expected_variants = [PARSED_VARIANTS[0], PARSED_MULTI_INDEX_VARIANT]
         self.assertListEqual(variants, expected_variants)
         self.assertEqual(total_results, 3)
@@ -1499,12 +1669,9 @@ class EsUtilsTest(TestCase):
             'bool': {
                 'minimum_should_match': 1,
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00732'}},
-                    {'term': {'samples_num_alt_1': 'HG00732'}},
-                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_1': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                    {'terms': {'samples_num_alt_1': ['HG00732', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                 ],
                 'should': [
                     {'term': {'samples_num_alt_1': 'HG00731'}},
@@ -1517,12 +1684,9 @@ class EsUtilsTest(TestCase):
             'bool': {
                 'minimum_should_match': 1,
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00731'}},
-                    {'term': {'samples_num_alt_1': 'HG00731'}},
-                    {'term': {'samples_num_alt_2': 'HG00731'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_1': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00731', 'HG00733']}},
+                    {'terms': {'samples_num_alt_1': ['HG00731', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00731', 'HG00733']}}
                 ],
                 'should': [
                     {'term': {'samples_num_alt_1': 'HG00732'}},
@@ -1534,10 +1698,8 @@ class EsUtilsTest(TestCase):
         recessive_filter = {
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00732'}},
-                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                 ],
                 'must': [
                     {'term': {'samples_num_alt_2': 'HG00731'}}
@@ -1547,10 +1709,8 @@ class EsUtilsTest(TestCase):
         custom_affected_recessive_filter = {
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00731'}},
-                    {'term': {'samples_num_alt_2': 'HG00731'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00731', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00731', 'HG00733']}}
                 ],
                 'must': [
                     {'term': {'samples_num_alt_2': 'HG00732'}}
@@ -1571,10 +1731,8 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(inheritance_filter.to_dict(), {'bool': {'_name': 'F000002_2', 'must': [{
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00732'}},
-                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                 ],
                 'must': [
                     {'term': {'samples_num_alt_1': 'HG00731'}},
@@ -1585,10 +1743,8 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(inheritance_filter.to_dict(), {'bool': {'_name': 'F000002_2', 'must': [{
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00731'}},
-                    {'term': {'samples_num_alt_2': 'HG00731'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00731', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00731', 'HG00733']}}
                 ],
                 'must': [
                     {'term': {'samples_num_alt_1': 'HG00732'}},
@@ -1600,11 +1756,9 @@ class EsUtilsTest(TestCase):
         x_linked_filter = {
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00732'}},
+                    {'terms': {'samples_no_call': ['HG00732', 'HG00733']}},
                     {'term': {'samples_num_alt_1': 'HG00732'}},
-                    {'term': {'samples_num_alt_2': 'HG00732'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_num_alt_2': ['HG00732', 'HG00733']}}
                 ],
                 'must': [
                     {'match': {'contig': 'X'}},
@@ -1616,10 +1770,8 @@ class EsUtilsTest(TestCase):
         custom_affected_x_linked_filter = {
             'bool': {
                 'must_not': [
-                    {'term': {'samples_no_call': 'HG00731'}},
-                    {'term': {'samples_num_alt_2': 'HG00731'}},
-                    {'term': {'samples_no_call': 'HG00733'}},
-                    {'term': {'samples_num_alt_2': 'HG00733'}}
+                    {'terms': {'samples_no_call': ['HG00731', 'HG00733']}},
+                    {'terms': {'samples_num_alt_2': ['HG00731', 'HG00733']}}
                 ],
                 'must': [
                     {'match': {'contig': 'X'}},
@@ -1638,6 +1790,7 @@ class EsUtilsTest(TestCase):
 
         # recessive
         inheritance_filter = _genotype_inheritance_filter('recessive', {}, samples_by_id, {})
+        recessive_q = inheritance_filter
         self.assertDictEqual(inheritance_filter.to_dict(), {'bool': {'_name': 'F000002_2', 'must': [{
             'bool': {'should': [recessive_filter, x_linked_filter]}
         }]}})
@@ -1645,3 +1798,86 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(inheritance_filter.to_dict(), {'bool': {'_name': 'F000002_2', 'must': [{
             'bool': {'should': [custom_affected_recessive_filter, custom_affected_x_linked_filter]}
         }]}})
+
+        # compiled filters are reused for the same family and search
+        self.assertIs(_genotype_inheritance_filter('recessive', {}, samples_by_id, {}), recessive_q)
+        self.assertIsNot(
+            _genotype_inheritance_filter('recessive', {}, samples_by_id, {'min_ab': 0, 'min_gq': 5}), recessive_q)
+
+    @mock.patch('seqr.utils.es_utils.elasticsearch.Elasticsearch')
+    def test_get_es_client(self, mock_elasticsearch):
+        ES_CLIENTS.clear()
+        ES_CLIENT_CHECKOUTS.clear()
+        mock_elasticsearch.side_effect = lambda **kwargs: mock.MagicMock()
+
+        client = get_es_client()
+        self.assertIs(get_es_client(), client)
+        self.assertIsNot(get_es_client(timeout=10000), client)
+        self.assertEqual(mock_elasticsearch.call_count, 2)
+        self.assertEqual(ES_CLIENT_CHECKOUTS[('localhost', 30)], 2)
+        self.assertEqual(ES_CLIENT_CHECKOUTS[('localhost', 10000)], 1)
+        ES_CLIENTS.clear()
+
+    @mock.patch('seqr.utils.es_utils.Index')
+    def test_get_index_mappings(self, mock_index):
+        INDEX_MAPPINGS_LOCAL_CACHE.clear()
+        REDIS_CACHE.pop('index_mappings__{}'.format(INDEX_NAME), None)
+        mock_index.return_value.get_mapping.return_value = {INDEX_NAME: {'mappings': {'variant': {
+            '_meta': {'genomeVersion': '37'}, 'properties': {'samples_num_alt_1': {}, 'xpos': {}},
+        }}}}
+
+        mappings = get_index_mappings(INDEX_NAME, None)
+        self.assertListEqual(mappings.keys(), [INDEX_NAME])
+        self.assertDictEqual(mappings[INDEX_NAME]['meta'], {'genomeVersion': '37'})
+        self.assertSetEqual(set(mappings[INDEX_NAME]['fields']), {'samples_num_alt_1', 'xpos'})
+        mock_index.assert_called_with(INDEX_NAME, using=None)
+        self.assertDictEqual(json.loads(REDIS_CACHE['index_mappings__{}'.format(INDEX_NAME)]), mappings)
+
+        # Subsequent calls are served from the local and redis caches
+        self.assertDictEqual(get_index_mappings(INDEX_NAME, None), mappings)
+        INDEX_MAPPINGS_LOCAL_CACHE.clear()
+        self.assertDictEqual(get_index_mappings(INDEX_NAME, None), mappings)
+        self.assertEqual(mock_index.return_value.get_mapping.call_count, 1)
+
+        clear_index_mappings_cache(INDEX_NAME)
+        MOCK_REDIS.delete.assert_called_with('index_mappings__{}'.format(INDEX_NAME))
+        self.assertNotIn('index_mappings__{}'.format(INDEX_NAME), REDIS_CACHE)
+        get_index_mappings(INDEX_NAME, None)
+        self.assertEqual(mock_index.return_value.get_mapping.call_count, 2)
+
+        # Wildcard patterns are not cached, as clearing the cache for an index does not clear the patterns matching it
+        self.assertDictEqual(get_index_mappings('{}*'.format(INDEX_NAME), None), mappings)
+        mock_index.assert_called_with('{}*'.format(INDEX_NAME), using=None)
+        self.assertNotIn('index_mappings__{}*'.format(INDEX_NAME), REDIS_CACHE)
+        get_index_mappings('{}*'.format(INDEX_NAME), None)
+        self.assertEqual(mock_index.return_value.get_mapping.call_count, 4)
+        INDEX_MAPPINGS_LOCAL_CACHE.clear()
+
+    def test_get_latest_loaded_samples_by_family_index(self):
+        families = Family.objects.filter(guid__in=['F000002_2', 'F000003_3'])
+        expected_samples = {INDEX_NAME: {
+            'F000002_2': {
+                'HG00731': LoadedSample('HG00731', LoadedSampleIndividual('I000004_hg00731', 'A', 'F')),
+                'HG00732': LoadedSample('HG00732', LoadedSampleIndividual('I000005_hg00732', 'N', 'M')),
+                'HG00733': LoadedSample('HG00733', LoadedSampleIndividual('I000006_hg00733', 'N', 'F')),
+            },
+            'F000003_3': {
+                'NA20870': LoadedSample('NA20870', LoadedSampleIndividual('I000007_na20870', 'A', 'M')),
+            },
+        }}
+
+        with self.assertNumQueries(2):
+            samples_by_family_index = get_latest_loaded_samples_by_family_index(families)
+        self.assertDictEqual(samples_by_family_index, expected_samples)
+
+        # Returned mappings can be modified without affecting the cache
+        del samples_by_family_index[INDEX_NAME]['F000003_3']
+
+        with self.assertNumQueries(1):
+            samples_by_family_index = get_latest_loaded_samples_by_family_index(families)
+        self.assertDictEqual(samples_by_family_index, expected_samples)
+
+        reset_cached_loaded_samples([families.first().project_id])
+        with self.assertNumQueries(2):
+            samples_by_family_index = get_latest_loaded_samples_by_family_index(families)
+        self.assertDictEqual(samples_by_family_index, expected_samples)
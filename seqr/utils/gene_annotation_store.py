@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+
+import settings
+from reference_data.models import GeneInfo, GeneConstraint, Omim, dbNSFPGene, PrimateAI, MGI, \
+    GENE_ANNOTATIONS_VERSION_CACHE_KEY
+from seqr.utils.redis_utils import get_redis_client
+from seqr.views.utils.json_utils import _to_camel_case
+
+logger = logging.getLogger(__name__)
+
+
+def _json_keys(model_class):
+    return tuple(_to_camel_case(field) for field in model_class._meta.json_fields)
+
+
+class GeneAnnotationStore(object):
+    """Process-local copy of the gene reference data returned with search results.
+
+    Every table is loaded once into dicts of value tuples keyed by gene id, and the json for a gene is assembled from
+    these on request, so looking up any set of genes does not query the database. The json matches what
+    get_json_for_genes returns for the same annotations.
+    """
+
+    GENE_KEYS = _json_keys(GeneInfo)
+    DBNSFP_KEYS = _json_keys(dbNSFPGene)
+    OMIM_KEYS = _json_keys(Omim)
+    CONSTRAINT_KEYS = _json_keys(GeneConstraint)
+    PRIMATE_AI_KEYS = _json_keys(PrimateAI)
+
+    def __init__(self, version=None):
+        self.version = version
+
+        start = time.time()
+        gene_ids_by_db_id = {}
+        self._genes = {}
+        for row in GeneInfo.objects.values_list('id', *GeneInfo._meta.json_fields).iterator():
+            gene_ids_by_db_id[row[0]] = row[1]
+            self._genes[row[1]] = row[1:]
+
+        self._dbnsfp = self._load_first_by_gene(dbNSFPGene, gene_ids_by_db_id)
+        self._constraints = self._load_first_by_gene(GeneConstraint, gene_ids_by_db_id, order_by=['-mis_z', '-pLI'])
+        self._total_constraints = GeneConstraint.objects.count()
+        self._primate_ai = self._load_first_by_gene(PrimateAI, gene_ids_by_db_id)
+        self._mgi = {
+            gene_id: marker_id[0] for gene_id, marker_id in
+            self._load_first_by_gene(MGI, gene_ids_by_db_id, fields=['marker_id']).items()
+        }
+
+        omim = {}
+        for row in Omim.objects.order_by('id').values_list('gene', *Omim._meta.json_fields).iterator():
+            omim.setdefault(gene_ids_by_db_id[row[0]], []).append(row[1:])
+        self._omim = {gene_id: tuple(rows) for gene_id, rows in omim.items()}
+
+        logger.info('Loaded annotations for {} genes in {:.1f}s'.format(len(self._genes), time.time() - start))
+
+    @staticmethod
+    def _load_first_by_gene(model_class, gene_ids_by_db_id, fields=None, order_by=None):
+        annotations = {}
+        order_by = (order_by or []) + ['id']
+        rows = model_class.objects.order_by(*order_by).values_list('gene', *(fields or model_class._meta.json_fields))
+        for row in rows.iterator():
+            gene_id = gene_ids_by_db_id[row[0]]
+            if gene_id not in annotations:
+                annotations[gene_id] = row[1:]
+        return annotations
+
+    def get_genes(self, gene_ids, add_dbnsfp=False, add_omim=False, add_constraints=False, add_primate_ai=False,
+                  add_mgi=False):
+        """Returns the json keyed by gene id for the given gene ids that are in the store, or all genes if None."""
+        if gene_ids is None:
+            gene_ids = self._genes.keys()
+        genes = {}
+        for gene_id in gene_ids:
+            gene_values = self._genes.get(gene_id)
+            if gene_values is None:
+                continue
+            gene = dict(zip(self.GENE_KEYS, gene_values))
+            if add_dbnsfp:
+                gene.update(zip(self.DBNSFP_KEYS, self._dbnsfp.get(gene_id) or [None] * len(self.DBNSFP_KEYS)))
+            if add_primate_ai:
+                primate_ai = self._primate_ai.get(gene_id)
+                if primate_ai:
+                    gene['primateAi'] = dict(zip(self.PRIMATE_AI_KEYS, primate_ai))
+            if add_mgi:
+                gene['mgiMarkerId'] = self._mgi.get(gene_id)
+            if add_omim:
+                omim_rows = self._omim.get(gene_id, ())
+                gene['omimPhenotypes'] = [dict(zip(self.OMIM_KEYS, row)) for row in omim_rows if row[1]]
+                gene['mimNumber'] = omim_rows[0][0] if omim_rows else None
+            if add_constraints:
+                constraint = self._constraints.get(gene_id)
+                gene['constraints'] = dict(
+                    zip(self.CONSTRAINT_KEYS, constraint), totalGenes=self._total_constraints) if constraint else {}
+            genes[gene_id] = gene
+        return genes
+
+
+GENE_ANNOTATION_STORE = None
+GENE_ANNOTATION_STORE_LOCK = threading.Lock()
+LAST_VERSION_CHECK = {'time': None}
+
+
+def _get_gene_annotations_version():
+    try:
+        return get_redis_client().get(GENE_ANNOTATIONS_VERSION_CACHE_KEY)
+    except Exception as e:
+        logger.warn('Unable to fetch "{}" from redis: {}'.format(GENE_ANNOTATIONS_VERSION_CACHE_KEY, e))
+        return GENE_ANNOTATION_STORE.version if GENE_ANNOTATION_STORE else None
+
+
+def get_gene_annotation_store():
+    """Returns the loaded store, reloading it if the reference data has been updated since it was loaded.
+
+    The reference data update commands change the version in redis, which is checked at most once per
+    GENE_ANNOTATION_STORE_VERSION_CHECK_SECONDS.
+    """
+    global GENE_ANNOTATION_STORE
+    with GENE_ANNOTATION_STORE_LOCK:
+        now = time.time()
+        last_check = LAST_VERSION_CHECK['time']
+        check_interval = settings.GENE_ANNOTATION_STORE_VERSION_CHECK_SECONDS
+        if GENE_ANNOTATION_STORE and last_check and now - last_check < check_interval:
+            return GENE_ANNOTATION_STORE
+
+        version = _get_gene_annotations_version()
+        LAST_VERSION_CHECK['time'] = now
+        if not GENE_ANNOTATION_STORE or GENE_ANNOTATION_STORE.version != version:
+            GENE_ANNOTATION_STORE = GeneAnnotationStore(version=version)
+        return GENE_ANNOTATION_STORE
+
+
+def reset_gene_annotation_store():
+    global GENE_ANNOTATION_STORE
+    with GENE_ANNOTATION_STORE_LOCK:
+        GENE_ANNOTATION_STORE = None
+        LAST_VERSION_CHECK['time'] = None
@@ -0,0 +1,84 @@
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from reference_data.models import GeneInfo, GeneExpression
+from seqr.models import GeneNote
+from seqr.utils.gene_annotation_store import GeneAnnotationStore, get_gene_annotation_store, \
+    reset_gene_annotation_store
+from seqr.utils.gene_utils import get_genes, get_gene
+from seqr.views.utils.orm_to_json_utils import get_json_for_genes
+
+GENE_ANNOTATION_FLAGS = {
+    'add_dbnsfp': True, 'add_omim': True, 'add_constraints': True, 'add_primate_ai': True, 'add_mgi': True,
+}
+
+
+class GeneAnnotationStoreTest(TestCase):
+    fixtures = ['users', 'reference_data']
+
+    def setUp(self):
+        reset_gene_annotation_store()
+        self.addCleanup(reset_gene_annotation_store)
+
+    def test_get_genes(self):
+        store = GeneAnnotationStore()
+        expected_genes = {
+            gene['geneId']: gene for gene in get_json_for_genes(list(GeneInfo.objects.all()), **GENE_ANNOTATION_FLAGS)
+        }
+
+        with self.assertNumQueries(0):
+            genes = store.get_genes(None, **GENE_ANNOTATION_FLAGS)
+        self.assertDictEqual(genes, expected_genes)
+
+        gene_id = sorted(expected_genes.keys())[0]
+        with self.assertNumQueries(0):
+            genes = store.get_genes([gene_id, 'ENSG_INVALID'], add_omim=True)
+        self.assertListEqual(genes.keys(), [gene_id])
+        self.assertEqual(genes[gene_id]['omimPhenotypes'], expected_genes[gene_id]['omimPhenotypes'])
+        self.assertNotIn('constraints', genes[gene_id])
+
+    @mock.patch('seqr.utils.gene_annotation_store.settings.GENE_ANNOTATION_STORE_VERSION_CHECK_SECONDS', 0)
+    @mock.patch('seqr.utils.gene_annotation_store.get_redis_client')
+    def test_get_gene_annotation_store(self, mock_get_redis_client):
+        mock_get_redis_client.return_value.get.return_value = '1'
+        store = get_gene_annotation_store()
+        self.assertEqual(store.version, '1')
+        self.assertIs(get_gene_annotation_store(), store)
+
+        mock_get_redis_client.return_value.get.return_value = '2'
+        updated_store = get_gene_annotation_store()
+        self.assertIsNot(updated_store, store)
+        self.assertEqual(updated_store.version, '2')
+
+        # An unavailable redis keeps the loaded genes
+        mock_get_redis_client.return_value.get.side_effect = Exception('Connection refused')
+        self.assertIs(get_gene_annotation_store(), updated_store)
+
+    @mock.patch('seqr.utils.gene_annotation_store.get_redis_client')
+    def test_gene_utils(self, mock_get_redis_client):
+        mock_get_redis_client.return_value.get.return_value = '1'
+        user = User.objects.get(username='test_user')
+        gene_ids = sorted(GeneInfo.objects.values_list('gene_id', flat=True))[:2]
+        GeneNote.objects.create(gene_id=gene_ids[0], note='A note', created_by=user)
+        GeneExpression.objects.create(
+            gene=GeneInfo.objects.get(gene_id=gene_ids[0]), tissue_type='muscle', expression_values=[0.1, 2.5])
+
+        with override_settings(GENE_ANNOTATION_STORE_ENABLED=False):
+            expected_genes = get_genes(
+                gene_ids, user=user, add_notes=True, add_expression=True, **GENE_ANNOTATION_FLAGS)
+            expected_gene = get_gene(gene_ids[0], user)
+
+        # The store output, with notes and expression merged in from the database, matches the database output
+        with override_settings(GENE_ANNOTATION_STORE_ENABLED=True):
+            genes = get_genes(gene_ids, user=user, add_notes=True, add_expression=True, **GENE_ANNOTATION_FLAGS)
+            gene = get_gene(gene_ids[0], user)
+            with self.assertRaises(GeneInfo.DoesNotExist):
+                get_gene('ENSG_INVALID', user)
+
+        self.assertDictEqual(genes, expected_genes)
+        self.assertEqual(genes[gene_ids[0]]['notes'][0]['note'], 'A note')
+        self.assertListEqual(genes[gene_ids[1]]['notes'], [])
+        self.assertDictEqual(genes[gene_ids[0]]['expression'], {'muscle': [0.1, 2.5]})
+        self.assertDictEqual(genes[gene_ids[1]]['expression'], {})
+        self.assertDictEqual(gene, expected_gene)
@@ -1,14 +1,25 @@
 import re
 from collections import defaultdict
+from django.conf import settings
 from django.db.models import Q
 from django.db.models.functions import Length
 
-from reference_data.models import GeneInfo
+from reference_data.models import GeneInfo, GeneExpression
+from seqr.utils.gene_annotation_store import get_gene_annotation_store
 from seqr.utils.xpos_utils import get_xpos
-from seqr.views.utils.orm_to_json_utils import get_json_for_genes, get_json_for_gene
+from seqr.views.utils.orm_to_json_utils import get_json_for_genes, get_json_for_gene, \
+    get_json_for_gene_notes_by_gene_id
 
 
 def get_gene(gene_id, user):
+    if settings.GENE_ANNOTATION_STORE_ENABLED:
+        gene_json = get_genes(
+            [gene_id], user=user, add_dbnsfp=True, add_omim=True, add_constraints=True, add_notes=True,
+            add_expression=True, add_mgi=True).get(gene_id)
+        if not gene_json:
+            raise GeneInfo.DoesNotExist('GeneInfo matching query does not exist.')
+        return gene_json
+
     gene = GeneInfo.objects.get(gene_id=gene_id)
     gene_json = get_json_for_gene(
         gene, user=user, add_dbnsfp=True, add_omim=True, add_constraints=True, add_notes=True, add_expression=True, add_mgi=True
@@ -16,12 +27,28 @@ def get_gene(gene_id, user):
     return gene_json
 
 
-def get_genes(gene_ids, **kwargs):
+def get_genes(gene_ids, user=None, add_notes=False, add_expression=False, **kwargs):
+    if settings.GENE_ANNOTATION_STORE_ENABLED:
+        genes = get_gene_annotation_store().get_genes(gene_ids, **kwargs)
+        # Notes are user data and expression is too large to hold in memory, so these are still loaded per request
+        if add_notes:
+            gene_notes_json = get_json_for_gene_notes_by_gene_id(genes.keys(), user)
+            for gene_id, gene in genes.items():
+                gene['notes'] = gene_notes_json.get(gene_id, [])
+        if add_expression:
+            for gene in genes.values():
+                gene['expression'] = {}
+            for gene_id, tissue_type, expression_values in GeneExpression.objects.filter(
+                    gene__gene_id__in=genes.keys()).values_list('gene__gene_id', 'tissue_type', 'expression_values'):
+                genes[gene_id]['expression'][tissue_type] = expression_values
+        return genes
+
     gene_filter = {}
     if gene_ids is not None:
         gene_filter['gene_id__in'] = gene_ids
     genes = GeneInfo.objects.filter(**gene_filter)
-    return {gene['geneId']: gene for gene in get_json_for_genes(genes, **kwargs)}
+    return {gene['geneId']: gene for gene in get_json_for_genes(
+        genes, user=user, add_notes=add_notes, add_expression=add_expression, **kwargs)}
 
 
 def get_gene_ids_for_gene_symbols(gene_symbols):
@@ -0,0 +1,128 @@
+import threading
+from collections import defaultdict, OrderedDict
+
+from seqr.models import LocusListInterval
+
+MAX_CACHED_LOCUS_LIST_INDICES = 100
+
+
+class IntervalIndex(object):
+    """Finds the intervals containing a position with an augmented interval tree.
+
+    The intervals sorted by start form an implicit balanced binary tree, where the root of each range of intervals is
+    its middle interval, and every node stores the maximum end in its subtree. A query skips any subtree that ends
+    before the position or starts after it, so a single long interval does not make lookups scan the intervals around
+    it.
+
+    Intervals are (key, start, end, value) tuples with inclusive ends. Only intervals with the same key as the query are
+    searched, where the key identifies the reference sequence (i.e. the chromosome, or the genome version and
+    chromosome).
+    """
+
+    def __init__(self, intervals):
+        intervals_by_key = defaultdict(list)
+        for key, start, end, value in intervals:
+            intervals_by_key[key].append((int(start), int(end), value))
+
+        self._index = {}
+        for key, key_intervals in intervals_by_key.items():
+            key_intervals.sort(key=lambda interval: interval[:2])
+            ends = [interval[1] for interval in key_intervals]
+            max_ends = list(ends)
+            _set_subtree_max_ends(max_ends, 0, len(max_ends))
+            self._index[key] = (
+                [interval[0] for interval in key_intervals], ends, max_ends,
+                [interval[2] for interval in key_intervals],
+            )
+
+    def keys(self):
+        return self._index.keys()
+
+    def get_values(self, key, pos):
+        """Returns the values for the intervals containing the position, ordered by interval start."""
+        if key not in self._index:
+            return []
+        matched, _ = self._search(key, int(pos))
+        values = self._index[key][3]
+        return [values[i] for i in matched]
+
+    def _search(self, key, pos):
+        """Returns the indices of the intervals containing the position in order, and the number of nodes visited."""
+        starts, ends, max_ends, _ = self._index[key]
+        matched = []
+        visited = 0
+        # In-order traversal of the (start, end) ranges of the subtrees still to search, with a None marking a visited
+        # node whose own interval is next in order
+        stack = [(0, len(starts))]
+        while stack:
+            node = stack.pop()
+            if node[0] is None:
+                matched.append(node[1])
+                continue
+            lo, hi = node
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            visited += 1
+            if max_ends[mid] < pos:
+                continue
+            if starts[mid] <= pos:
+                stack.append((mid + 1, hi))
+                if ends[mid] >= pos:
+                    stack.append((None, mid))
+            stack.append((lo, mid))
+        return matched, visited
+
+    def get_merged_intervals(self, key):
+        """Returns the (start, end) of the fewest intervals covering the same positions as the intervals for the key."""
+        if key not in self._index:
+            return []
+        starts, ends, _, _ = self._index[key]
+        merged = []
+        for start, end in zip(starts, ends):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+
+def _set_subtree_max_ends(max_ends, lo, hi):
+    """Sets each node's maximum end to the largest end in its subtree, given the ends of the intervals in the range."""
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    for child_max_end in [_set_subtree_max_ends(max_ends, lo, mid), _set_subtree_max_ends(max_ends, mid + 1, hi)]:
+        if child_max_end is not None and child_max_end > max_ends[mid]:
+            max_ends[mid] = child_max_end
+    return max_ends[mid]
+
+
+LOCUS_LIST_INDICES = OrderedDict()
+LOCUS_LIST_INDICES_LOCK = threading.Lock()
+
+
+def get_locus_list_interval_index(locus_lists):
+    """Returns an IntervalIndex of the locus list guids for the intervals in the given locus lists, keyed by
+    (genome_version, chrom).
+
+    Indices are cached for each set of locus lists and their last modified dates, so editing a locus list or its
+    intervals gives it a new index.
+    """
+    cache_key = tuple(sorted((locus_list.id, locus_list.last_modified_date) for locus_list in locus_lists))
+    with LOCUS_LIST_INDICES_LOCK:
+        index = LOCUS_LIST_INDICES.pop(cache_key, None)
+        if index is not None:
+            LOCUS_LIST_INDICES[cache_key] = index
+            return index
+
+    index = IntervalIndex(
+        ((genome_version, chrom), start, end, locus_list_guid) for locus_list_guid, genome_version, chrom, start, end in
+        LocusListInterval.objects.filter(locus_list__in=locus_lists).values_list(
+            'locus_list__guid', 'genome_version', 'chrom', 'start', 'end')
+    )
+    with LOCUS_LIST_INDICES_LOCK:
+        LOCUS_LIST_INDICES[cache_key] = index
+        if len(LOCUS_LIST_INDICES) > MAX_CACHED_LOCUS_LIST_INDICES:
+            LOCUS_LIST_INDICES.popitem(last=False)
+    return index
@@ -0,0 +1,57 @@
+import random
+from django.test import TestCase
+
+from seqr.models import LocusList, LocusListInterval
+from seqr.utils.interval_index import IntervalIndex, get_locus_list_interval_index
+
+LOCUS_LIST_GUID = 'LL00049_pid_genes_autosomal_do'
+
+
+class IntervalIndexTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    def test_interval_index(self):
+        rand = random.Random(0)
+        intervals = []
+        for i in range(200):
+            start = rand.randint(1, 1000)
+            intervals.append((rand.choice(['1', '2']), start, start + rand.randint(0, 100), i))
+        interval_index = IntervalIndex(intervals)
+
+        for chrom in ['1', '2', 'X']:
+            for pos in range(0, 1110, 3):
+                expected = sorted(
+                    (start, end, value) for interval_chrom, start, end, value in intervals
+                    if interval_chrom == chrom and start <= pos <= end
+                )
+                self.assertListEqual(interval_index.get_values(chrom, pos), [value for _, _, value in expected])
+
+        # A long interval does not make lookups scan the intervals it overlaps
+        long_interval_index = IntervalIndex(
+            [('1', 1, 10**8, 'long')] + [('1', i * 1000, i * 1000 + 10, i) for i in range(1, 10001)])
+        self.assertListEqual(long_interval_index.get_values('1', 5000005), ['long', 5000])
+        self.assertListEqual(long_interval_index.get_values('1', 5000500), ['long'])
+        for pos in [5, 5000005, 5000500, 9999500, 20000000]:
+            _, visited = long_interval_index._search('1', pos)
+            self.assertLessEqual(visited, 60)
+
+        self.assertListEqual(IntervalIndex([
+            ('1', 10, 20, None), ('1', 5, 8, None), ('1', 21, 30, None), ('1', 40, 50, None), ('1', 42, 45, None),
+        ]).get_merged_intervals('1'), [(5, 8), (10, 30), (40, 50)])
+
+    def test_get_locus_list_interval_index(self):
+        locus_lists = list(LocusList.objects.filter(guid=LOCUS_LIST_GUID))
+        interval_index = get_locus_list_interval_index(locus_lists)
+
+        self.assertListEqual(interval_index.get_values(('37', '1'), 248367250), [LOCUS_LIST_GUID])
+        self.assertListEqual(interval_index.get_values(('38', '1'), 248367250), [])
+        self.assertListEqual(interval_index.get_values(('38', '3'), 25), [LOCUS_LIST_GUID])
+        self.assertIs(get_locus_list_interval_index(list(LocusList.objects.filter(guid=LOCUS_LIST_GUID))), interval_index)
+
+        # Editing the locus list gives it a new index
+        LocusListInterval.objects.create(
+            locus_list=locus_lists[0], genome_version='38', chrom='3', start=5000, end=6000)
+        locus_lists[0].save()
+        updated_index = get_locus_list_interval_index(locus_lists)
+        self.assertIsNot(updated_index, interval_index)
+        self.assertListEqual(updated_index.get_values(('38', '3'), 5500), [LOCUS_LIST_GUID])
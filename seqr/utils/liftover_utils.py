@@ -0,0 +1,149 @@
+import logging
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from pyliftover.liftover import LiftOver
+
+from reference_data.models import GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
+
+logger = logging.getLogger(__name__)
+
+
+LIFTOVER_CACHE_SIZE = 100000
+
+UCSC_GENOME_BUILDS = {
+    GENOME_VERSION_GRCh37: 'hg19',
+    GENOME_VERSION_GRCh38: 'hg38',
+}
+
+
+class ChainLiftover(object):
+    """Converts coordinates between genome builds using the blocks of a liftover chain file.
+
+    The blocks for every source chromosome are kept in flat lists sorted by start position, so a coordinate is lifted
+    with a binary search instead of an interval tree query, and a list of coordinates is converted in one pass ordered by
+    position. Converted coordinates are memoized in an LRU cache keyed by (chrom, pos), which is kept as two generations
+    of plain dicts since OrderedDict bookkeeping costs about as much as the lookup it saves. As with pyliftover, positions
+    are passed through without any change of base and the highest scoring chain wins when blocks overlap.
+    """
+
+    def __init__(self, chains, cache_size=LIFTOVER_CACHE_SIZE):
+        blocks_by_chrom = defaultdict(list)
+        for chain in chains:
+            target = (chain.target_name.lstrip('chr'), chain.target_strand, chain.target_size, chain.score)
+            for source_start, source_end, target_start in chain.blocks:
+                blocks_by_chrom[chain.source_name.lstrip('chr')].append((source_start, source_end, target_start, target))
+
+        self._block_index = {}
+        for chrom, blocks in blocks_by_chrom.items():
+            blocks.sort(key=lambda block: block[0])
+            # Blocks from different chains can overlap, so the maximum end seen so far bounds how far back a query needs
+            # to look for blocks that start earlier but still contain the position
+            max_ends = []
+            for _, source_end, _, _ in blocks:
+                max_ends.append(max(source_end, max_ends[-1]) if max_ends else source_end)
+            self._block_index[chrom] = (
+                [block[0] for block in blocks], [block[1] for block in blocks], max_ends,
+                [block[2] for block in blocks], [block[3] for block in blocks],
+            )
+
+        # Recently used coordinates are in the current generation, and once it holds half the cache size the previous
+        # generation is dropped, so only coordinates that have not been used since then are evicted
+        self._cache_generation_size = max(cache_size // 2, 1)
+        self._cache = {}
+        self._previous_cache = {}
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def from_liftover(cls, liftover, **kwargs):
+        return cls(liftover.chain_file.chains, **kwargs)
+
+    def convert_coordinate(self, chrom, pos):
+        """Returns the lifted (chrom, pos) for a single coordinate, or None if it can not be lifted."""
+        return self.convert_coordinates([(chrom, pos)])[0]
+
+    def convert_coordinates(self, coordinates):
+        """Returns the lifted (chrom, pos), or None if it can not be lifted, for each of the given (chrom, pos)."""
+        keys = [(chrom.lstrip('chr'), int(pos)) for chrom, pos in coordinates]
+
+        converted = {}
+        missing_by_chrom = defaultdict(set)
+        with self._cache_lock:
+            cache = self._cache
+            previous_cache = self._previous_cache
+            for key in keys:
+                if key in converted:
+                    continue
+                if key in cache:
+                    converted[key] = cache[key]
+                elif key in previous_cache:
+                    converted[key] = previous_cache[key]
+                    self._add_to_cache({key: converted[key]})
+                    cache = self._cache
+                else:
+                    missing_by_chrom[key[0]].add(key[1])
+
+        if missing_by_chrom:
+            lifted = {}
+            for chrom, positions in missing_by_chrom.items():
+                lifted.update(self._lift_sorted_positions(chrom, sorted(positions)))
+            converted.update(lifted)
+            with self._cache_lock:
+                self._add_to_cache(lifted)
+
+        return [converted[key] for key in keys]
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache = {}
+            self._previous_cache = {}
+
+    def _add_to_cache(self, lifted):
+        self._cache.update(lifted)
+        if len(self._cache) >= self._cache_generation_size:
+            self._previous_cache = self._cache
+            self._cache = {}
+
+    def _lift_sorted_positions(self, chrom, positions):
+        if chrom not in self._block_index:
+            return {(chrom, pos): None for pos in positions}
+        starts, ends, max_ends, target_starts, targets = self._block_index[chrom]
+
+        lifted = {}
+        lo = 0
+        for pos in positions:
+            # Positions are sorted, so each search only needs to consider blocks after the previous match
+            lo = bisect_right(starts, pos, lo)
+            best = None
+            i = lo - 1
+            while i >= 0 and max_ends[i] > pos:
+                if ends[i] > pos and (best is None or targets[i][3] > targets[best][3]):
+                    best = i
+                i -= 1
+
+            lifted_coord = None
+            if best is not None:
+                target_chrom, target_strand, target_size, _ = targets[best]
+                lifted_pos = target_starts[best] + (pos - starts[best])
+                if target_strand == '-':
+                    lifted_pos = target_size - 1 - lifted_pos
+                lifted_coord = (target_chrom, lifted_pos)
+            lifted[(chrom, pos)] = lifted_coord
+        return lifted
+
+
+LIFTOVERS = {}
+LIFTOVERS_LOCK = threading.Lock()
+
+
+def get_liftover(from_genome_version, to_genome_version):
+    """Returns the shared ChainLiftover between the given genome versions, or None if the chain file is unavailable."""
+    key = (from_genome_version, to_genome_version)
+    with LIFTOVERS_LOCK:
+        if not LIFTOVERS.get(key):
+            try:
+                LIFTOVERS[key] = ChainLiftover.from_liftover(
+                    LiftOver(UCSC_GENOME_BUILDS[from_genome_version], UCSC_GENOME_BUILDS[to_genome_version]))
+            except Exception as e:
+                logger.warn('WARNING: Unable to set up liftover. {}'.format(e))
+        return LIFTOVERS.get(key)
@@ -0,0 +1,61 @@
+from io import BytesIO
+from unittest import TestCase
+from pyliftover.liftover import LiftOver
+
+from seqr.utils.liftover_utils import ChainLiftover
+
+CHAIN_FILE = b"""chain 1000 chr1 1000 + 0 300 chr1 2000 + 100 450 1
+100 50 100
+150
+
+chain 500 chr1 1000 + 120 220 chr2 500 - 10 110 2
+100
+
+chain 2000 chrX 1000 + 900 950 chr5 100 + 0 50 3
+50
+
+"""
+
+
+class LiftoverUtilsTest(TestCase):
+
+    def setUp(self):
+        self.pyliftover = LiftOver(BytesIO(CHAIN_FILE))
+        self.liftover = ChainLiftover.from_liftover(self.pyliftover, cache_size=10)
+
+    def test_convert_coordinates(self):
+        coords = [(chrom, pos) for chrom in ['chr1', 'X'] for pos in range(1010)]
+        expected = []
+        for chrom, pos in coords:
+            lifted = self.pyliftover.convert_coordinate('chr{}'.format(chrom.lstrip('chr')), pos)
+            expected.append((lifted[0][0].lstrip('chr'), lifted[0][1]) if lifted else None)
+
+        self.assertListEqual(self.liftover.convert_coordinates(coords), expected)
+        self.assertListEqual(self.liftover.convert_coordinates(list(reversed(coords))), list(reversed(expected)))
+
+        self.assertEqual(self.liftover.convert_coordinate('1', 10), ('1', 110))
+        self.assertEqual(self.liftover.convert_coordinate('1', 130), ('2', 479))
+        self.assertEqual(self.liftover.convert_coordinate('chr1', 160), ('1', 310))
+        self.assertIsNone(self.liftover.convert_coordinate('1', 110))
+        self.assertIsNone(self.liftover.convert_coordinate('2', 10))
+
+    def test_cache(self):
+        def _cached_keys():
+            return set(self.liftover._cache.keys()) | set(self.liftover._previous_cache.keys())
+
+        self.assertListEqual(
+            self.liftover.convert_coordinates([('1', 10), ('chr1', 10), ('1', 11)]), [('1', 110), ('1', 110), ('1', 111)])
+        self.assertSetEqual(_cached_keys(), {('1', 10), ('1', 11)})
+
+        self.liftover.convert_coordinates([('1', 10)] + [('X', pos) for pos in range(900, 904)])
+        self.assertEqual(len(_cached_keys()), 6)
+
+        self.assertEqual(self.liftover.convert_coordinate('1', 11), ('1', 111))
+        self.liftover.convert_coordinates([('X', pos) for pos in range(904, 909)])
+        self.assertIn(('1', 11), _cached_keys())
+        self.assertNotIn(('1', 10), _cached_keys())
+        self.assertNotIn(('X', 900), _cached_keys())
+        self.assertIn(('X', 908), _cached_keys())
+
+        self.liftover.clear_cache()
+        self.assertSetEqual(_cached_keys(), set())
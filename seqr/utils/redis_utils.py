@@ -0,0 +1,39 @@
+import json
+import logging
+import redis
+
+from settings import REDIS_SERVICE_HOSTNAME
+
+logger = logging.getLogger(__name__)
+
+
+def get_redis_client():
+    return redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
+
+
+def safe_redis_get_json(cache_key):
+    try:
+        value = get_redis_client().get(cache_key)
+        return json.loads(value) if value else None
+    except Exception as e:
+        logger.warn('Unable to fetch "{}" from redis: {}'.format(cache_key, e))
+        return None
+
+
+def safe_redis_set_json(cache_key, value, expire=None, encoder=None):
+    try:
+        redis_client = get_redis_client()
+        redis_client.set(cache_key, json.dumps(value, cls=encoder))
+        if expire:
+            redis_client.expire(cache_key, expire)
+    except Exception as e:
+        logger.warn('Unable to write "{}" to redis: {}'.format(cache_key, e))
+
+
+def safe_redis_delete(*cache_keys):
+    if not cache_keys:
+        return
+    try:
+        get_redis_client().delete(*cache_keys)
+    except Exception as e:
+        logger.warn('Unable to delete {} from redis: {}'.format(', '.join(cache_keys), e))
@@ -0,0 +1,157 @@
+import json
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from django.db import connection
+
+import settings
+from seqr.models import VariantSearchResults
+from seqr.utils.es_utils import get_es_variants, cancel_search_tasks, new_search_opaque_id
+from seqr.utils.redis_utils import get_redis_client, safe_redis_get_json, safe_redis_set_json, safe_redis_delete
+from seqr.utils.search_results_cache import SearchResultsCache
+
+logger = logging.getLogger(__name__)
+
+
+# Prefetch state is kept in redis so it is shared by every server process, and each entry expires in case the process
+# that would have cleared it has died. Whether a page was prefetched is decided by whether it is in the results cache.
+CURRENT_SEARCH_KEY = 'search_prefetch__current_search__{user_id}'
+USER_PREFETCH_KEY = 'search_prefetch__user_prefetch__{user_id}'
+IN_FLIGHT_PREFETCH_KEY = 'search_prefetch__in_flight__{results_guid}__{sort}'
+PREFETCH_STATS_KEY = 'search_prefetch__stats__{stat}'
+
+CURRENT_SEARCH_SECONDS = 60 * 60 * 24
+IN_FLIGHT_PREFETCH_SECONDS = 60 * 5
+PREFETCH_STATS_SECONDS = 60 * 60 * 24 * 7
+PREFETCH_POLL_SECONDS = 0.25
+
+PREFETCH_STATS = ['scheduled', 'completed', 'cancelled', 'failed', 'hits', 'misses']
+
+PREFETCH_POOL = None
+PREFETCH_POOL_LOCK = threading.Lock()
+
+
+def _get_prefetch_pool():
+    global PREFETCH_POOL
+    with PREFETCH_POOL_LOCK:
+        if PREFETCH_POOL is None:
+            PREFETCH_POOL = ThreadPool(settings.SEARCH_PREFETCH_THREADS)
+    return PREFETCH_POOL
+
+
+def set_current_search(user, search_hash, sort):
+    """Records the search the user is viewing, and cancels any prefetch for their previous searches."""
+    search = [search_hash, sort]
+    safe_redis_set_json(CURRENT_SEARCH_KEY.format(user_id=user.id), search, expire=CURRENT_SEARCH_SECONDS)
+
+    user_prefetch_key = USER_PREFETCH_KEY.format(user_id=user.id)
+    user_prefetch = safe_redis_get_json(user_prefetch_key)
+    if user_prefetch and user_prefetch['search'] != search:
+        safe_redis_delete(user_prefetch_key)
+        canceled = cancel_search_tasks(user_prefetch['opaqueId'])
+        logger.info('Canceled {} prefetch searches for {}'.format(canceled, user_prefetch['opaqueId']))
+
+
+def wait_for_prefetched_page(results_model, sort, page, num_results):
+    """Waits for any prefetch still loading this search and records whether the requested page was prefetched.
+
+    Waiting keeps the request from loading the same results from elasticsearch a second time, and as the results are
+    cached once the prefetch finishes the request is then served from the cache.
+    """
+    in_flight_key = IN_FLIGHT_PREFETCH_KEY.format(results_guid=results_model.guid, sort=sort)
+    deadline = time.time() + settings.SEARCH_PREFETCH_WAIT_SECONDS
+    while safe_redis_get_json(in_flight_key) and time.time() < deadline:
+        time.sleep(PREFETCH_POLL_SECONDS)
+
+    if page == 1:
+        return
+    is_hit = SearchResultsCache(results_model.guid, sort).has_page(page, num_results)
+    _increment_stat('hits' if is_hit else 'misses')
+    stats = get_prefetch_stats()
+    logger.info('Search prefetch {} for page {} ({} of {} pages prefetched)'.format(
+        'hit' if is_hit else 'miss', page, stats['hits'], stats['hits'] + stats['misses']))
+
+
+def prefetch_next_page(results_model, user, sort, page, num_results, total_results):
+    """Loads the page after the given one into the search results cache in the background."""
+    if not settings.SEARCH_PREFETCH_ENABLED or page * num_results >= total_results:
+        return
+
+    next_page = page + 1
+    if SearchResultsCache(results_model.guid, sort).has_page(next_page, num_results):
+        return
+
+    opaque_id = new_search_opaque_id()
+    in_flight_key = IN_FLIGHT_PREFETCH_KEY.format(results_guid=results_model.guid, sort=sort)
+    try:
+        # Only one prefetch runs per search at a time across all processes, so it is claimed before it is queued
+        is_claimed = get_redis_client().set(
+            in_flight_key, json.dumps({'opaqueId': opaque_id}), ex=IN_FLIGHT_PREFETCH_SECONDS, nx=True)
+    except Exception as e:
+        logger.warn('Unable to write "{}" to redis: {}'.format(in_flight_key, e))
+        return
+    if not is_claimed:
+        return
+
+    search = [results_model.search_hash, sort]
+    safe_redis_set_json(
+        USER_PREFETCH_KEY.format(user_id=user.id), {'search': search, 'opaqueId': opaque_id},
+        expire=IN_FLIGHT_PREFETCH_SECONDS)
+    _get_prefetch_pool().apply_async(_prefetch_page, (
+        user.id, search, results_model.guid, sort, next_page, num_results, opaque_id,
+    ))
+    _increment_stat('scheduled')
+
+
+def get_prefetch_stats():
+    stats_keys = [PREFETCH_STATS_KEY.format(stat=stat) for stat in PREFETCH_STATS]
+    try:
+        values = get_redis_client().mget(stats_keys)
+    except Exception as e:
+        logger.warn('Unable to fetch "{}" from redis: {}'.format(', '.join(stats_keys), e))
+        values = [None] * len(stats_keys)
+    stats = {stat: int(value or 0) for stat, value in zip(PREFETCH_STATS, values)}
+    lookups = stats['hits'] + stats['misses']
+    stats['hitRate'] = float(stats['hits']) / lookups if lookups else None
+    return stats
+
+
+def _increment_stat(stat):
+    stat_key = PREFETCH_STATS_KEY.format(stat=stat)
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        pipeline.incr(stat_key)
+        pipeline.expire(stat_key, PREFETCH_STATS_SECONDS)
+        pipeline.execute()
+    except Exception as e:
+        logger.warn('Unable to write "{}" to redis: {}'.format(stat_key, e))
+
+
+def _is_current_search(user_id, search):
+    return safe_redis_get_json(CURRENT_SEARCH_KEY.format(user_id=user_id)) == search
+
+
+def _prefetch_page(user_id, search, results_guid, sort, page, num_results, opaque_id):
+    try:
+        if not _is_current_search(user_id, search):
+            _increment_stat('cancelled')
+            return
+
+        results_model = VariantSearchResults.objects.get(guid=results_guid)
+        get_es_variants(results_model, sort=sort, page=page, num_results=num_results, opaque_id=opaque_id)
+        _increment_stat('completed')
+    except Exception as e:
+        # The prefetch's search tasks are cancelled once the user moves on to a new search, which fails the search
+        if _is_current_search(user_id, search):
+            logger.warn('Unable to prefetch page {} of search {}: {}'.format(page, search[0], e))
+            _increment_stat('failed')
+        else:
+            _increment_stat('cancelled')
+    finally:
+        safe_redis_delete(IN_FLIGHT_PREFETCH_KEY.format(results_guid=results_guid, sort=sort))
+        user_prefetch_key = USER_PREFETCH_KEY.format(user_id=user_id)
+        if (safe_redis_get_json(user_prefetch_key) or {}).get('opaqueId') == opaque_id:
+            safe_redis_delete(user_prefetch_key)
+        # Threads in the pool outlive the request, so they must not hold on to their own database connection
+        connection.close()
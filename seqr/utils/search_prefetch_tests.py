@@ -0,0 +1,125 @@
+import json
+import mock
+from unittest import TestCase
+
+from seqr.utils.search_prefetch import prefetch_next_page, set_current_search, wait_for_prefetched_page, \
+    get_prefetch_stats
+from seqr.utils.search_results_cache import SearchResultsCache
+from seqr.views.utils.test_utils import MockRedis
+
+USER = mock.MagicMock(id=1)
+RESULTS_MODEL = mock.MagicMock(guid='VSR0000001_search', search_hash='abc123')
+IN_FLIGHT_KEY = 'search_prefetch__in_flight__VSR0000001_search__xpos'
+
+
+class _DeferredPool(object):
+    """Queues tasks until they are run, so tests control when a prefetch runs."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def apply_async(self, func, args):
+        self.tasks.append((func, args))
+
+    def run_tasks(self, *args):
+        tasks, self.tasks = self.tasks, []
+        for func, task_args in tasks:
+            func(*task_args)
+
+
+def _cache_results(results_model, sort='xpos', page=1, num_results=100, **kwargs):
+    SearchResultsCache(results_model.guid, sort).save({
+        'total_results': 250, 'all_results': [{'variantId': str(i)} for i in range(page * num_results)],
+    })
+    return [], 250, []
+
+
+@mock.patch('seqr.utils.search_prefetch.cancel_search_tasks')
+@mock.patch('seqr.utils.search_prefetch.VariantSearchResults')
+@mock.patch('seqr.utils.search_prefetch.get_es_variants')
+class SearchPrefetchTest(TestCase):
+
+    def setUp(self):
+        self.redis = MockRedis()
+        for module in ['seqr.utils.redis_utils', 'seqr.utils.search_prefetch', 'seqr.utils.search_results_cache']:
+            patcher = mock.patch('{}.get_redis_client'.format(module), return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.pool = _DeferredPool()
+        pool_patcher = mock.patch('seqr.utils.search_prefetch._get_prefetch_pool', return_value=self.pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+
+        # Another process finishes the prefetch while the request is waiting for it
+        sleep_patcher = mock.patch('seqr.utils.search_prefetch.time.sleep', side_effect=self.pool.run_tasks)
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_prefetch_next_page(self, mock_get_variants, mock_results_model, mock_cancel_search_tasks):
+        mock_results_model.objects.get.return_value = RESULTS_MODEL
+        mock_get_variants.side_effect = _cache_results
+
+        set_current_search(USER, 'abc123', 'xpos')
+        wait_for_prefetched_page(RESULTS_MODEL, 'xpos', 1, 100)
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 1, 100, 250)
+        self.assertTrue(IN_FLIGHT_KEY in self.redis.values)
+
+        # A prefetch already running for the search in any process is not started again
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 1, 100, 250)
+        self.assertEqual(len(self.pool.tasks), 1)
+
+        wait_for_prefetched_page(RESULTS_MODEL, 'xpos', 2, 100)
+        self.assertEqual(self.mock_sleep.call_count, 1)
+        self.assertFalse(IN_FLIGHT_KEY in self.redis.values)
+
+        mock_results_model.objects.get.assert_called_with(guid='VSR0000001_search')
+        mock_get_variants.assert_called_once_with(
+            RESULTS_MODEL, sort='xpos', page=2, num_results=100, opaque_id=mock.ANY)
+        self.assertTrue(mock_get_variants.call_args[1]['opaque_id'].startswith('seqr-search-'))
+
+        # Pages that are already cached or past the end of the results are not prefetched
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 1, 100, 250)
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 3, 100, 250)
+        self.assertListEqual(self.pool.tasks, [])
+        wait_for_prefetched_page(RESULTS_MODEL, 'xpos', 3, 100)
+
+        mock_cancel_search_tasks.assert_not_called()
+        self.assertDictEqual(get_prefetch_stats(), {
+            'scheduled': 1, 'completed': 1, 'cancelled': 0, 'failed': 0, 'hits': 1, 'misses': 1, 'hitRate': 0.5,
+        })
+
+    def test_superseded_prefetch(self, mock_get_variants, mock_results_model, mock_cancel_search_tasks):
+        set_current_search(USER, 'abc123', 'xpos')
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 1, 100, 250)
+        user_prefetch = json.loads(self.redis.values['search_prefetch__user_prefetch__1'])
+
+        set_current_search(USER, 'abc123', 'pathogenicity')
+        mock_cancel_search_tasks.assert_called_once_with(user_prefetch['opaqueId'])
+        wait_for_prefetched_page(RESULTS_MODEL, 'xpos', 2, 100)
+
+        mock_get_variants.assert_not_called()
+        self.assertDictEqual(get_prefetch_stats(), {
+            'scheduled': 1, 'completed': 0, 'cancelled': 1, 'failed': 0, 'hits': 0, 'misses': 1, 'hitRate': 0.0,
+        })
+        self.assertFalse(IN_FLIGHT_KEY in self.redis.values)
+        self.assertFalse('search_prefetch__user_prefetch__1' in self.redis.values)
+
+    def test_cancelled_running_prefetch(self, mock_get_variants, mock_results_model, mock_cancel_search_tasks):
+        mock_results_model.objects.get.return_value = RESULTS_MODEL
+
+        # The user starts a new search while the prefetch is running, which cancels its elasticsearch search
+        def _get_variants(*args, **kwargs):
+            set_current_search(USER, 'def456', 'xpos')
+            raise Exception('task cancelled')
+        mock_get_variants.side_effect = _get_variants
+
+        set_current_search(USER, 'abc123', 'xpos')
+        prefetch_next_page(RESULTS_MODEL, USER, 'xpos', 1, 100, 250)
+        self.pool.run_tasks()
+
+        mock_cancel_search_tasks.assert_called_once_with(mock_get_variants.call_args[1]['opaque_id'])
+        self.assertDictEqual(get_prefetch_stats(), {
+            'scheduled': 1, 'completed': 0, 'cancelled': 1, 'failed': 0, 'hits': 0, 'misses': 0, 'hitRate': None,
+        })
+        self.assertFalse(IN_FLIGHT_KEY in self.redis.values)
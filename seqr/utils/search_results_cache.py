@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import zlib
+
+from seqr.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_RESULTS_CACHE_KEY = 'search_results__{}__{}'
+SEARCH_RESULTS_CACHE_FORMAT_VERSION = 1
+SEARCH_RESULTS_CACHE_SECONDS = 60 * 60 * 24 * 7
+SEARCH_RESULTS_CHUNK_SIZE = 100
+
+RESULT_LIST_KEYS = ['all_results', 'grouped_results', 'compound_het_results', 'variant_results']
+GROUPED_RESULTS_KEY = 'grouped_results'
+
+
+class SearchResultsCache(object):
+    """Redis store for the loaded results of a single search and sort.
+
+    The small search state (totals, per-index counts) lives in a header entry and every list of loaded results is
+    split into fixed size, zlib compressed chunks, so returning an already loaded page only fetches the chunks it needs
+    and loading more results only rewrites the chunks that changed. All entries for a search share the same
+    expiration, and if any chunk has been evicted the whole search is treated as not cached.
+    """
+
+    def __init__(self, results_guid, sort):
+        self._cache_key = SEARCH_RESULTS_CACHE_KEY.format(results_guid, sort)
+        self._redis_client = None
+        self._header = {}
+        self._loaded = False
+        try:
+            self._redis_client = get_redis_client()
+            header = json.loads(self._redis_client.get(self._cache_key) or '{}')
+            if header.get('format_version') == SEARCH_RESULTS_CACHE_FORMAT_VERSION:
+                self._header = header
+        except Exception as e:
+            logger.warn('Unable to fetch "{}" from redis: {}'.format(self._cache_key, e))
+
+    @property
+    def total_results(self):
+        return self._header.get('search_state', {}).get('total_results')
+
+    def get_loaded_count(self, list_name):
+        return self._header.get('lists', {}).get(list_name, {}).get('length', 0)
+
+    def has_page(self, page, num_results):
+        """Returns whether the given page of results has been loaded, without fetching any of the result chunks."""
+        end_index = page * num_results
+        if self.total_results is not None:
+            end_index = min(end_index, self.total_results)
+        grouped_count = sum(
+            self._header.get('lists', {}).get(GROUPED_RESULTS_KEY, {}).get('chunk_variant_counts', []))
+        return bool(self._header) and (self.get_loaded_count('all_results') >= end_index or grouped_count >= end_index)
+
+    def get_results(self, start_index, end_index):
+        """Returns the given slice of the loaded results, or None if they are no longer cached."""
+        if end_index <= start_index:
+            return []
+        chunk_size = self._header['chunk_size']
+        chunk_indices = range(start_index // chunk_size, (end_index - 1) // chunk_size + 1)
+        chunks = self._fetch_chunks('all_results', chunk_indices)
+        if chunks is None:
+            return None
+        results = [result for chunk in chunks for result in chunk]
+        offset = chunk_indices[0] * chunk_size
+        return results[start_index - offset:end_index - offset]
+
+    def get_grouped_results(self, start_index, end_index):
+        """Returns the loaded compound het groups needed to build the given page of results.
+
+        Returns a tuple of the groups and the number of results in the groups preceding them, or None if the page is
+        not fully loaded or no longer cached.
+        """
+        chunk_variant_counts = self._header.get('lists', {}).get(GROUPED_RESULTS_KEY, {}).get('chunk_variant_counts', [])
+        skipped = 0
+        first_chunk = 0
+        while first_chunk < len(chunk_variant_counts) and skipped + chunk_variant_counts[first_chunk] < start_index:
+            skipped += chunk_variant_counts[first_chunk]
+            first_chunk += 1
+
+        loaded = skipped
+        last_chunk = first_chunk
+        while last_chunk < len(chunk_variant_counts):
+            loaded += chunk_variant_counts[last_chunk]
+            if loaded >= end_index:
+                break
+            last_chunk += 1
+        else:
+            return None
+
+        chunks = self._fetch_chunks(GROUPED_RESULTS_KEY, range(first_chunk, last_chunk + 1))
+        if chunks is None:
+            return None
+        return [group for chunk in chunks for group in chunk], skipped
+
+    def load(self):
+        """Returns the full search state, as expected by EsSearch's previous_search_results."""
+        if not self._header:
+            return {}
+        results = dict(self._header['search_state'])
+        for list_name, list_info in self._header['lists'].items():
+            chunks = self._fetch_chunks(list_name, range(len(list_info['chunks'])))
+            if chunks is None:
+                return {}
+            results[list_name] = [result for chunk in chunks for result in chunk]
+        self._loaded = True
+        return results
+
+    def save(self, results):
+        """Writes the search state, only rewriting the result chunks whose contents have changed."""
+        if not self._redis_client:
+            return
+
+        previous_lists = self._header.get('lists', {}) if self._loaded else {}
+        header = {
+            'format_version': SEARCH_RESULTS_CACHE_FORMAT_VERSION,
+            'chunk_size': SEARCH_RESULTS_CHUNK_SIZE,
+            'search_state': {k: v for k, v in results.items() if k not in RESULT_LIST_KEYS},
+            'lists': {},
+        }
+        chunks_to_write = {}
+        keys_to_delete = []
+        for list_name in RESULT_LIST_KEYS:
+            if results.get(list_name) is None:
+                continue
+            list_results = results[list_name]
+            previous_chunks = previous_lists.get(list_name, {}).get('chunks', [])
+            list_info = {'length': len(list_results), 'chunks': []}
+            if list_name == GROUPED_RESULTS_KEY:
+                list_info['chunk_variant_counts'] = []
+
+            for chunk_index, i in enumerate(range(0, len(list_results), SEARCH_RESULTS_CHUNK_SIZE)):
+                chunk = list_results[i:i + SEARCH_RESULTS_CHUNK_SIZE]
+                # Keys are sorted so a chunk reloaded from redis has the same checksum as when it was written
+                serialized_chunk = json.dumps(chunk, sort_keys=True)
+                checksum = hashlib.md5(serialized_chunk).hexdigest()
+                if chunk_index < len(previous_chunks) and previous_chunks[chunk_index]['checksum'] == checksum:
+                    list_info['chunks'].append(previous_chunks[chunk_index])
+                else:
+                    compressed_chunk = zlib.compress(serialized_chunk)
+                    chunks_to_write[self._chunk_key(list_name, chunk_index)] = compressed_chunk
+                    list_info['chunks'].append({'checksum': checksum, 'size': len(compressed_chunk)})
+                if list_name == GROUPED_RESULTS_KEY:
+                    list_info['chunk_variant_counts'].append(sum(len(group.values()[0]) for group in chunk))
+
+            keys_to_delete += [
+                self._chunk_key(list_name, chunk_index)
+                for chunk_index in range(len(list_info['chunks']), len(previous_chunks))
+            ]
+            header['lists'][list_name] = list_info
+
+        for list_name, list_info in previous_lists.items():
+            if list_name not in header['lists']:
+                keys_to_delete += [self._chunk_key(list_name, i) for i in range(len(list_info['chunks']))]
+
+        header['size_bytes'] = sum(
+            chunk['size'] for list_info in header['lists'].values() for chunk in list_info['chunks'])
+
+        try:
+            pipeline = self._redis_client.pipeline(transaction=False)
+            for key, value in chunks_to_write.items():
+                pipeline.set(key, value)
+            if keys_to_delete:
+                pipeline.delete(*keys_to_delete)
+            pipeline.set(self._cache_key, json.dumps(header))
+            for key in [self._cache_key] + self._all_chunk_keys(header):
+                pipeline.expire(key, SEARCH_RESULTS_CACHE_SECONDS)
+            pipeline.execute()
+        except Exception as e:
+            logger.warn('Unable to write "{}" to redis: {}'.format(self._cache_key, e))
+            return
+
+        logger.info('Cached search results "{}": {} chunks written, {} total bytes'.format(
+            self._cache_key, len(chunks_to_write), header['size_bytes']))
+        self._header = header
+
+    def _chunk_key(self, list_name, chunk_index):
+        return '{}__{}__{}'.format(self._cache_key, list_name, chunk_index)
+
+    def _all_chunk_keys(self, header):
+        return [
+            self._chunk_key(list_name, chunk_index)
+            for list_name, list_info in header['lists'].items() for chunk_index in range(len(list_info['chunks']))
+        ]
+
+    def _fetch_chunks(self, list_name, chunk_indices):
+        if not chunk_indices:
+            return []
+        try:
+            compressed_chunks = self._redis_client.mget([self._chunk_key(list_name, i) for i in chunk_indices])
+        except Exception as e:
+            logger.warn('Unable to fetch "{}" from redis: {}'.format(self._cache_key, e))
+            return None
+        if any(chunk is None for chunk in compressed_chunks):
+            logger.warn('Search results "{}" are no longer fully cached'.format(self._cache_key))
+            self._header = {}
+            return None
+        return [json.loads(zlib.decompress(chunk)) for chunk in compressed_chunks]
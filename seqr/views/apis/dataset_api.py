@@ -7,9 +7,10 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 
-from seqr.models import Individual, CAN_EDIT, Sample, Family
+from seqr.models import Individual, CAN_EDIT, Sample, Family, deferred_project_page_updates
 from seqr.model_utils import update_xbrowse_vcfffiles, find_matching_xbrowse_model
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
+from seqr.utils.es_utils import clear_index_mappings_cache, reset_cached_loaded_samples
 from seqr.views.utils.dataset_utils import match_sample_ids_to_sample_records, validate_index_metadata, \
     get_elasticsearch_index_samples, load_mapping_file, load_uploaded_mapping_file, validate_alignment_dataset_path
 from seqr.views.utils.json_utils import create_json_response
@@ -51,6 +52,8 @@ def add_variants_dataset_handler(request, project_guid):
             raise ValueError('"elasticsearchIndex" is required')
         elasticsearch_index = request_json['elasticsearchIndex'].strip()
 
+        # Indices may be reloaded under an existing name, so always validate against the current mapping
+        clear_index_mappings_cache(elasticsearch_index)
         sample_ids, index_metadata = get_elasticsearch_index_samples(elasticsearch_index)
         validate_index_metadata(index_metadata, project, elasticsearch_index)
         sample_type = index_metadata['sampleType']
@@ -120,8 +123,9 @@ def add_variants_dataset_handler(request, project_guid):
 
     families_to_update = [family for family in included_family_individuals.keys()
                           if family.analysis_status == Family.ANALYSIS_STATUS_WAITING_FOR_DATA]
-    for family in families_to_update:
-        update_model_from_json(family, {'analysis_status': Family.ANALYSIS_STATUS_ANALYSIS_IN_PROGRESS})
+    with deferred_project_page_updates():
+        for family in families_to_update:
+            update_model_from_json(family, {'analysis_status': Family.ANALYSIS_STATUS_ANALYSIS_IN_PROGRESS})
 
     response_json = _get_samples_json(matched_sample_id_to_sample_record, project_guid)
     response_json['familiesByGuid'] = {family.guid: {'analysisStatus': Family.ANALYSIS_STATUS_ANALYSIS_IN_PROGRESS}
@@ -210,16 +214,20 @@ def add_alignment_dataset_handler(request, project_guid):
 
 def _update_samples(matched_sample_id_to_sample_record, elasticsearch_index=None, dataset_path=None, sample_dataset_path_mapping=None):
     loaded_date = timezone.now()
-    for sample_id, sample in matched_sample_id_to_sample_record.items():
-        sample_update_json = {
-            'dataset_file_path': dataset_path or sample_dataset_path_mapping[sample_id],
-        }
-        if elasticsearch_index:
-            sample_update_json['elasticsearch_index'] = elasticsearch_index
-        if sample.sample_status != Sample.SAMPLE_STATUS_LOADED:
-            sample_update_json['sample_status'] = Sample.SAMPLE_STATUS_LOADED
-            sample_update_json['loaded_date'] = loaded_date
-        update_model_from_json(sample, sample_update_json)
+    with deferred_project_page_updates():
+        for sample_id, sample in matched_sample_id_to_sample_record.items():
+            sample_update_json = {
+                'dataset_file_path': dataset_path or sample_dataset_path_mapping[sample_id],
+            }
+            if elasticsearch_index:
+                sample_update_json['elasticsearch_index'] = elasticsearch_index
+            if sample.sample_status != Sample.SAMPLE_STATUS_LOADED:
+                sample_update_json['sample_status'] = Sample.SAMPLE_STATUS_LOADED
+                sample_update_json['loaded_date'] = loaded_date
+            update_model_from_json(sample, sample_update_json)
+
+    reset_cached_loaded_samples(
+        {sample.individual.family.project_id for sample in matched_sample_id_to_sample_record.values()})
 
 
 def _get_samples_json(matched_sample_id_to_sample_record, project_guid):
@@ -11,7 +11,8 @@ from django.views.decorators.csrf import csrf_exempt
 
 from reference_data.models import HumanPhenotypeOntology
 from seqr.model_utils import get_or_create_seqr_model, delete_seqr_model
-from seqr.models import Sample, Individual, Family, CAN_EDIT
+from seqr.models import Sample, Individual, Family, CAN_EDIT, deferred_project_page_updates
+from seqr.utils.es_utils import reset_cached_loaded_samples
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.pedigree_image_api import update_pedigree_images
 from seqr.views.apis.phenotips_api import delete_patient, PhenotipsException
@@ -347,64 +348,65 @@ def add_or_update_individuals_and_families(project, individual_records, user=Non
     families = {}
     updated_individuals = set()
     parent_updates = []
-    for i, record in enumerate(individual_records):
-        # family id will be in different places in the json depending on whether it comes from a flat uploaded file or from the nested individual object
-        family_id = record.get(JsonConstants.FAMILY_ID_COLUMN) or record.get('family', {}).get('familyId')
-        if not family_id:
-            raise ValueError("record #%s doesn't contain a 'familyId' key: %s" % (i, record))
-
-        if JsonConstants.INDIVIDUAL_ID_COLUMN not in record and 'individualGuid' not in record:
-            raise ValueError("record #%s doesn't contain an 'individualId' key: %s" % (i, record))
-
-        family = families.get(family_id)
-        if family:
-            created = False
-        else:
-            family, created = get_or_create_seqr_model(Family, project=project, family_id=family_id)
+    with deferred_project_page_updates():
+        for i, record in enumerate(individual_records):
+            # family id will be in different places in the json depending on whether it comes from a flat uploaded file or from the nested individual object
+            family_id = record.get(JsonConstants.FAMILY_ID_COLUMN) or record.get('family', {}).get('familyId')
+            if not family_id:
+                raise ValueError("record #%s doesn't contain a 'familyId' key: %s" % (i, record))
+
+            if JsonConstants.INDIVIDUAL_ID_COLUMN not in record and 'individualGuid' not in record:
+                raise ValueError("record #%s doesn't contain an 'individualId' key: %s" % (i, record))
+
+            family = families.get(family_id)
+            if family:
+                created = False
+            else:
+                family, created = get_or_create_seqr_model(Family, project=project, family_id=family_id)
 
-        if created:
-            logger.info("Created family: %s", family)
+            if created:
+                logger.info("Created family: %s", family)
 
-        # uploaded files do not have unique guid's so fall back to a combination of family and individualId
-        if record.get('individualGuid'):
-            individual_filters = {'guid': record['individualGuid']}
-        else:
-            individual_id = record.get(JsonConstants.PREVIOUS_INDIVIDUAL_ID_COLUMN) or record[JsonConstants.INDIVIDUAL_ID_COLUMN]
-            individual_filters = {'family': family, 'individual_id': individual_id}
+            # uploaded files do not have unique guid's so fall back to a combination of family and individualId
+            if record.get('individualGuid'):
+                individual_filters = {'guid': record['individualGuid']}
+            else:
+                individual_id = record.get(JsonConstants.PREVIOUS_INDIVIDUAL_ID_COLUMN) or record[JsonConstants.INDIVIDUAL_ID_COLUMN]
+                individual_filters = {'family': family, 'individual_id': individual_id}
 
-        individual, created = get_or_create_seqr_model(Individual, **individual_filters)
+            individual, created = get_or_create_seqr_model(Individual, **individual_filters)
 
-        if created:
-            record.update({
-                'caseReviewStatus': 'I',
-            })
+            if created:
+                record.update({
+                    'caseReviewStatus': 'I',
+                })
 
-        record['family'] = family
-        record.pop('familyId', None)
-        if individual.family != family:
-            families[individual.family.family_id] = individual.family
+            record['family'] = family
+            record.pop('familyId', None)
+            if individual.family != family:
+                families[individual.family.family_id] = individual.family
 
-        if record.get(JsonConstants.PREVIOUS_INDIVIDUAL_ID_COLUMN):
-            updated_individuals.update(individual.maternal_children.all())
-            updated_individuals.update(individual.paternal_children.all())
-            record['displayName'] = ''
+            if record.get(JsonConstants.PREVIOUS_INDIVIDUAL_ID_COLUMN):
+                updated_individuals.update(individual.maternal_children.all())
+                updated_individuals.update(individual.paternal_children.all())
+                record['displayName'] = ''
 
-        # Update the parent ids last, so if they are referencing updated individuals they will check for the correct ID
-        if record.get('maternalId') or record.get('paternalId'):
-            parent_updates.append({
-                'individual': individual,
-                'maternalId': record.pop('maternalId', None),
-                'paternalId': record.pop('paternalId', None),
-            })
+            # Update the parent ids last, so if they are referencing updated individuals they will check for the correct ID
+            if record.get('maternalId') or record.get('paternalId'):
+                parent_updates.append({
+                    'individual': individual,
+                    'maternalId': record.pop('maternalId', None),
+                    'paternalId': record.pop('paternalId', None),
+                })
 
-        update_individual_from_json(individual, record, allow_unknown_keys=True, user=user)
+            update_individual_from_json(individual, record, allow_unknown_keys=True, user=user)
 
-        updated_individuals.add(individual)
-        families[family.family_id] = family
+            updated_individuals.add(individual)
+            families[family.family_id] = family
 
-    for update in parent_updates:
-        individual = update.pop('individual')
-        update_individual_from_json(individual, update, user=user)
+        for update in parent_updates:
+            individual = update.pop('individual')
+            update_individual_from_json(individual, update, user=user)
 
     updated_families = list(families.values())
 
@@ -431,24 +433,26 @@ def delete_individuals(project, individual_guids):
     samples_to_delete = Sample.objects.filter(
         individual__family__project=project, individual__guid__in=individual_guids)
 
-    for sample in samples_to_delete:
-        logger.info("Deleting sample: %s" % sample)
-        sample.delete()
+    with deferred_project_page_updates():
+        for sample in samples_to_delete:
+            logger.info("Deleting sample: %s" % sample)
+            sample.delete()
+        reset_cached_loaded_samples([project.id])
 
-    families = {}
-    for individual in individuals_to_delete:
-        families[individual.family.family_id] = individual.family
-
-        # delete phenotips records
-        try:
-            delete_patient(project, individual)
-        except (PhenotipsException, ValueError) as e:
-            logger.error("Error: couldn't delete patient from phenotips: %s %s",
-                         individual.phenotips_eid,
-                         individual)
-
-        # delete Individual
-        delete_seqr_model(individual)
+        families = {}
+        for individual in individuals_to_delete:
+            families[individual.family.family_id] = individual.family
+
+            # delete phenotips records
+            try:
+                delete_patient(project, individual)
+            except (PhenotipsException, ValueError) as e:
+                logger.error("Error: couldn't delete patient from phenotips: %s %s",
+                             individual.phenotips_eid,
+                             individual)
+
+            # delete Individual
+            delete_seqr_model(individual)
 
 
     update_pedigree_images(families.values())
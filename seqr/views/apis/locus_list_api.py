@@ -186,3 +186,6 @@ def _update_locus_list_items(locus_list, genes_by_id, intervals, request_json, u
         )
         interval_guids.add(interval_model.guid)
     locus_list.locuslistinterval_set.exclude(guid__in=interval_guids).delete()
+
+    # Cached interval indices are keyed by the locus list last modified date
+    locus_list.save()
@@ -10,6 +10,7 @@ from django.views.decorators.csrf import csrf_exempt
 import settings
 from seqr.model_utils import get_or_create_seqr_model, delete_seqr_model
 from seqr.models import Project, Family, Individual, Sample, _slugify, CAN_EDIT, IS_OWNER
+from seqr.utils.es_utils import reset_cached_loaded_samples
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.phenotips_api import create_phenotips_user, _get_phenotips_uname_and_pwd_for_project
 from seqr.views.utils.json_utils import create_json_response
@@ -159,6 +160,7 @@ def delete_project(project):
     """
 
     Sample.objects.filter(individual__family__project=project).delete()
+    reset_cached_loaded_samples([project.id])
     for individual in Individual.objects.filter(family__project=project):
         delete_seqr_model(individual)
     for family in Family.objects.filter(project=project):
@@ -1,16 +1,16 @@
 import logging
 import json
-from collections import defaultdict
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
 
 from seqr.models import Individual, SavedVariant, VariantTagType, VariantTag, VariantNote, VariantFunctionalData,\
-    LocusListInterval, LocusListGene, Family, CAN_VIEW, CAN_EDIT
+    LocusListGene, Family, CAN_VIEW, CAN_EDIT
 from seqr.model_utils import create_seqr_model, delete_seqr_model
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.locus_list_api import get_project_locus_list_models
 from seqr.utils.gene_utils import get_genes
+from seqr.utils.interval_index import get_locus_list_interval_index
 from seqr.views.utils.json_to_orm_utils import update_model_from_json
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.orm_to_json_utils import get_json_for_saved_variants, get_json_for_variant_tag, \
@@ -66,7 +66,7 @@ def create_saved_variant_handler(request):
     ref = variant_json['ref']
     alt = variant_json['alt']
     # TODO remove project field from saved variants
-    saved_variant = SavedVariant.objects.create(
+    saved_variant = SavedVariant(
         xpos=xpos,
         xpos_start=xpos,
         xpos_end=xpos + len(ref) - 1,
@@ -74,8 +74,9 @@ def create_saved_variant_handler(request):
         alt=alt,
         family=family,
         project=family.project,
-        saved_variant_json=json.dumps(variant_json)
     )
+    saved_variant.set_saved_variant_json(variant_json)
+    saved_variant.save()
 
     if non_variant_json.get('note'):
         _create_variant_note(saved_variant, non_variant_json, request.user)
@@ -236,17 +237,18 @@ def _add_locus_lists(projects, variants, genes):
     for variant in variants:
         variant['locusListGuids'] = []
 
-    locus_list_intervals_by_chrom = defaultdict(list)
-    for interval in LocusListInterval.objects.filter(locus_list__in=locus_lists):
-        locus_list_intervals_by_chrom[interval.chrom].append(interval)
-    if locus_list_intervals_by_chrom:
-        for variant in variants:
-            for interval in locus_list_intervals_by_chrom[variant['chrom']]:
-                pos = variant['pos'] if variant['genomeVersion'] == interval.genome_version else variant['liftedOverPos']
-                if pos and interval.start <= int(pos) <= interval.end:
-                    variant['locusListGuids'].append(interval.locus_list.guid)
-
-    for locus_list_gene in LocusListGene.objects.filter(locus_list__in=locus_lists, gene_id__in=genes.keys()).prefetch_related('locus_list'):
-        genes[locus_list_gene.gene_id]['locusListGuids'].append(locus_list_gene.locus_list.guid)
+    interval_index = get_locus_list_interval_index(locus_lists)
+    genome_versions = {genome_version for genome_version, _ in interval_index.keys()}
+    for variant in variants:
+        for genome_version in genome_versions:
+            pos = variant['pos'] if variant['genomeVersion'] == genome_version else variant['liftedOverPos']
+            if pos:
+                for locus_list_guid in interval_index.get_values((genome_version, variant['chrom']), pos):
+                    if locus_list_guid not in variant['locusListGuids']:
+                        variant['locusListGuids'].append(locus_list_guid)
+
+    for gene_id, locus_list_guid in LocusListGene.objects.filter(
+            locus_list__in=locus_lists, gene_id__in=genes.keys()).values_list('gene_id', 'locus_list__guid'):
+        genes[gene_id]['locusListGuids'].append(locus_list_guid)
 
     return [locus_list.guid for locus_list in locus_lists]
\ No newline at end of file
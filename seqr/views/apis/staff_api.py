@@ -9,8 +9,9 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import prefetch_related_objects, Q, Prefetch, Max
 from django.utils import timezone
 
-from seqr.utils.es_utils import get_es_client, get_latest_loaded_samples
+from seqr.utils.es_utils import get_es_client, get_es_client_stats, get_latest_loaded_samples
 from seqr.utils.gene_utils import get_genes
+from seqr.utils.search_prefetch import get_prefetch_stats
 from seqr.utils.xpos_utils import get_chrom_pos
 
 from seqr.views.pages.project_page import get_project_variant_tag_types
@@ -105,6 +106,8 @@ def elasticsearch_status(request):
         'indices': indices,
         'diskStats': disk_status,
         'elasticsearchHost': ELASTICSEARCH_SERVER,
+        'clientConnectionPools': get_es_client_stats(),
+        'searchPrefetch': get_prefetch_stats(),
         'mongoProjects': mongo_projects,
         'errors': errors,
     })
@@ -518,12 +521,12 @@ def _generate_rows(project, loaded_samples_by_project_family, saved_variants_by_
 
         saved_variants_to_json = {}
         for variant in saved_variants:
-            if not variant.saved_variant_json:
+            if not variant.get_saved_variant_json():
                 errors.append("%s - variant annotation not found" % variant)
                 rows.append(row)
                 continue
 
-            saved_variant_json = variant_details(json.loads(variant.saved_variant_json), project, user=None)
+            saved_variant_json = variant_details(variant.get_saved_variant_json(), project, user=None)
 
             if not saved_variant_json['transcripts']:
                 errors.append("%s - no gene ids" % variant)
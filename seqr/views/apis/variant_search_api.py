@@ -1,3 +1,4 @@
+import itertools
 import json
 import jmespath
 from collections import defaultdict
@@ -9,13 +10,15 @@ from elasticsearch.exceptions import ConnectionTimeout
 
 from seqr.models import Project, Family, Individual, SavedVariant, VariantSearch, VariantSearchResults, Sample,\
     AnalysisGroup, ProjectCategory
-from seqr.utils.es_utils import get_es_variants, get_single_es_variant, InvalidIndexException, XPOS_SORT_KEY, \
-    PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY
+from seqr.utils.es_utils import get_es_variants, get_single_es_variant, iterate_es_variants, \
+    get_latest_loaded_samples_by_family_index, InvalidIndexException, XPOS_SORT_KEY, PATHOGENICTY_SORT_KEY, \
+    PATHOGENICTY_HGMD_SORT_KEY
+from seqr.utils.search_prefetch import prefetch_next_page, set_current_search, wait_for_prefetched_page
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.locus_list_api import get_project_locus_list_models
 from seqr.views.apis.saved_variant_api import _saved_variant_genes, _add_locus_lists
 from seqr.views.pages.project_page import get_project_variant_tag_types
-from seqr.views.utils.export_table_utils import export_table
+from seqr.views.utils.export_table_utils import export_table_stream
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.orm_to_json_utils import \
     get_json_for_variant_functional_data_tag_types, \
@@ -78,8 +81,11 @@ def query_variants_handler(request, search_hash):
 
     _check_results_permission(results_model, request.user)
 
+    set_current_search(request.user, search_hash, sort)
+    wait_for_prefetched_page(results_model, sort, page, per_page)
     try:
-        variants, total_results = get_es_variants(results_model, sort=sort, page=page, num_results=per_page)
+        variants, total_results, incomplete_indices = get_es_variants(
+            results_model, sort=sort, page=page, num_results=per_page)
     except InvalidIndexException as e:
         return create_json_response({}, status=400, reason=e.message)
     except ConnectionTimeout as e:
@@ -88,6 +94,10 @@ def query_variants_handler(request, search_hash):
     response = _process_variants(variants, results_model.families.all())
     response['search'] = _get_search_context(results_model)
     response['search']['totalResults'] = total_results
+    response['search']['incompleteIndices'] = incomplete_indices
+
+    if not incomplete_indices:
+        prefetch_next_page(results_model, request.user, sort, page, per_page, total_results)
 
     return create_json_response(response)
 
@@ -193,32 +203,25 @@ def export_variants_handler(request, search_hash):
 
     _check_results_permission(results_model, request.user)
 
-    family_ids_by_guid = {family.guid: family.family_id for family in results_model.families.all()}
-
-    variants, _ = get_es_variants(results_model, page=1, load_all=True)
-
-    saved_variants_by_guid = _get_saved_variants(variants)
-    saved_variants_by_family = defaultdict(dict)
-    for var in saved_variants_by_guid.values():
-        for family_guid in var['familyGuids']:
-            saved_variants_by_family[family_guid]['{}-{}-{}'.format(var['xpos'], var['ref'], var['alt'])] = var
+    families = results_model.families.all()
+    family_ids_by_guid = {family.guid: family.family_id for family in families}
 
-    max_families_per_variant = max([len(variant['familyGuids']) for variant in variants])
-    max_samples_per_variant = max([len(variant['genotypes']) for variant in variants])
-
-    rows = []
-    for variant in variants:
-        row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
-        for i in range(max_families_per_variant):
-            family_guid = variant['familyGuids'][i] if i < len(variant['familyGuids']) else ''
-            family_tags = saved_variants_by_family[family_guid].get('{}-{}-{}'.format(variant['xpos'], variant['ref'], variant['alt'])) or {}
-            family_tags['family_id'] = family_ids_by_guid.get(family_guid)
-            row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
-        genotypes = variant['genotypes'].values()
-        for i in range(max_samples_per_variant):
-            genotype = genotypes[i] if i < len(genotypes) else {}
-            row += [_get_field_value(genotype, config) for config in VARIANT_GENOTYPE_EXPORT_DATA]
-        rows.append(row)
+    variant_batches = iterate_es_variants(results_model)
+    buffered_batches = [next(variant_batches, [])]
+    next_batch = next(variant_batches, None)
+    if next_batch is None:
+        # All results fit in a single batch, so only include as many family and sample columns as are needed
+        max_families_per_variant = max([len(variant['familyGuids']) for variant in buffered_batches[0]] or [0])
+        max_samples_per_variant = max([len(variant['genotypes']) for variant in buffered_batches[0]] or [0])
+    else:
+        # The header is written before later batches are loaded, so include columns for every searched family and sample
+        buffered_batches.append(next_batch)
+        samples_by_family_index = get_latest_loaded_samples_by_family_index(families)
+        max_families_per_variant = len(
+            {family_guid for family_samples in samples_by_family_index.values() for family_guid in family_samples.keys()})
+        max_samples_per_variant = len({
+            sample.individual.guid for family_samples in samples_by_family_index.values()
+            for samples_by_id in family_samples.values() for sample in samples_by_id.values()})
 
     header = [config['header'] for config in VARIANT_EXPORT_DATA]
     for i in range(max_families_per_variant):
@@ -226,9 +229,36 @@ def export_variants_handler(request, search_hash):
     for i in range(max_samples_per_variant):
         header += ['{}_{}'.format(config['header'], i+1) for config in VARIANT_GENOTYPE_EXPORT_DATA]
 
+    rows = _get_variant_export_rows(
+        itertools.chain(buffered_batches, variant_batches), family_ids_by_guid, max_families_per_variant,
+        max_samples_per_variant,
+    )
+
     file_format = request.GET.get('file_format', 'tsv')
 
-    return export_table('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+    return export_table_stream('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+
+
+def _get_variant_export_rows(variant_batches, family_ids_by_guid, max_families_per_variant, max_samples_per_variant):
+    for variants in variant_batches:
+        saved_variants_by_guid = _get_saved_variants(variants)
+        saved_variants_by_family = defaultdict(dict)
+        for var in saved_variants_by_guid.values():
+            for family_guid in var['familyGuids']:
+                saved_variants_by_family[family_guid]['{}-{}-{}'.format(var['xpos'], var['ref'], var['alt'])] = var
+
+        for variant in variants:
+            row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
+            for i in range(max_families_per_variant):
+                family_guid = variant['familyGuids'][i] if i < len(variant['familyGuids']) else ''
+                family_tags = saved_variants_by_family[family_guid].get('{}-{}-{}'.format(variant['xpos'], variant['ref'], variant['alt'])) or {}
+                family_tags['family_id'] = family_ids_by_guid.get(family_guid)
+                row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
+            genotypes = variant['genotypes'].values()
+            for i in range(max_samples_per_variant):
+                genotype = genotypes[i] if i < len(genotypes) else {}
+                row += [_get_field_value(genotype, config) for config in VARIANT_GENOTYPE_EXPORT_DATA]
+            yield row
 
 
 def _get_field_value(value, config):
@@ -412,10 +442,22 @@ def _get_saved_variants(variants):
     if not variants:
         return {}
 
-    variant_q = Q()
+    # A single IN query on the indexed variant position finds the candidate saved variants, and only the exact matches
+    # are loaded with their tags
+    variant_family_guids = defaultdict(set)
     for variant in variants:
-        variant_q |= Q(xpos_start=variant['xpos'], ref=variant['ref'], alt=variant['alt'], family__guid__in=variant['familyGuids'])
-    saved_variants = SavedVariant.objects.filter(variant_q)
+        variant_family_guids[(variant['xpos'], variant['ref'], variant['alt'])].update(variant['familyGuids'])
+    candidate_saved_variants = SavedVariant.objects.filter(
+        xpos_start__in={xpos for xpos, _, _ in variant_family_guids.keys()},
+        family__guid__in=set.union(*variant_family_guids.values()),
+    ).values_list('id', 'xpos_start', 'ref', 'alt', 'family__guid')
+    saved_variant_ids = [
+        saved_variant_id for saved_variant_id, xpos, ref, alt, family_guid in candidate_saved_variants
+        if family_guid in variant_family_guids.get((xpos, ref, alt), set())
+    ]
+    if not saved_variant_ids:
+        return {}
+    saved_variants = SavedVariant.objects.filter(id__in=saved_variant_ids)
 
     variants_by_id = {'{}-{}-{}'.format(var['xpos'], var['ref'], var['alt']): var for var in variants}
     saved_variants_json = get_json_for_saved_variants(saved_variants, add_tags=True)
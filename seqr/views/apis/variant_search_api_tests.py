@@ -35,14 +35,16 @@ EXPECTED_VARIANTS[2]['locusListGuids'] = []
 
 def _get_es_variants(results_model, **kwargs):
     results_model.save()
-    return deepcopy(VARIANTS), len(VARIANTS)
+    return deepcopy(VARIANTS), len(VARIANTS), []
 
 
 class VariantSearchAPITest(TestCase):
     fixtures = ['users', '1kg_project', 'reference_data', 'variant_searches']
 
+    @mock.patch('seqr.views.apis.variant_search_api.prefetch_next_page')
+    @mock.patch('seqr.views.apis.variant_search_api.iterate_es_variants')
     @mock.patch('seqr.views.apis.variant_search_api.get_es_variants')
-    def test_query_variants(self, mock_get_variants):
+    def test_query_variants(self, mock_get_variants, mock_iterate_variants, mock_prefetch):
         url = reverse(query_variants_handler, args=[SEARCH_HASH])
         _check_login(self, url)
 
@@ -83,6 +85,7 @@ class VariantSearchAPITest(TestCase):
             'search': SEARCH,
             'projectFamilies': PROJECT_FAMILIES,
             'totalResults': 3,
+            'incompleteIndices': [],
         })
         self.assertSetEqual(
             set(response_json['savedVariantsByGuid'].keys()),
@@ -98,11 +101,13 @@ class VariantSearchAPITest(TestCase):
 
         results_model = VariantSearchResults.objects.get(search_hash=SEARCH_HASH)
         mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100)
+        mock_prefetch.assert_called_with(results_model, mock.ANY, 'xpos', 1, 100, 3)
 
         # Test pagination
         response = self.client.get('{}?page=3'.format(url))
         self.assertEqual(response.status_code, 200)
         mock_get_variants.assert_called_with(results_model, sort='xpos', page=3, num_results=100)
+        mock_prefetch.assert_called_with(results_model, mock.ANY, 'xpos', 3, 100, 3)
 
         # Test sort
         response = self.client.get('{}?sort=consequence'.format(url))
@@ -110,10 +115,11 @@ class VariantSearchAPITest(TestCase):
         mock_get_variants.assert_called_with(results_model, sort='consequence', page=1, num_results=100)
 
         # Test export
+        mock_iterate_variants.return_value = iter([deepcopy(VARIANTS)])
         export_url = reverse(export_variants_handler, args=[SEARCH_HASH])
         response = self.client.get(export_url)
         self.assertEqual(response.status_code, 200)
-        export_content = [row.split('\t') for row in response.content.rstrip('\n').split('\n')]
+        export_content = [row.split('\t') for row in ''.join(response.streaming_content).rstrip('\n').split('\n')]
         self.assertEqual(len(export_content), 4)
         self.assertListEqual(
             export_content[0],
@@ -128,7 +134,21 @@ class VariantSearchAPITest(TestCase):
              '', '1', 'Tier 1 - Novel gene and phenotype (None)|Review (None)', '', '2', '', '', 'NA19675', '1',
              '14,33', '50', '46.0', '0.702127659574', 'NA19679', '0', '45,0', '45', '99.0', '0.0'])
 
-        mock_get_variants.assert_called_with(results_model, page=1, load_all=True)
+        mock_iterate_variants.assert_called_with(results_model)
+
+        # Test export with multiple batches includes columns for all searched families and samples
+        mock_iterate_variants.return_value = iter([deepcopy(VARIANTS[:1]), deepcopy(VARIANTS[1:])])
+        response = self.client.get(export_url)
+        self.assertEqual(response.status_code, 200)
+        export_content = [row.split('\t') for row in ''.join(response.streaming_content).rstrip('\n').split('\n')]
+        self.assertEqual(len(export_content), 4)
+        self.assertEqual(len(export_content[0]), 54)
+        self.assertListEqual(export_content[0][-7:], ['ab_3', 'sample_id_4', 'num_alt_alleles_4', 'ad_4', 'dp_4', 'gq_4', 'ab_4'])
+        self.assertListEqual(export_content[1][:len(export_content[0]) - 12], [
+            '21', '3343353', 'GAGA', 'G', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+            '', '1', 'Tier 1 - Novel gene and phenotype (None)|Review (None)', '', '2', '', '', 'NA19675', '1',
+            '14,33', '50', '46.0', '0.702127659574', 'NA19679', '0', '45,0', '45', '99.0', '0.0'])
+        self.assertListEqual(export_content[3][-12:], [''] * 12)
 
     def test_search_context(self):
         search_context_url = reverse(search_context_handler)
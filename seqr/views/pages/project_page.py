@@ -2,20 +2,24 @@
 APIs used by the project page
 """
 
+import hashlib
 import logging
 import json
 
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q, Count
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 
 from seqr.models import Family, Individual, _slugify, VariantTagType, VariantTag, VariantFunctionalData, VariantNote, \
-    AnalysisGroup, Sample
+    AnalysisGroup, Sample, PROJECT_PAGE_VERSION_CACHE_KEY, PROJECT_PAGE_FAMILIES, PROJECT_PAGE_INDIVIDUALS, \
+    PROJECT_PAGE_SAMPLES, PROJECT_PAGE_ANALYSIS_GROUPS, PROJECT_PAGE_VARIANT_TAGS
+from seqr.utils.redis_utils import get_redis_client, safe_redis_get_json, safe_redis_set_json
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.individual_api import export_individuals
 from seqr.views.apis.locus_list_api import get_sorted_project_locus_lists
 from seqr.views.apis.users_api import get_json_for_project_collaborator_list
-from seqr.views.utils.json_utils import create_json_response
+from seqr.views.utils.json_utils import create_json_response, DjangoJSONEncoderWithSets
 from seqr.views.utils.json_to_orm_utils import update_project_from_json
 from seqr.views.utils.orm_to_json_utils import \
     _get_json_for_project, get_json_for_samples, _get_json_for_families, _get_json_for_individuals, \
@@ -26,6 +30,11 @@ from seqr.views.utils.permissions_utils import get_project_and_check_permissions
 
 logger = logging.getLogger(__name__)
 
+PROJECT_PAGE_CACHE_KEY = 'project_page__{project_guid}__{section}__{version}__{user_type}'
+# Cached sections are only reused while the section version is unchanged, and at most this long in case a version
+# update failed to reach redis
+PROJECT_PAGE_CACHE_SECONDS = 300
+
 
 @login_required(login_url=API_LOGIN_REQUIRED_URL)
 def project_page_data(request, project_guid):
@@ -39,6 +48,8 @@ def project_page_data(request, project_guid):
          'samplesByGuid': {..},
        }
 
+    The response has an ETag, and a 304 is returned if the page has not changed since the client last loaded it.
+
     Args:
         project_guid (string): GUID of the Project to retrieve data for.
     """
@@ -49,32 +60,93 @@ def project_page_data(request, project_guid):
 
     project_json = _get_json_for_project(project, request.user)
     project_json['collaborators'] = get_json_for_project_collaborator_list(project)
-    project_json.update(_get_json_for_variant_tag_types(project, request.user, individuals_by_guid))
+    project_json.update(_get_cached_project_page_section(
+        project, PROJECT_PAGE_VARIANT_TAGS, lambda: _get_json_for_variant_tag_types(project, request.user, individuals_by_guid),
+        user=request.user,
+    ))
     project_json['locusListGuids'] = locus_lists_by_guid.keys()
     project_json['detailsLoaded'] = True
 
-    return create_json_response({
+    response_json = {
         'projectsByGuid': {project_guid: project_json},
         'familiesByGuid': families_by_guid,
         'individualsByGuid': individuals_by_guid,
         'samplesByGuid': samples_by_guid,
         'locusListsByGuid': locus_lists_by_guid,
         'analysisGroupsByGuid': analysis_groups_by_guid,
-    })
+    }
+
+    # Loading the page saves the project with a new last accessed date, which also updates its last modified date, so
+    # these dates are not used to check whether the page has changed
+    access_dates = {key: project_json.pop(key) for key in ['lastAccessedDate', 'lastModifiedDate']}
+    etag = _get_etag(response_json)
+    not_modified_response = get_conditional_response(request, etag=etag)
+    if not_modified_response:
+        return not_modified_response
+    project_json.update(access_dates)
+
+    response = create_json_response(response_json)
+    response['ETag'] = etag
+    return response
 
 
 def _get_project_child_entities(project, user):
-    families_by_guid = _retrieve_families(project.guid, user)
-    individuals_by_guid = _retrieve_individuals(project.guid, user)
-    for individual_guid, individual in individuals_by_guid.items():
-        families_by_guid[individual['familyGuid']]['individualGuids'].add(individual_guid)
-    samples_by_guid = _retrieve_samples(project.guid, individuals_by_guid)
-    analysis_groups_by_guid = _retrieve_analysis_groups(project)
+    families_by_guid = _get_cached_project_page_section(
+        project, PROJECT_PAGE_FAMILIES, lambda: _retrieve_families(project.guid, user), user=user)
+    individuals_by_guid = _get_cached_project_page_section(
+        project, PROJECT_PAGE_INDIVIDUALS, lambda: _retrieve_individuals(project.guid, user), user=user)
+    samples_by_guid = _get_cached_project_page_section(
+        project, PROJECT_PAGE_SAMPLES, lambda: _retrieve_samples(project.guid))
+    analysis_groups_by_guid = _get_cached_project_page_section(
+        project, PROJECT_PAGE_ANALYSIS_GROUPS, lambda: _retrieve_analysis_groups(project))
+
+    # The sections are cached independently, so the guids of the child entities are only added once all are loaded
+    for family in families_by_guid.values():
+        family['individualGuids'] = []
+    for individual in individuals_by_guid.values():
+        individual['sampleGuids'] = []
+    for individual_guid in sorted(individuals_by_guid.keys()):
+        families_by_guid[individuals_by_guid[individual_guid]['familyGuid']]['individualGuids'].append(individual_guid)
+    for sample_guid in sorted(samples_by_guid.keys()):
+        individuals_by_guid[samples_by_guid[sample_guid]['individualGuid']]['sampleGuids'].append(sample_guid)
+
     locus_lists = get_sorted_project_locus_lists(project, user)
     locus_lists_by_guid = {locus_list['locusListGuid']: locus_list for locus_list in locus_lists}
     return families_by_guid, individuals_by_guid, samples_by_guid, analysis_groups_by_guid, locus_lists_by_guid
 
 
+def _get_cached_project_page_section(project, section, get_section_json, user=None):
+    """Returns the json for the given section of the project page, from redis if it has not changed since it was cached.
+
+    Args:
+        project (object): Django model for the project
+        section (string): name of the section, whose version is incremented whenever its data changes
+        get_section_json (function): computes the json for the section
+        user (object): the json for staff and non-staff users is cached separately if the section has internal fields
+    """
+    try:
+        version = get_redis_client().get(PROJECT_PAGE_VERSION_CACHE_KEY.format(
+            project_guid=project.guid, section=section)) or 0
+    except Exception as e:
+        logger.warn('Unable to fetch project page version from redis: {}'.format(e))
+        return get_section_json()
+
+    cache_key = PROJECT_PAGE_CACHE_KEY.format(
+        project_guid=project.guid, section=section, version=version,
+        user_type='staff' if user and user.is_staff else 'all',
+    )
+    section_json = safe_redis_get_json(cache_key)
+    if section_json is None:
+        section_json = get_section_json()
+        safe_redis_set_json(cache_key, section_json, expire=PROJECT_PAGE_CACHE_SECONDS, encoder=DjangoJSONEncoderWithSets)
+    return section_json
+
+
+def _get_etag(response_json):
+    response_hash = hashlib.md5(json.dumps(response_json, sort_keys=True, cls=DjangoJSONEncoderWithSets)).hexdigest()
+    return 'W/"{}"'.format(response_hash)
+
+
 def _retrieve_families(project_guid, user):
     """Retrieves family-level metadata for the given project.
 
@@ -89,13 +161,7 @@ def _retrieve_families(project_guid, user):
 
     families = _get_json_for_families(family_models, user, project_guid=project_guid)
 
-    families_by_guid = {}
-    for family in families:
-        family_guid = family['familyGuid']
-        family['individualGuids'] = set()
-        families_by_guid[family_guid] = family
-
-    return families_by_guid
+    return {family['familyGuid']: family for family in families}
 
 
 def _retrieve_individuals(project_guid, user):
@@ -111,38 +177,22 @@ def _retrieve_individuals(project_guid, user):
 
     individuals = _get_json_for_individuals(individual_models, user=user, project_guid=project_guid)
 
-    individuals_by_guid = {}
-    for i in individuals:
-        i['sampleGuids'] = set()
-        individual_guid = i['individualGuid']
-        individuals_by_guid[individual_guid] = i
-
-    return individuals_by_guid
+    return {individual['individualGuid']: individual for individual in individuals}
 
 
-def _retrieve_samples(project_guid, individuals_by_guid):
+def _retrieve_samples(project_guid):
     """Retrieves sample metadata for the given project.
 
         Args:
             project_guid (string): project_guid
-            individuals_by_guid (dict): maps each individual_guid to a dictionary with individual info.
-                This method adds a "sampleGuids" list to each of these dictionaries.
         Returns:
-            2-tuple with dictionaries: (samples_by_guid, sample_batches_by_guid)
+            dictionary: samples_by_guid
         """
     sample_models = Sample.objects.filter(individual__family__project__guid=project_guid)
 
     samples = get_json_for_samples(sample_models, project_guid=project_guid)
 
-    samples_by_guid = {}
-    for s in samples:
-        sample_guid = s['sampleGuid']
-        samples_by_guid[sample_guid] = s
-
-        individual_guid = s['individualGuid']
-        individuals_by_guid[individual_guid]['sampleGuids'].add(sample_guid)
-
-    return samples_by_guid
+    return {sample['sampleGuid']: sample for sample in samples}
 
 
 def _retrieve_analysis_groups(project):
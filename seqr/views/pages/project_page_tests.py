@@ -3,8 +3,9 @@ from datetime import datetime
 from django.test import TestCase
 from django.urls.base import reverse
 
+from seqr.models import Family, Individual
 from seqr.views.pages.project_page import project_page_data, export_project_individuals_handler
-from seqr.views.utils.test_utils import _check_login
+from seqr.views.utils.test_utils import _check_login, MockRedis
 
 MME_INDIVIDUAL_ID = 'IND_012'
 
@@ -108,6 +109,60 @@ class ProjectPageTest(TestCase):
         self.assertDictEqual(response_json['samplesByGuid'], {})
         self.assertDictEqual(response_json['analysisGroupsByGuid'], {})
 
+    @mock.patch('seqr.views.apis.locus_list_api.get_objects_for_group', get_objects_for_group)
+    def test_cached_project_page_data(self):
+        redis = MockRedis()
+        for module in ['seqr.models', 'seqr.utils.redis_utils', 'seqr.views.pages.project_page',
+                       'seqr.views.utils.permissions_utils']:
+            patcher = mock.patch('{}.get_redis_client'.format(module), return_value=redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        url = reverse(project_page_data, args=[PROJECT_GUID])
+        _check_login(self, url)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        initial_json = response.json()
+        cached_sections = {key.split('__')[2] for key in redis.values.keys() if key.startswith('project_page__')}
+        self.assertSetEqual(cached_sections, {'families', 'individuals', 'samples', 'analysis_groups', 'variant_tags'})
+
+        # The cached sections are used, and the unchanged page is not sent again
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        response_json = response.json()
+        self.assertDictEqual(response_json['familiesByGuid'], initial_json['familiesByGuid'])
+        self.assertDictEqual(response_json['individualsByGuid'], initial_json['individualsByGuid'])
+        self.assertDictEqual(response_json['samplesByGuid'], initial_json['samplesByGuid'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Updating a family only invalidates the cached families
+        family = Family.objects.get(guid=FAMILY_GUID)
+        family.description = 'An updated description'
+        family.save()
+        self.assertEqual(redis.get('project_page_version__{}__families'.format(PROJECT_GUID)), '1')
+        self.assertIsNone(redis.get('project_page_version__{}__individuals'.format(PROJECT_GUID)))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response_json = response.json()
+        self.assertEqual(response_json['familiesByGuid'][FAMILY_GUID]['description'], 'An updated description')
+        self.assertListEqual(
+            response_json['familiesByGuid'][FAMILY_GUID]['individualGuids'],
+            initial_json['familiesByGuid'][FAMILY_GUID]['individualGuids'],
+        )
+
+        individual = Individual.objects.filter(family=family).first()
+        individual.notes = 'An updated note'
+        individual.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()['individualsByGuid'][individual.guid]['notes'], 'An updated note')
+
     def test_export_tables(self):
         url = reverse(export_project_individuals_handler, args=['R0001_1kg'])
         _check_login(self, url)
@@ -4,7 +4,7 @@ from django.utils import timezone
 from django.db.models.query_utils import Q
 
 from seqr.views.apis.igv_api import proxy_to_igv
-from seqr.models import Sample, Individual
+from seqr.models import Sample, Individual, deferred_project_page_updates
 from seqr.utils.es_utils import get_es_client, get_index_metadata
 from seqr.utils.file_utils import file_iter
 from seqr.views.utils.file_utils import load_uploaded_file, parse_file
@@ -135,17 +135,18 @@ def match_sample_ids_to_sample_records(
 
         # create new Sample records for Individual records that matches
         if create_sample_records:
-            for sample_id, individual in sample_id_to_individual_record.items():
-                new_sample = Sample.objects.create(
-                    sample_id=sample_id,
-                    sample_type=sample_type,
-                    dataset_type=dataset_type,
-                    elasticsearch_index=elasticsearch_index,
-                    individual=individual,
-                    sample_status=Sample.SAMPLE_STATUS_LOADED,
-                    loaded_date=timezone.now(),
-                )
-                sample_id_to_sample_record[sample_id] = new_sample
+            with deferred_project_page_updates():
+                for sample_id, individual in sample_id_to_individual_record.items():
+                    new_sample = Sample.objects.create(
+                        sample_id=sample_id,
+                        sample_type=sample_type,
+                        dataset_type=dataset_type,
+                        elasticsearch_index=elasticsearch_index,
+                        individual=individual,
+                        sample_status=Sample.SAMPLE_STATUS_LOADED,
+                        loaded_date=timezone.now(),
+                    )
+                    sample_id_to_sample_record[sample_id] = new_sample
 
     return sample_id_to_sample_record
 
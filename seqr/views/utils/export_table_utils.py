@@ -1,9 +1,11 @@
 import datetime
 from collections import OrderedDict
+import itertools
 import json
 import openpyxl as xl
+import tempfile
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse, FileResponse
 
 from seqr.views.utils.json_utils import _to_title_case
 
@@ -27,19 +29,7 @@ def export_table(filename_prefix, header, rows, file_format, titlecase_header=Tr
         column_keys = header
 
     for i, row in enumerate(rows):
-        if isinstance(row, dict):
-            for column_key in column_keys:
-                if column_key not in row:
-                    raise ValueError("row #%d doesn't have key '%s': %s" % (i, column_key, row))
-        else:
-            if len(header) != len(row):
-                raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (len(header), len(row), header, row))
-
-        for i, value in enumerate(row):
-            if value is None:
-                row[i] = ""
-            elif type(value) == datetime.datetime:
-                row[i] = value.strftime("%m/%d/%Y %H:%M:%S %p %Z")
+        _format_row(i, row, header, column_keys)
 
     if file_format == "tsv":
         response = HttpResponse(content_type='text/tsv')
@@ -80,6 +70,73 @@ def export_table(filename_prefix, header, rows, file_format, titlecase_header=Tr
             raise ValueError("Invalid file_format: %s" % file_format)
 
 
+def export_table_stream(filename_prefix, header, rows, file_format, titlecase_header=True):
+    """Generates a streaming HTTP response for a table with the given header and rows, exported into the given file_format.
+
+    Rows are formatted as they are consumed, so the full table is never held in memory.
+
+    Args:
+        filename_prefix (string): Filename without the extension.
+        header (list): List of column names
+        rows (iterable): Iterable of rows, where each row is a list of column values
+        file_format (string): "tsv", "xls", or "json"
+    Returns:
+        Django StreamingHttpResponse object with the table data as an attachment.
+    """
+    def _formatted_rows():
+        for i, row in enumerate(rows):
+            yield _format_row(i, row, header, header)
+
+    if file_format == "tsv":
+        lines = itertools.chain(['\t'.join(header)+'\n'], ('\t'.join(map(unicode, row))+'\n' for row in _formatted_rows()))
+        response = StreamingHttpResponse(lines, content_type='text/tsv')
+        response['Content-Disposition'] = 'attachment; filename="{}.tsv"'.format(filename_prefix)
+        return response
+    elif file_format == "json":
+        json_keys = map(lambda s: s.replace(" ", "_").lower(), header)
+        lines = (json.dumps(OrderedDict(zip(json_keys, map(unicode, row))))+'\n' for row in _formatted_rows())
+        response = StreamingHttpResponse(lines, content_type='application/json')
+        response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(filename_prefix)
+        return response
+    elif file_format == "xls":
+        # xlsx files are zip archives which can not be written incrementally to the response, so rows are written with a
+        # write-only workbook to a temporary file which is then streamed
+        wb = xl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(map(_to_title_case, header) if titlecase_header else header)
+        for row in _formatted_rows():
+            ws.append(row)
+
+        temp_file = tempfile.TemporaryFile()
+        wb.save(temp_file)
+        temp_file.seek(0)
+        response = FileResponse(temp_file, content_type="application/ms-excel")
+        response['Content-Disposition'] = 'attachment; filename="{}.xlsx"'.format(filename_prefix)
+        return response
+    else:
+        if not file_format:
+            raise ValueError("file_format arg not specified")
+        else:
+            raise ValueError("Invalid file_format: %s" % file_format)
+
+
+def _format_row(i, row, header, column_keys):
+    if isinstance(row, dict):
+        for column_key in column_keys:
+            if column_key not in row:
+                raise ValueError("row #%d doesn't have key '%s': %s" % (i, column_key, row))
+    else:
+        if len(header) != len(row):
+            raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (len(header), len(row), header, row))
+
+    for i, value in enumerate(row):
+        if value is None:
+            row[i] = ""
+        elif type(value) == datetime.datetime:
+            row[i] = value.strftime("%m/%d/%Y %H:%M:%S %p %Z")
+    return row
+
+
 # def export_samples(filename_prefix, samples, file_format):
 #     """Export Projects table.
 #
@@ -3,6 +3,7 @@ from django.utils import timezone
 
 from seqr.models import Individual
 from seqr.model_utils import update_seqr_model
+from seqr.utils.es_utils import reset_cached_loaded_samples
 from seqr.utils.model_sync_utils import can_edit_family_id, can_edit_individual_id
 from seqr.views.utils.json_utils import _to_snake_case
 
@@ -38,11 +39,16 @@ def update_individual_from_json(individual, json, verbose=False, user=None, allo
     if json.get('displayName') and json['displayName'] == individual.individual_id:
         json['displayName'] = ''
 
+    search_fields = (individual.family_id, individual.affected, individual.sex)
+
     update_model_from_json(
         individual, json, user=user, verbose=verbose, allow_unknown_keys=allow_unknown_keys,
         immutable_keys=['phenotips_data'], conditional_edit_keys={'individual_id': can_edit_individual_id}
     )
 
+    if (individual.family_id, individual.affected, individual.sex) != search_fields:
+        reset_cached_loaded_samples([individual.family.project_id])
+
 
 def _parse_parent_field(json, individual, parent_key, parent_id_key):
     parent = getattr(individual, parent_key, None)
@@ -7,12 +7,13 @@ import logging
 import os
 from collections import defaultdict
 from copy import copy
-from django.db.models import prefetch_related_objects, Prefetch
+from django.db.models import prefetch_related_objects, Prefetch, QuerySet
 from django.db.models.fields.files import ImageFieldFile
 
 from reference_data.models import GeneConstraint, dbNSFPGene
 from seqr.models import CAN_EDIT, Sample, GeneNote, VariantFunctionalData
 from seqr.views.utils.json_utils import _to_camel_case
+from seqr.views.utils.permissions_utils import user_has_project_permission
 logger = logging.getLogger(__name__)
 
 
@@ -129,7 +130,7 @@ def get_json_for_projects(projects, user=None, add_project_category_guids_field=
     def _process_result(result, project):
         result.update({
             'projectCategoryGuids': [c.guid for c in project.projectcategory_set.all()] if add_project_category_guids_field else [],
-            'canEdit': user.is_staff or user.has_perm(CAN_EDIT, project),
+            'canEdit': user.is_staff or user_has_project_permission(user, project, CAN_EDIT),
         })
 
     if add_project_category_guids_field:
@@ -359,7 +360,7 @@ def get_json_for_saved_variants(saved_variants, add_tags=False, add_details=Fals
                 'notes': [get_json_for_variant_note(tag) for tag in saved_variant.variantnote_set.all()],
             })
         if add_details:
-            saved_variant_json = json.loads(saved_variant.saved_variant_json or '{}')
+            saved_variant_json = saved_variant.get_saved_variant_json() or {}
             variant_json.update(variant_details(saved_variant_json, project or saved_variant.project, user, **kwargs))
         variant_json.update({
             'variantId': saved_variant.guid,  # TODO get from json
@@ -367,6 +368,11 @@ def get_json_for_saved_variants(saved_variants, add_tags=False, add_details=Fals
         })
         return variant_json
 
+    if not add_details and isinstance(saved_variants, QuerySet):
+        # The saved variant json is only needed for the details, so it is not loaded for the listed variants
+        saved_variants = saved_variants.defer(
+            'saved_variant_json', 'saved_variant_json_compressed', 'gene_ids', 'main_transcript_id',
+            'main_transcript_gene_id')
     prefetch_related_objects(saved_variants, 'family')
     if not project:
         prefetch_related_objects(saved_variants, 'project')
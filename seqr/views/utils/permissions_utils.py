@@ -1,7 +1,23 @@
+import logging
+import threading
+import time
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
 from django.db.models.query_utils import Q
+from guardian.models import UserObjectPermission, GroupObjectPermission
 
-from seqr.models import Project, CAN_VIEW, CAN_EDIT, IS_OWNER
+from seqr.models import Project, CAN_VIEW, CAN_EDIT, IS_OWNER, PROJECT_PERMISSIONS_VERSION_CACHE_KEY
+from seqr.utils.redis_utils import get_redis_client, safe_redis_get_json, safe_redis_set_json
+
+logger = logging.getLogger(__name__)
+
+# Cached permissions are only reused while the permissions version is unchanged, and at most this long in case a
+# version update failed to reach redis
+PROJECT_PERMISSIONS_CACHE_SECONDS = 300
+MAX_CACHED_USER_PERMISSIONS = 10000
+
+USER_PROJECT_PERMISSIONS = {}
+USER_PROJECT_PERMISSIONS_LOCK = threading.Lock()
 
 
 def _validate_permissions_arg(permission_level):
@@ -33,10 +49,16 @@ def get_project_and_check_permissions(project_guid, user, permission_level=CAN_V
 def check_permissions(project, user, permission_level=CAN_VIEW):
     _check_object_permissions(
         project, user, permission_level=permission_level,
-        check_permission=lambda project, user: user.is_staff and not project.disable_staff_access
+        check_permission=lambda project, user: user.is_staff and not project.disable_staff_access,
+        has_perm=user_has_project_permission,
     )
 
 
+def user_has_project_permission(user, project, permission_level):
+    """Returns whether the user has been given the permission for the project, the same as user.has_perm."""
+    return user.is_active and project.id in _get_user_project_permissions(user)['perms'].get(permission_level, set())
+
+
 def check_object_permissions(obj, user, permission_level=CAN_VIEW):
     _check_object_permissions(obj, user, permission_level, check_permission=None)
 
@@ -45,8 +67,9 @@ def check_public_object_permissions(obj, user, permission_level=CAN_VIEW):
     _check_object_permissions(obj, user, permission_level, check_permission=lambda obj, user: obj.is_public)
 
 
-def _check_object_permissions(obj, user, permission_level, check_permission):
-    if user.has_perm(permission_level, obj) or user.is_superuser or user.is_staff or (check_permission and check_permission(obj, user)):
+def _check_object_permissions(obj, user, permission_level, check_permission, has_perm=None):
+    has_perm = has_perm or (lambda user, obj, permission_level: user.has_perm(permission_level, obj))
+    if has_perm(user, obj, permission_level) or user.is_superuser or user.is_staff or (check_permission and check_permission(obj, user)):
         pass
     else:
         raise PermissionDenied("{user} does not have {permission_level} permissions for {object}".format(
@@ -57,7 +80,7 @@ def get_projects_user_can_view(user):
     if user.is_superuser:
         return Project.objects.all()
 
-    can_view_filter = Q(can_view_group__user=user)
+    can_view_filter = Q(id__in=_get_user_project_permissions(user)['view'])
     if user.is_staff:
         return Project.objects.filter(can_view_filter | Q(disable_staff_access=False))
     else:
@@ -68,7 +91,7 @@ def get_projects_user_can_edit(user):
     if user.is_superuser:
         return Project.objects.all()
 
-    can_edit_filter = Q(can_edit_group__user=user)
+    can_edit_filter = Q(id__in=_get_user_project_permissions(user)['edit'])
     if user.is_staff:
         return Project.objects.filter(can_edit_filter | Q(disable_staff_access=False))
     else:
@@ -86,3 +109,67 @@ def add_user_to_project(user, project, permission_level=CAN_VIEW):
             project.can_edit_group.user_set.add(user)
 
 
+def _get_project_permissions_version():
+    try:
+        return get_redis_client().get(PROJECT_PERMISSIONS_VERSION_CACHE_KEY) or '0'
+    except Exception as e:
+        logger.warn('Unable to fetch "{}" from redis: {}'.format(PROJECT_PERMISSIONS_VERSION_CACHE_KEY, e))
+        return None
+
+
+def _get_user_project_permissions(user):
+    """Returns the ids of the projects the user is a collaborator for ('view' and 'edit') and the ids of the projects
+    the user has each guardian permission for ('perms').
+
+    These are cached in memory and in redis for the current permissions version, and are loaded from the database
+    without caching if the version is unavailable.
+    """
+    version = _get_project_permissions_version()
+    if version is None:
+        return _load_user_project_permissions(user)
+
+    now = time.time()
+    with USER_PROJECT_PERMISSIONS_LOCK:
+        cached = USER_PROJECT_PERMISSIONS.get(user.id)
+    if cached and cached['version'] == version and now - cached['loadedTime'] < PROJECT_PERMISSIONS_CACHE_SECONDS:
+        return cached
+
+    cache_key = 'project_permissions__{}__{}'.format(user.id, version)
+    permissions = safe_redis_get_json(cache_key)
+    if not permissions:
+        permissions = _load_user_project_permissions(user)
+        safe_redis_set_json(cache_key, {
+            'view': list(permissions['view']),
+            'edit': list(permissions['edit']),
+            'perms': {perm: list(project_ids) for perm, project_ids in permissions['perms'].items()},
+        }, expire=PROJECT_PERMISSIONS_CACHE_SECONDS)
+    permissions = {
+        'version': version,
+        'loadedTime': now,
+        'view': set(permissions['view']),
+        'edit': set(permissions['edit']),
+        'perms': {perm: set(project_ids) for perm, project_ids in permissions['perms'].items()},
+    }
+
+    with USER_PROJECT_PERMISSIONS_LOCK:
+        if len(USER_PROJECT_PERMISSIONS) >= MAX_CACHED_USER_PERMISSIONS:
+            USER_PROJECT_PERMISSIONS.clear()
+        USER_PROJECT_PERMISSIONS[user.id] = permissions
+    return permissions
+
+
+def _load_user_project_permissions(user):
+    project_content_type = ContentType.objects.get_for_model(Project)
+    perms = {}
+    for object_permissions in [
+        UserObjectPermission.objects.filter(user=user, content_type=project_content_type),
+        GroupObjectPermission.objects.filter(group__user=user, content_type=project_content_type),
+    ]:
+        for perm, project_id in object_permissions.values_list('permission__codename', 'object_pk'):
+            perms.setdefault(perm, set()).add(int(project_id))
+
+    return {
+        'view': set(Project.objects.filter(can_view_group__user=user).values_list('id', flat=True)),
+        'edit': set(Project.objects.filter(can_edit_group__user=user).values_list('id', flat=True)),
+        'perms': perms,
+    }
@@ -0,0 +1,55 @@
+import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase
+from guardian.shortcuts import assign_perm
+
+from seqr.models import Project, CAN_VIEW, CAN_EDIT
+from seqr.views.utils import permissions_utils
+from seqr.views.utils.permissions_utils import add_user_to_project, check_permissions, get_projects_user_can_view, \
+    get_projects_user_can_edit, user_has_project_permission
+from seqr.views.utils.test_utils import MockRedis
+
+
+class PermissionsUtilsTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    def setUp(self):
+        permissions_utils.USER_PROJECT_PERMISSIONS.clear()
+        redis = MockRedis()
+        for module in ['seqr.models', 'seqr.utils.redis_utils', 'seqr.views.utils.permissions_utils']:
+            patcher = mock.patch('{}.get_redis_client'.format(module), return_value=redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_project_permissions(self):
+        project = Project.objects.get(guid='R0001_1kg')
+        assign_perm(user_or_group=project.can_view_group, perm=CAN_VIEW, obj=project)
+        user = User.objects.create(username='collaborator')
+
+        self.assertListEqual(list(get_projects_user_can_view(user)), [])
+        with self.assertRaises(PermissionDenied):
+            check_permissions(project, user)
+
+        # Adding the user to the project changes the permissions version, so the cached permissions are not used
+        # The fixture projects share a view group, so the user can view all of them
+        add_user_to_project(user, project, permission_level=CAN_VIEW)
+        self.assertSetEqual(
+            set(get_projects_user_can_view(user)), set(Project.objects.filter(can_view_group=project.can_view_group)))
+        self.assertListEqual(list(get_projects_user_can_edit(user)), [])
+        check_permissions(project, user)
+        with self.assertRaises(PermissionDenied):
+            check_permissions(project, user, permission_level=CAN_EDIT)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_project_permission(user, project, CAN_VIEW))
+
+        # Permissions cached in redis by another process are used without querying the database
+        permissions_utils.USER_PROJECT_PERMISSIONS.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_project_permission(user, project, CAN_VIEW))
+
+        project.can_view_group.user_set.remove(user)
+        self.assertListEqual(list(get_projects_user_can_view(user)), [])
+        self.assertFalse(user_has_project_permission(user, project, CAN_VIEW))
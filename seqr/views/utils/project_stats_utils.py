@@ -0,0 +1,83 @@
+import logging
+from collections import defaultdict
+from django.db.models import Count
+
+from seqr.models import ProjectStats, Family, Individual, Sample, VariantTag
+
+logger = logging.getLogger(__name__)
+
+
+def get_projects_stats(projects):
+    """Returns the dashboard counts for each of the given projects, keyed by project guid.
+
+    Stored stats are returned as is, and only the stats for projects that have changed since they were last computed
+    are recomputed.
+    """
+    project_stats = {stats.project_id: stats for stats in ProjectStats.objects.filter(project__in=projects)}
+
+    stale_projects = [
+        project for project in projects if project.id not in project_stats or project_stats[project.id].is_stale
+    ]
+    if stale_projects:
+        project_stats.update(update_projects_stats(stale_projects, project_stats=project_stats))
+
+    return {project.guid: project_stats[project.id].stats for project in projects}
+
+
+def update_projects_stats(projects, project_stats=None):
+    """Computes and saves the stats for the given projects, and returns the ProjectStats keyed by project id."""
+    project_stats = dict(project_stats or {})
+    for project in projects:
+        if project.id not in project_stats:
+            project_stats[project.id], _ = ProjectStats.objects.get_or_create(project=project)
+
+    # The version is read before counting, so any change made while counting leaves the stats out of date
+    versions = dict(ProjectStats.objects.filter(project__in=projects).values_list('project_id', 'version'))
+    computed_stats = _compute_projects_stats([project.id for project in projects])
+    updated_project_stats = {}
+    for project in projects:
+        stats = project_stats[project.id]
+        stats.stats = computed_stats[project.id]
+        stats.stats_version = versions[project.id]
+        ProjectStats.objects.filter(project_id=project.id).update(stats=stats.stats, stats_version=stats.stats_version)
+        updated_project_stats[project.id] = stats
+
+    logger.info('Updated stats for {} projects'.format(len(projects)))
+    return updated_project_stats
+
+
+def _compute_projects_stats(project_ids):
+    stats = {project_id: {'numFamilies': 0, 'numIndividuals': 0, 'numVariantTags': 0} for project_id in project_ids}
+
+    for agg in Family.objects.filter(project_id__in=project_ids).values('project_id').annotate(count=Count('*')):
+        stats[agg['project_id']]['numFamilies'] = agg['count']
+
+    for agg in Individual.objects.filter(family__project_id__in=project_ids).values(
+            'family__project_id').annotate(count=Count('*')):
+        stats[agg['family__project_id']]['numIndividuals'] = agg['count']
+
+    for agg in VariantTag.objects.filter(saved_variant__project_id__in=project_ids).values(
+            'saved_variant__project_id').annotate(count=Count('*')):
+        stats[agg['saved_variant__project_id']]['numVariantTags'] = agg['count']
+
+    analysis_status_counts = defaultdict(dict)
+    for agg in Family.objects.filter(project_id__in=project_ids).values(
+            'project_id', 'analysis_status').annotate(count=Count('*')):
+        analysis_status_counts[agg['project_id']][agg['analysis_status']] = agg['count']
+
+    sample_type_counts = defaultdict(dict)
+    for agg in Sample.objects.filter(
+        individual__family__project_id__in=project_ids,
+        dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS,
+        sample_status=Sample.SAMPLE_STATUS_LOADED,
+    ).values('individual__family__project_id', 'sample_type').annotate(
+            count=Count('individual_id', distinct=True)):
+        sample_type_counts[agg['individual__family__project_id']][agg['sample_type']] = agg['count']
+
+    # Projects without any families or loaded samples are left without analysis status or sample type counts
+    for project_id, counts in analysis_status_counts.items():
+        stats[project_id]['analysisStatusCounts'] = counts
+    for project_id, counts in sample_type_counts.items():
+        stats[project_id]['sampleTypeCounts'] = counts
+
+    return stats
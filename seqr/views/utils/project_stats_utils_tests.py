@@ -0,0 +1,81 @@
+import mock
+from django.test import TestCase
+
+from seqr.models import Project, ProjectStats, Family, Individual, Sample, deferred_project_page_updates
+from seqr.views.utils.project_stats_utils import get_projects_stats
+from seqr.views.utils.test_utils import MockRedis
+
+
+class ProjectStatsUtilsTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    def test_get_projects_stats(self):
+        projects = Project.objects.filter(guid='R0001_1kg')
+        stats = get_projects_stats(projects)
+        self.assertListEqual(stats.keys(), ['R0001_1kg'])
+        project_stats = stats['R0001_1kg']
+        self.assertEqual(project_stats['numFamilies'], 11)
+        self.assertEqual(project_stats['numIndividuals'], 15)
+        self.assertEqual(project_stats['numVariantTags'], 3)
+        self.assertDictEqual(project_stats['sampleTypeCounts'], {'WES': 13})
+
+        stored_stats = ProjectStats.objects.get(project__guid='R0001_1kg')
+        self.assertFalse(stored_stats.is_stale)
+        self.assertDictEqual(stored_stats.stats, project_stats)
+
+        # Changing a family marks the stats as out of date, and they are recomputed on the next read
+        Family.objects.create(project=projects.first(), family_id='new_family')
+        self.assertTrue(ProjectStats.objects.get(project__guid='R0001_1kg').is_stale)
+        self.assertEqual(get_projects_stats(projects)['R0001_1kg']['numFamilies'], 12)
+        self.assertFalse(ProjectStats.objects.get(project__guid='R0001_1kg').is_stale)
+
+    def test_project_change_invalidation(self):
+        projects = Project.objects.filter(guid='R0001_1kg')
+        get_projects_stats(projects)
+        individual = Individual.objects.get(guid='I000001_na19675')
+
+        # The project is looked up once to invalidate both the stats and the cached project page sections
+        redis = MockRedis()
+        with mock.patch('seqr.models.get_redis_client', return_value=redis):
+            with self.assertNumQueries(3):
+                individual.save()
+
+        self.assertTrue(ProjectStats.objects.get(project__guid='R0001_1kg').is_stale)
+        self.assertDictEqual(redis.values, {
+            'project_page_version__R0001_1kg__individuals': '1',
+            'project_page_version__R0001_1kg__variant_tags': '1',
+        })
+
+    def test_deferred_project_change_invalidation(self):
+        projects = Project.objects.filter(guid='R0001_1kg')
+        get_projects_stats(projects)
+        samples = list(Sample.objects.filter(individual__family__project__guid='R0001_1kg'))
+
+        # Changes made in bulk look up and update the project once, after all the rows are saved
+        redis = MockRedis()
+        with mock.patch('seqr.models.get_redis_client', return_value=redis):
+            with self.assertNumQueries(len(samples) + 2):
+                with deferred_project_page_updates():
+                    for sample in samples:
+                        sample.save()
+
+        self.assertTrue(ProjectStats.objects.get(project__guid='R0001_1kg').is_stale)
+        self.assertDictEqual(redis.values, {'project_page_version__R0001_1kg__samples': '1'})
+
+        # Deleted rows are resolved to their project straight away, as the rows they are looked up through may also be
+        # deleted before the block exits
+        get_projects_stats(projects)
+        individual = next(
+            sample.individual for sample in samples if not sample.individual.matchmakerresult_set.exists())
+        redis = MockRedis()
+        with mock.patch('seqr.models.get_redis_client', return_value=redis):
+            with deferred_project_page_updates():
+                individual.sample_set.all().delete()
+                individual.delete()
+
+        self.assertTrue(ProjectStats.objects.get(project__guid='R0001_1kg').is_stale)
+        self.assertDictEqual(redis.values, {
+            'project_page_version__R0001_1kg__individuals': '1',
+            'project_page_version__R0001_1kg__samples': '1',
+            'project_page_version__R0001_1kg__variant_tags': '1',
+        })
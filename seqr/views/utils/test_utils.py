@@ -42,3 +42,38 @@ def create_proxy_request_stub(response_status=200, reason="OK"):
         return http_response
 
     return _proxy_request_stub
+
+
+class MockRedis(object):
+    """In-memory stand-in for the redis client, for testing code that caches data in redis"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def expire(self, key, seconds):
+        pass
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
@@ -1,10 +1,16 @@
+import hashlib
 import json
 import logging
 import redis
-from collections import defaultdict
+import time
+from collections import defaultdict, OrderedDict
 from django.contrib.auth.models import User
+from django.db.models import Case, When, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
 
-from seqr.models import SavedVariant, VariantSearchResults, Individual
+from seqr.models import SavedVariant, VariantSearchResults, Individual, increment_project_page_version, \
+    PROJECT_PAGE_VARIANT_TAGS
 from seqr.utils.es_utils import get_es_variants_for_variant_tuples, InvalidIndexException
 from seqr.utils.xpos_utils import get_chrom_pos
 from settings import REDIS_SERVICE_HOSTNAME
@@ -28,7 +34,7 @@ def deprecated_get_or_create_saved_variant(xpos=None, ref=None, alt=None, family
         family=family,
         project=project,
     )
-    if not saved_variant.saved_variant_json:
+    if not saved_variant.get_saved_variant_json():
         try:
             saved_variants_json = _retrieve_saved_variants_json(project, [(xpos, ref, alt, family)], create_if_missing=True)
             if len(saved_variants_json):
@@ -38,26 +44,55 @@ def deprecated_get_or_create_saved_variant(xpos=None, ref=None, alt=None, family
     return saved_variant
 
 
-def update_project_saved_variant_json(project, family_id=None):
+SAVED_VARIANT_JSON_FIELDS = [
+    'saved_variant_json', 'saved_variant_json_compressed', 'gene_ids', 'main_transcript_id', 'main_transcript_gene_id',
+]
+
+# Number of distinct variants looked up in each search and saved in each UPDATE when reloading saved variant json
+SAVED_VARIANT_JSON_CHUNK_SIZE = 500
+
+
+def update_project_saved_variant_json(project, family_id=None, chunk_size=SAVED_VARIANT_JSON_CHUNK_SIZE,
+                                      changed_only=False):
+    """Reloads the json for the project's saved variants and returns the guids of the updated saved variants.
+
+    Variants are processed in chunks ordered by position, with one search and one UPDATE per chunk. If changed_only is
+    set, saved variants whose reloaded json is the same as the saved json are not updated or returned.
+    """
+    start = time.time()
     saved_variants = SavedVariant.objects.filter(project=project, family__isnull=False).select_related('family')
     if family_id:
         saved_variants = saved_variants.filter(family__family_id=family_id)
 
-    saved_variants_map = {(v.xpos_start, v.ref, v.alt, v.family): v for v in saved_variants}
-    variant_tuples = saved_variants_map.keys()
-    saved_variants_map = {
-        (xpos, ref, alt, family.guid): v for (xpos, ref, alt, family), v in saved_variants_map.items()
-    }
-
-    variants_json = _retrieve_saved_variants_json(project, variant_tuples)
+    saved_variants_map = {}
+    families_by_variant = defaultdict(list)
+    for v in saved_variants:
+        saved_variants_map[(v.xpos_start, v.ref, v.alt, v.family.guid)] = v
+        families_by_variant[(v.xpos_start, v.ref, v.alt)].append(v.family)
 
+    # All families with the same variant are looked up in the same chunk, so each saved variant is in one search
+    variant_keys = sorted(families_by_variant.keys())
     updated_saved_variant_guids = []
-    for var in variants_json:
-        for family_guid in var['familyGuids']:
-            saved_variant = saved_variants_map.get((var['xpos'], var['ref'], var['alt'], family_guid))
-            if saved_variant:
-                _update_saved_variant_json(saved_variant, var)
-                updated_saved_variant_guids.append(saved_variant.guid)
+    for i in range(0, len(variant_keys), chunk_size):
+        variant_tuples = [
+            (xpos, ref, alt, family) for xpos, ref, alt in variant_keys[i:i + chunk_size]
+            for family in families_by_variant[(xpos, ref, alt)]
+        ]
+        variants_json = _retrieve_saved_variants_json(project, variant_tuples)
+
+        saved_variant_json_updates = OrderedDict()
+        for var in variants_json:
+            for family_guid in var['familyGuids']:
+                saved_variant = saved_variants_map.get((var['xpos'], var['ref'], var['alt'], family_guid))
+                if saved_variant:
+                    saved_variant_json_updates[saved_variant] = var
+        updated_saved_variant_guids += _bulk_update_saved_variant_json(
+            saved_variant_json_updates, changed_only=changed_only)
+
+    elapsed = time.time() - start
+    logger.info('Reloaded {} saved variants for {} in {:.1f}s ({:.0f} variants/s), updated {}'.format(
+        len(saved_variants_map), project.guid, elapsed, len(saved_variants_map) / elapsed if elapsed else 0,
+        len(updated_saved_variant_guids)))
 
     return updated_saved_variant_guids
 
@@ -110,10 +145,54 @@ def _deprecated_retrieve_saved_variants_json(project, variant_tuples, create_if_
 
 
 def _update_saved_variant_json(saved_variant, saved_variant_json):
-    saved_variant.saved_variant_json = json.dumps(saved_variant_json)
+    saved_variant.set_saved_variant_json(saved_variant_json)
     saved_variant.save()
 
 
+def _saved_variant_json_hash(saved_variant_json):
+    if not saved_variant_json:
+        return None
+    # Key order is not stable across loads, so the json is hashed with sorted keys
+    return hashlib.md5(json.dumps(saved_variant_json, sort_keys=True)).hexdigest()
+
+
+def _bulk_update_saved_variant_json(saved_variant_json_updates, changed_only=False):
+    """Saves the json for each saved variant in a single UPDATE and returns the guids of the updated variants."""
+    updated_saved_variants = []
+    for saved_variant, saved_variant_json in saved_variant_json_updates.items():
+        if changed_only and _saved_variant_json_hash(saved_variant.get_saved_variant_json()) == _saved_variant_json_hash(
+                saved_variant_json):
+            continue
+        saved_variant.set_saved_variant_json(saved_variant_json)
+        updated_saved_variants.append(saved_variant)
+
+    bulk_save_saved_variant_json(updated_saved_variants)
+    return [saved_variant.guid for saved_variant in updated_saved_variants]
+
+
+def bulk_save_saved_variant_json(saved_variants):
+    """Saves the json and projected json fields already set on each of the saved variants in a single UPDATE."""
+    if not saved_variants:
+        return
+
+    def _field_case(field):
+        # Each value is cast to the column type, as postgres can not infer the type of an empty array literal
+        return Case(
+            *[When(guid=saved_variant.guid, then=Cast(
+                Value(getattr(saved_variant, field.name), output_field=field), output_field=field))
+              for saved_variant in saved_variants],
+            output_field=field
+        )
+
+    SavedVariant.objects.filter(guid__in=[saved_variant.guid for saved_variant in saved_variants]).update(
+        last_modified_date=timezone.now(),
+        **{field: _field_case(SavedVariant._meta.get_field(field)) for field in SAVED_VARIANT_JSON_FIELDS}
+    )
+    # The bulk update does not send post_save, so the cached discovery tags are invalidated here
+    increment_project_page_version(
+        [PROJECT_PAGE_VARIANT_TAGS], id__in={saved_variant.project_id for saved_variant in saved_variants})
+
+
 # TODO process data before saving and then get rid of this
 def variant_details(variant_json, project, user, individual_guids_by_id=None):
     if 'populations' in variant_json:
@@ -0,0 +1,83 @@
+import json
+import mock
+
+from django.test import TestCase, override_settings
+
+from seqr.models import Project, SavedVariant
+from seqr.views.utils.variant_utils import update_project_saved_variant_json
+
+
+def _mock_variants_json(project, variant_tuples):
+    return [
+        {'xpos': var[0], 'ref': var[1], 'alt': var[2], 'familyGuids': [var[3].guid], 'extras': {'a': 1, 'b': 2}}
+        for var in variant_tuples
+    ]
+
+
+class VariantUtilsTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    @mock.patch('seqr.views.utils.variant_utils._retrieve_saved_variants_json')
+    def test_update_project_saved_variant_json(self, mock_retrieve_variants):
+        mock_retrieve_variants.side_effect = _mock_variants_json
+        project = Project.objects.get(guid='R0001_1kg')
+
+        updated_guids = update_project_saved_variant_json(project, chunk_size=2)
+        self.assertListEqual(
+            updated_guids,
+            ['SV0000002_1248367227_r0390_100', 'SV0000001_2103343353_r0390_100', 'SV0000003_2246859832_r0390_100']
+        )
+        self.assertListEqual(
+            [[var[:3] for var in call[0][1]] for call in mock_retrieve_variants.call_args_list],
+            [[(1248367227, 'TC', 'T'), (2103343353, 'GAGA', 'G')], [(22046859832, 'C', 'T')]]
+        )
+        saved_variant = SavedVariant.objects.get(guid='SV0000001_2103343353_r0390_100')
+        self.assertDictEqual(saved_variant.get_saved_variant_json(), {
+            'xpos': 2103343353, 'ref': 'GAGA', 'alt': 'G', 'familyGuids': ['F000001_1'], 'extras': {'a': 1, 'b': 2},
+        })
+
+        # Reloading the same json, even with a different key order, does not update any variants
+        SavedVariant.objects.filter(guid='SV0000001_2103343353_r0390_100').update(
+            saved_variant_json_compressed=None, saved_variant_json=json.dumps({
+                'extras': {'b': 2, 'a': 1}, 'familyGuids': ['F000001_1'], 'alt': 'G', 'ref': 'GAGA', 'xpos': 2103343353,
+            }))
+        updated_guids = update_project_saved_variant_json(project, changed_only=True)
+        self.assertListEqual(updated_guids, [])
+
+        mock_retrieve_variants.side_effect = lambda project, variant_tuples: [
+            dict(var, extras={'a': 3}) if var['ref'] == 'TC' else var
+            for var in _mock_variants_json(project, variant_tuples)
+        ]
+        updated_guids = update_project_saved_variant_json(project, changed_only=True)
+        self.assertListEqual(updated_guids, ['SV0000002_1248367227_r0390_100'])
+        saved_variant = SavedVariant.objects.get(guid='SV0000002_1248367227_r0390_100')
+        self.assertDictEqual(saved_variant.get_saved_variant_json()['extras'], {'a': 3})
+
+    def test_saved_variant_json_storage(self):
+        saved_variant = SavedVariant.objects.get(guid='SV0000001_2103343353_r0390_100')
+        legacy_json = saved_variant.get_saved_variant_json()
+        self.assertEqual(legacy_json['xpos'], 2103343353)
+
+        saved_variant.set_saved_variant_json(legacy_json)
+        saved_variant.save()
+        saved_variant = SavedVariant.objects.get(guid='SV0000001_2103343353_r0390_100')
+        self.assertIsNone(saved_variant.saved_variant_json)
+        self.assertDictEqual(saved_variant.get_saved_variant_json(), legacy_json)
+        self.assertListEqual(saved_variant.gene_ids, ['ENSG00000135953'])
+        self.assertEqual(saved_variant.main_transcript_id, 'ENST00000258436')
+        self.assertEqual(saved_variant.main_transcript_gene_id, 'ENSG00000135953')
+
+        variant_json = {
+            'xpos': 2103343353, 'ref': 'GAGA', 'alt': 'G',
+            'transcripts': {'ENSG00000135953': [{'transcriptId': 'ENST00000258436'}], 'ENSG00000228198': []},
+            'mainTranscript': {'transcriptId': 'ENST00000258436', 'geneId': 'ENSG00000135953'},
+        }
+        with override_settings(SAVED_VARIANT_JSON_COMPRESSED=False):
+            saved_variant.set_saved_variant_json(variant_json)
+        saved_variant.save()
+        saved_variant = SavedVariant.objects.get(guid='SV0000001_2103343353_r0390_100')
+        self.assertIsNone(saved_variant.saved_variant_json_compressed)
+        self.assertDictEqual(json.loads(saved_variant.saved_variant_json), variant_json)
+        self.assertDictEqual(saved_variant.get_saved_variant_json(), variant_json)
+        self.assertListEqual(saved_variant.gene_ids, ['ENSG00000135953', 'ENSG00000228198'])
+        self.assertEqual(saved_variant.main_transcript_gene_id, 'ENSG00000135953')
@@ -174,6 +174,30 @@ LOGGING = {
 ELASTICSEARCH_SERVICE_HOSTNAME = os.environ.get('ELASTICSEARCH_SERVICE_HOSTNAME', 'localhost')
 ELASTICSEARCH_PORT = os.environ.get('ELASTICSEARCH_SERVICE_PORT', "9200")
 ELASTICSEARCH_SERVER = "%s:%s" % (ELASTICSEARCH_SERVICE_HOSTNAME, ELASTICSEARCH_PORT)
+# number of keep-alive connections each process holds open to each elasticsearch node
+ELASTICSEARCH_CONNECTION_POOL_SIZE = int(os.environ.get('ELASTICSEARCH_CONNECTION_POOL_SIZE', 25))
+# sniffing discovers the other cluster nodes - only enable it if the nodes are reachable directly from seqr
+ELASTICSEARCH_SNIFF = os.environ.get('ELASTICSEARCH_SNIFF', 'false').lower() == 'true'
+ELASTICSEARCH_SNIFFER_TIMEOUT = int(os.environ.get('ELASTICSEARCH_SNIFFER_TIMEOUT', 60))
+# searches across multiple indices run each index concurrently, and an index that does not respond in time is left
+# out of the results instead of failing the whole search
+ELASTICSEARCH_SEARCH_THREADS = int(os.environ.get('ELASTICSEARCH_SEARCH_THREADS', 10))
+ELASTICSEARCH_INDEX_SEARCH_TIMEOUT = int(os.environ.get('ELASTICSEARCH_INDEX_SEARCH_TIMEOUT', 20))
+# the maximum number of documents to collect per shard for each index search - unset to collect all matching documents
+ELASTICSEARCH_INDEX_SEARCH_TERMINATE_AFTER = int(os.environ['ELASTICSEARCH_INDEX_SEARCH_TERMINATE_AFTER']) \
+    if os.environ.get('ELASTICSEARCH_INDEX_SEARCH_TERMINATE_AFTER') else None
+# after returning a page of search results the next page is loaded into the results cache in the background
+SEARCH_PREFETCH_ENABLED = os.environ.get('SEARCH_PREFETCH_ENABLED', 'true').lower() == 'true'
+SEARCH_PREFETCH_THREADS = int(os.environ.get('SEARCH_PREFETCH_THREADS', 4))
+SEARCH_PREFETCH_WAIT_SECONDS = int(os.environ.get('SEARCH_PREFETCH_WAIT_SECONDS', 30))
+
+# gene reference data is held in memory by each process, and is reloaded once the update commands have changed it
+GENE_ANNOTATION_STORE_ENABLED = os.environ.get('GENE_ANNOTATION_STORE_ENABLED', 'true').lower() == 'true'
+GENE_ANNOTATION_STORE_VERSION_CHECK_SECONDS = int(os.environ.get('GENE_ANNOTATION_STORE_VERSION_CHECK_SECONDS', 60))
+
+# saved variant json is stored zlib compressed - existing variants are converted with the compress_saved_variant_json
+# command, and variants saved with compression disabled are stored as plain text
+SAVED_VARIANT_JSON_COMPRESSED = os.environ.get('SAVED_VARIANT_JSON_COMPRESSED', 'true').lower() == 'true'
 
 DEPLOYMENT_TYPE_DEV = "dev"
 DEPLOYMENT_TYPE_PROD = "prod"
@@ -278,6 +302,11 @@ TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 AUTH_PROFILE_MODULE = 'base.UserProfile'
 
 MONGO_SERVICE_HOSTNAME = os.environ.get('MONGO_SERVICE_HOSTNAME', 'localhost')
+
+# tabix indexed VCFs are loaded into the mongo datastore in regions of this many base pairs, by this many processes
+MONGO_VCF_LOADING_PROCESSES = int(os.environ.get('MONGO_VCF_LOADING_PROCESSES', 4))
+MONGO_VCF_LOADING_SHARD_SIZE = int(os.environ.get('MONGO_VCF_LOADING_SHARD_SIZE', 10**7))
+
 LOGGING_DB = MongoClient(MONGO_SERVICE_HOSTNAME, 27017)['logging']
 COVERAGE_DB = MongoClient(MONGO_SERVICE_HOSTNAME, 27017)['xbrowse_reference']
 EVENTS_COLLECTION = LOGGING_DB.events
@@ -443,6 +472,8 @@ if len(sys.argv) >= 2 and sys.argv[1] == 'test':
         'HOST': '',
         'PORT': '',
     }
+    # gene data is loaded from the database in each test, as the fixtures are reloaded for every test case
+    GENE_ANNOTATION_STORE_ENABLED = False
 
 logger.info("MONGO_SERVICE_HOSTNAME: " + MONGO_SERVICE_HOSTNAME)
 logger.info("PHENOTIPS_SERVICE_HOSTNAME: " + PHENOTIPS_SERVICE_HOSTNAME)
@@ -18,6 +18,7 @@ import {
   getSearchedVariantsIsLoading,
   getSearchedVariantsErrorMessage,
   getTotalVariantsCount,
+  getSearchIncompleteIndices,
   getVariantSearchDisplay,
   getSearchedVariantExportConfig,
   getSearchContextIsLoading,
@@ -39,6 +40,7 @@ const FIELDS = [
 
 const BaseVariantSearchResults = ({
   match, searchedVariants, variantSearchDisplay, searchedVariantExportConfig, onSubmit, load, unload, loading, errorMessage, totalVariantsCount,
+  incompleteIndices,
 }) => {
   const { searchHash, variantId } = match.params
   const { page = 1, recordsPerPage } = variantSearchDisplay
@@ -83,6 +85,16 @@ const BaseVariantSearchResults = ({
           </Grid.Column>
         </LargeRow>
       }
+      {incompleteIndices.length > 0 &&
+        <Grid.Row>
+          <Grid.Column width={16}>
+            <Message
+              warning
+              content={`Search timed out for ${incompleteIndices.length} dataset(s), so some variants may be missing. Reload the page to retry.`}
+            />
+          </Grid.Column>
+        </Grid.Row>
+      }
       <Grid.Row>
         <Grid.Column width={16}>
           <Variants variants={searchedVariants} />
@@ -103,6 +115,7 @@ BaseVariantSearchResults.propTypes = {
   variantSearchDisplay: PropTypes.object,
   searchedVariantExportConfig: PropTypes.array,
   totalVariantsCount: PropTypes.number,
+  incompleteIndices: PropTypes.array,
 }
 
 const mapStateToProps = (state, ownProps) => ({
@@ -111,6 +124,7 @@ const mapStateToProps = (state, ownProps) => ({
   variantSearchDisplay: getVariantSearchDisplay(state),
   searchedVariantExportConfig: getSearchedVariantExportConfig(state, ownProps),
   totalVariantsCount: getTotalVariantsCount(state, ownProps),
+  incompleteIndices: getSearchIncompleteIndices(state, ownProps),
   errorMessage: getSearchedVariantsErrorMessage(state),
 })
 
@@ -119,6 +119,11 @@ export const getTotalVariantsCount = createSelector(
   searchParams => (searchParams || {}).totalResults,
 )
 
+export const getSearchIncompleteIndices = createSelector(
+  getCurrentSearchParams,
+  searchParams => (searchParams || {}).incompleteIndices || [],
+)
+
 export const getSearchedVariantExportConfig = createSelector(
   getCurrentSearchHash,
   searchHash => [{
@@ -7,7 +7,8 @@ import pysam
 import sys
 import gzip
 import itertools
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
 from xbrowse import Variant
 from xbrowse import genomeloc
 from vep_annotations import HackedVEPAnnotator
@@ -19,6 +20,10 @@ from xbrowse.utils import compressed_file
 from xbrowse_server.xbrowse_annotation_controls import CustomAnnotator
 import vcf
 
+# Annotations are looked up with one query per batch of variants, and the most recently used are kept in memory
+ANNOTATION_LOOKUP_BATCH_SIZE = 1000
+MAX_CACHED_ANNOTATIONS = 5000
+
 
 class VariantAnnotator():
 
@@ -31,12 +36,15 @@ class VariantAnnotator():
             vep_perl_path=settings.ANNOTATOR_SETTINGS.vep_perl_path,
             vep_cache_dir=settings.ANNOTATOR_SETTINGS.vep_cache_dir,
             vep_batch_size=settings.ANNOTATOR_SETTINGS.vep_batch_size,
+            vep_processes=getattr(settings.ANNOTATOR_SETTINGS, 'vep_processes', 1),
             human_ancestor_fa=None,
             #human_ancestor_fa=settings_module.human_ancestor_fa,
         )
         self._custom_annotator = custom_annotator
         self.reference_populations = settings.ANNOTATOR_SETTINGS.reference_populations
         self.reference_population_slugs = [pop['slug'] for pop in settings.ANNOTATOR_SETTINGS.reference_populations]
+        self._annotation_cache = OrderedDict()
+        self._annotation_cache_lock = threading.Lock()
 
     def _ensure_indices(self):
         self.get_annotator_datastore().variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
@@ -69,23 +77,69 @@ class VariantAnnotator():
         return variant
 
     def get_annotation(self, xpos, ref, alt, populations=None):
-        doc = self.get_annotator_datastore().variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt})
-        if doc is None:
+        annotation = self.get_annotations([(xpos, ref, alt)], populations=populations).get((xpos, ref, alt))
+        if annotation is None:
             raise ValueError("Could not find annotations for variant: " + str((xpos, ref, alt)))
-        annotation = doc['annotation']
+        return annotation
+
+    def get_annotations(self, variant_t_list, populations=None):
+        """
+        Returns the annotations for the given (xpos, ref, alt) tuples, keyed by tuple
+        Variants without annotations are left out. Variants that are not in the in-memory cache are looked up with one
+        query per batch of variants.
+        """
         if populations is None:
             populations = self.reference_population_slugs
-        if populations is not None:
-            freqs = {}
-            for p in populations:
-                freqs[p] = annotation['freqs'].get(p, 0.0)
-            annotation['freqs'] = freqs
-        return annotation
+
+        annotations = {}
+        missing_variant_ts = []
+        with self._annotation_cache_lock:
+            for variant_t in set(variant_t_list):
+                annotation = self._annotation_cache.pop(variant_t, None)
+                if annotation is None:
+                    missing_variant_ts.append(variant_t)
+                else:
+                    self._annotation_cache[variant_t] = annotations[variant_t] = annotation
+
+        if missing_variant_ts:
+            found_annotations = self._find_annotations(missing_variant_ts)
+            annotations.update(found_annotations)
+            with self._annotation_cache_lock:
+                self._annotation_cache.update(found_annotations)
+                while len(self._annotation_cache) > MAX_CACHED_ANNOTATIONS:
+                    self._annotation_cache.popitem(last=False)
+
+        # cached annotations are shared, so each caller gets its own copy of the frequencies it may update
+        return {
+            variant_t: dict(annotation, freqs={p: annotation['freqs'].get(p, 0.0) for p in populations})
+            for variant_t, annotation in annotations.items()
+        }
+
+    def _find_annotations(self, variant_t_list):
+        variants = self.get_annotator_datastore().variants
+        variant_t_list = sorted(variant_t_list)
+        annotations = {}
+        for i in range(0, len(variant_t_list), ANNOTATION_LOOKUP_BATCH_SIZE):
+            batch = set(variant_t_list[i:i + ANNOTATION_LOOKUP_BATCH_SIZE])
+            xposes = sorted({variant_t[0] for variant_t in batch})
+            for doc in variants.find({'xpos': {'$in': xposes}}, {'_id': False, 'xpos': True, 'ref': True, 'alt': True, 'annotation': True}):
+                variant_t = (doc['xpos'], doc['ref'], doc['alt'])
+                if variant_t in batch:
+                    annotations[variant_t] = doc['annotation']
+        return annotations
+
+    def _clear_cached_annotation(self, variant_t):
+        with self._annotation_cache_lock:
+            self._annotation_cache.pop(variant_t, None)
 
     def add_variants_to_annotator(self, variant_t_list, force_all=False):
         """
         Make sure that all the variants in variant_t_list are in annotator
         For the ones that are not, go through the whole load cycle
+        VEP batches are checkpointed once their annotations are saved, so rerunning after a failure skips them
+        Checkpoints are scoped to the run for variant_t_list, and only that run's checkpoints are removed once it ends
+        Without force_all the variants saved before a failure are not annotated again anyway, so the checkpointed
+        batches are only skipped on force_all reruns
         """
         if force_all:
             variants_to_add = variant_t_list
@@ -96,20 +150,33 @@ class VariantAnnotator():
             print "Getting custom annotations..."
             custom_annotations = self._custom_annotator.get_annotations_for_variants(variants_to_add)
             print "...done"
-        for variant_t, vep_annotation in self._vep_annotator.get_vep_annotations_for_variants(variants_to_add):
-            annotation = {
-                'vep_annotation': vep_annotation,
-                'freqs': self._population_frequency_store.get_frequencies(variant_t[0], variant_t[1], variant_t[2]),
-            }
-            add_convenience_annotations(annotation)
-            if self._custom_annotator:
-                annotation.update(custom_annotations[variant_t])
-            self.get_annotator_datastore().variants.update({
-                'xpos': variant_t[0],
-                'ref': variant_t[1],
-                'alt': variant_t[2]
-            }, {'$set': {'annotation': annotation},
-            }, upsert=True)
+
+        vep_batch_checkpoints = self.get_annotator_datastore().vep_batch_checkpoints
+        run_key = vep_annotations.get_vep_batch_key(variant_t_list)
+        completed_batch_keys = {
+            checkpoint['batch_key'] for checkpoint in vep_batch_checkpoints.find({'run_key': run_key})}
+        for batch_key, batch_annotations in self._vep_annotator.iterate_vep_annotation_batches(variants_to_add, completed_batch_keys):
+            freqs_by_variant = self._population_frequency_store.get_frequencies_for_variants(
+                [variant_t for variant_t, _ in batch_annotations])
+            for variant_t, vep_annotation in batch_annotations:
+                annotation = {
+                    'vep_annotation': vep_annotation,
+                    'freqs': freqs_by_variant[variant_t],
+                }
+                add_convenience_annotations(annotation)
+                if self._custom_annotator:
+                    annotation.update(custom_annotations[variant_t])
+                self._clear_cached_annotation(variant_t)
+                self.get_annotator_datastore().variants.update({
+                    'xpos': variant_t[0],
+                    'ref': variant_t[1],
+                    'alt': variant_t[2]
+                }, {'$set': {'annotation': annotation},
+                }, upsert=True)
+            vep_batch_checkpoints.insert({'run_key': run_key, 'batch_key': batch_key})
+
+        # once all the variants are annotated the checkpoints are removed, so annotating them again reruns VEP
+        vep_batch_checkpoints.remove({'run_key': run_key})
 
     def add_vcf_file_to_annotator(self, vcf_file_path, force_all=False):
         """
@@ -207,6 +274,7 @@ class VariantAnnotator():
                 import pprint
                 pprint.pprint(variant_t)
 
+            self._clear_cached_annotation(variant_t)
             self.get_annotator_datastore().variants.update(
                 {
                     'xpos': variant_t[0],
@@ -221,31 +289,31 @@ class VariantAnnotator():
             {'vcf_file_path': vcf_file_path, 'date_added': datetime.datetime.utcnow()}, upsert=True)
 
     def _get_missing_annotations(self, variant_t_list):
-        ret = []
-        for variant_t in variant_t_list:
-            if not self.get_annotator_datastore().variants.find_one(
-                {'xpos': variant_t[0],
-                 'ref': variant_t[1],
-                 'alt': variant_t[2]}):
-                ret.append(variant_t)
-        return ret
+        annotated_variant_ts = self._find_annotations(variant_t_list)
+        return [variant_t for variant_t in variant_t_list if variant_t not in annotated_variant_ts]
 
     def annotate_variant(self, variant, populations=None):
-        if not hasattr(variant, 'annotation') or not variant.annotation:
-            try:
-                annotation = self.get_annotation(variant.xpos, variant.ref, variant.alt, populations)
-            except ValueError, e:
-                sys.stderr.write("WARNING: " + str(e) + "\n")
-                variant.annotation = None
-                return
-
-            variant.annotation = annotation
-        else:
-            annotation = variant.annotation
-        # todo: gotta remove one
-        # ...or actually maybe both
-        variant.gene_ids = [g for g in annotation['gene_ids']]
-        variant.coding_gene_ids = [g for g in annotation['coding_gene_ids']]
+        self.annotate_variants([variant], populations=populations)
+
+    def annotate_variants(self, variants, populations=None):
+        """
+        Add the annotation, gene_ids and coding_gene_ids to each variant, looking up the annotations of all the variants
+        that are not already annotated at once
+        """
+        variants_to_annotate = [variant for variant in variants if not getattr(variant, 'annotation', None)]
+        annotations = self.get_annotations([variant.unique_tuple() for variant in variants_to_annotate], populations)
+        for variant in variants_to_annotate:
+            variant.annotation = annotations.get(variant.unique_tuple())
+            if variant.annotation is None:
+                sys.stderr.write("WARNING: Could not find annotations for variant: " + str(variant.unique_tuple()) + "\n")
+
+        for variant in variants:
+            if not variant.annotation:
+                continue
+            # todo: gotta remove one
+            # ...or actually maybe both
+            variant.gene_ids = [g for g in variant.annotation['gene_ids']]
+            variant.coding_gene_ids = [g for g in variant.annotation['coding_gene_ids']]
 
 
 def add_convenience_annotations(annotation):
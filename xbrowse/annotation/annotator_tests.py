@@ -0,0 +1,90 @@
+import mock
+from django.test import TestCase
+
+from xbrowse.annotation import annotator
+from xbrowse.annotation.annotator import VariantAnnotator
+
+ANNOTATION_DOCS = [
+    {'xpos': 1000001000, 'ref': 'C', 'alt': 'T', 'annotation': {'freqs': {'1kg_wgs_phase3': 0.1, 'exac_v3': 0.2}, 'gene_ids': ['ENSG1'], 'coding_gene_ids': ['ENSG1']}},
+    {'xpos': 1000001000, 'ref': 'C', 'alt': 'G', 'annotation': {'freqs': {'exac_v3': 0.3}, 'gene_ids': ['ENSG1'], 'coding_gene_ids': []}},
+    {'xpos': 2000005000, 'ref': 'A', 'alt': 'AT', 'annotation': {'freqs': {}, 'gene_ids': [], 'coding_gene_ids': []}},
+]
+
+
+def _find_docs(query, projection=None):
+    return [doc for doc in ANNOTATION_DOCS if doc['xpos'] in query['xpos']['$in']]
+
+
+class VariantAnnotatorTest(TestCase):
+
+    def setUp(self):
+        datastore_patcher = mock.patch.object(VariantAnnotator, 'get_annotator_datastore')
+        self.mock_db = datastore_patcher.start().return_value
+        self.mock_variants = self.mock_db.variants
+        self.mock_variants.find.side_effect = _find_docs
+        self.addCleanup(datastore_patcher.stop)
+        self.annotator = VariantAnnotator()
+
+    @mock.patch.object(annotator, 'ANNOTATION_LOOKUP_BATCH_SIZE', 2)
+    def test_get_annotations(self):
+        annotations = self.annotator.get_annotations(
+            [(2000005000, 'A', 'AT'), (1000001000, 'C', 'T'), (1000001000, 'C', 'A'), (1000001000, 'C', 'G')],
+            populations=['exac_v3', 'topmed'],
+        )
+        self.assertSetEqual(set(annotations.keys()), {(2000005000, 'A', 'AT'), (1000001000, 'C', 'T'), (1000001000, 'C', 'G')})
+        self.assertDictEqual(annotations[(1000001000, 'C', 'T')], {
+            'freqs': {'exac_v3': 0.2, 'topmed': 0.0}, 'gene_ids': ['ENSG1'], 'coding_gene_ids': ['ENSG1'],
+        })
+        # the variants are looked up in batches sorted by position
+        self.assertListEqual(
+            [call[0][0]['xpos']['$in'] for call in self.mock_variants.find.call_args_list],
+            [[1000001000], [1000001000, 2000005000]],
+        )
+
+        # cached annotations are not looked up again, and updating a returned annotation does not update the cache
+        annotations[(1000001000, 'C', 'T')]['freqs']['exac_v3'] = 1.0
+        self.mock_variants.find.reset_mock()
+        self.assertDictEqual(self.annotator.get_annotation(1000001000, 'C', 'T', populations=['exac_v3']), {
+            'freqs': {'exac_v3': 0.2}, 'gene_ids': ['ENSG1'], 'coding_gene_ids': ['ENSG1'],
+        })
+        self.mock_variants.find.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            self.annotator.get_annotation(1000001000, 'C', 'A')
+
+    @mock.patch.object(annotator, 'MAX_CACHED_ANNOTATIONS', 2)
+    def test_annotation_cache_size(self):
+        self.annotator.get_annotations([(1000001000, 'C', 'T'), (1000001000, 'C', 'G'), (2000005000, 'A', 'AT')])
+        self.mock_variants.find.reset_mock()
+
+        self.annotator.get_annotations([(1000001000, 'C', 'T'), (1000001000, 'C', 'G'), (2000005000, 'A', 'AT')])
+        self.assertEqual(len(self.mock_variants.find.call_args[0][0]['xpos']['$in']), 1)
+
+    @mock.patch('xbrowse.annotation.annotator.add_convenience_annotations', mock.MagicMock())
+    def test_add_variants_to_annotator(self):
+        self.mock_db.vep_batch_checkpoints.find.return_value = [{'run_key': 'run_1', 'batch_key': 'batch_1'}]
+        vep_annotation = [{'consequence': 'missense_variant'}]
+        mock_iterate_batches = mock.MagicMock(return_value=[
+            ('batch_2', [((1000001000, 'C', 'G'), vep_annotation)]),
+            ('batch_3', [((2000005000, 'A', 'AT'), vep_annotation), ((2000006000, 'A', 'C'), vep_annotation)]),
+        ])
+        self.annotator._vep_annotator.iterate_vep_annotation_batches = mock_iterate_batches
+        self.annotator._population_frequency_store.get_frequencies_for_variants = lambda variant_ts: {
+            variant_t: {'exac_v3': 0.1} for variant_t in variant_ts}
+
+        variant_ts = [(1000001000, 'C', 'T'), (1000001000, 'C', 'G'), (2000005000, 'A', 'AT'), (2000006000, 'A', 'C')]
+        with mock.patch.object(annotator.vep_annotations, 'get_vep_batch_key', lambda variant_ts: 'run_1'):
+            self.annotator.add_variants_to_annotator(variant_ts, force_all=True)
+
+        self.mock_db.vep_batch_checkpoints.find.assert_called_with({'run_key': 'run_1'})
+        mock_iterate_batches.assert_called_with(variant_ts, {'batch_1'})
+        self.assertEqual(self.mock_variants.update.call_count, 3)
+        self.assertDictEqual(self.mock_variants.update.call_args[0][1], {'$set': {'annotation': {
+            'vep_annotation': vep_annotation, 'freqs': {'exac_v3': 0.1},
+        }}})
+        self.assertListEqual(
+            [call[0][0] for call in self.mock_db.vep_batch_checkpoints.insert.call_args_list],
+            [{'run_key': 'run_1', 'batch_key': 'batch_2'}, {'run_key': 'run_1', 'batch_key': 'batch_3'}],
+        )
+        # only the checkpoints for this run are removed
+        self.mock_db.vep_batch_checkpoints.remove.assert_called_once_with({'run_key': 'run_1'})
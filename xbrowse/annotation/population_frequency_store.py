@@ -1,11 +1,17 @@
 import gzip
 import os
+import time
+import pymongo
 from xbrowse.utils import get_progressbar
 from xbrowse import vcf_stuff
 from xbrowse.utils import get_aaf
 from xbrowse.parsers.esp_vcf import get_variants_from_esp_file
 from xbrowse.core import genomeloc
 
+# Frequencies are loaded with one bulk write per batch of variants, and looked up with one query per batch of variants
+POPULATION_LOADING_BATCH_SIZE = 10000
+FREQUENCY_LOOKUP_BATCH_SIZE = 1000
+
 
 class PopulationFrequencyStore():
 
@@ -14,18 +20,30 @@ class PopulationFrequencyStore():
         self.reference_populations = reference_populations
 
     def get_frequencies(self, xpos, ref, alt):
-        d = self._get_db().pop_variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt}, projection={'_id': False})
-        if d is None:
-            d = {}
+        return self.get_frequencies_for_variants([(xpos, ref, alt)])[(xpos, ref, alt)]
 
-        return d
+    def get_frequencies_for_variants(self, variant_t_list):
+        """
+        Returns the population frequencies for each of the (xpos, ref, alt) tuples, keyed by tuple
+        Variants without frequencies are given an empty dict
+        """
+        variant_t_list = sorted(set(variant_t_list))
+        freqs_by_variant = {variant_t: {} for variant_t in variant_t_list}
+        for i in range(0, len(variant_t_list), FREQUENCY_LOOKUP_BATCH_SIZE):
+            xposes = sorted({variant_t[0] for variant_t in variant_t_list[i:i + FREQUENCY_LOOKUP_BATCH_SIZE]})
+            for d in self._get_db().pop_variants.find({'xpos': {'$in': xposes}}, projection={'_id': False}):
+                variant_t = (d['xpos'], d['ref'], d['alt'])
+                if variant_t in freqs_by_variant:
+                    freqs_by_variant[variant_t] = d
+        return freqs_by_variant
 
     def add_populations_to_variants(self, variants, population_slug_list):
         """
         variants is a list of annotated variants, this adds more population frequencies to that annotation
         """
+        freqs_by_variant = self.get_frequencies_for_variants([variant.unique_tuple() for variant in variants])
         for variant in variants:
-            freqs = self.get_frequencies(variant.xpos, variant.ref, variant.alt)
+            freqs = freqs_by_variant[variant.unique_tuple()]
             for slug in population_slug_list:
                 if slug in freqs:
                     variant.annotation['freqs'][slug] = freqs[slug]
@@ -42,13 +60,6 @@ class PopulationFrequencyStore():
     def _ensure_indices(self):
         self._get_db().pop_variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
 
-    def _add_population_frequency(self, xpos, ref, alt, population, freq):
-        self._get_db().pop_variants.update(
-            {'xpos': xpos, 'ref': ref, 'alt': alt},
-            {'$set': {population: freq}},
-            upsert=True
-        )
-
     def load_populations(self, population_list):
         """
         Load all the populations described in population_list into annotator
@@ -57,10 +68,50 @@ class PopulationFrequencyStore():
         for population in population_list:
             self.load_population(population)
 
-    def load_population(self, population):
+    def load_population(self, population, batch_size=POPULATION_LOADING_BATCH_SIZE):
         """
         Take a population and a data source; extract and load it into annotator
         Data source can be VCF file, VCF Counts file, or a counts dir (in the case of ESP data)
+        Returns the number of variants loaded
+        """
+        return self._bulk_add_population_frequencies(
+            population['slug'], self._iterate_population_frequencies(population), batch_size=batch_size)
+
+    def _bulk_add_population_frequencies(self, population_slug, frequencies, batch_size=POPULATION_LOADING_BATCH_SIZE):
+        """
+        Upsert the (xpos, ref, alt, freq) tuples with unordered bulk writes of batch_size variants, reporting the
+        throughput after every million variants
+        """
+        pop_variants = self._get_db().pop_variants
+        start_time = time.time()
+        num_loaded = 0
+        batch = {}
+
+        def write_batch():
+            pop_variants.bulk_write([
+                pymongo.UpdateOne({'xpos': xpos, 'ref': ref, 'alt': alt}, {'$set': {population_slug: freq}}, upsert=True)
+                for (xpos, ref, alt), freq in batch.items()
+            ], ordered=False)
+            batch.clear()
+
+        for xpos, ref, alt, freq in frequencies:
+            # a variant listed more than once within a batch keeps its last frequency, as it would with single upserts
+            batch[(xpos, ref, alt)] = freq
+            num_loaded += 1
+            if len(batch) >= batch_size:
+                write_batch()
+            if num_loaded % 1000000 == 0:
+                print("Loaded %d %s variants (%d variants/s)" % (num_loaded, population_slug, num_loaded / (time.time() - start_time)))
+        if batch:
+            write_batch()
+
+        elapsed = time.time() - start_time
+        print("Loaded %d %s variants in %0.1fs (%d variants/s)" % (num_loaded, population_slug, elapsed, num_loaded / elapsed if elapsed else 0))
+        return num_loaded
+
+    def _iterate_population_frequencies(self, population):
+        """
+        Iterate (xpos, ref, alt, freq) tuples for the population data source
         """
         if population['file_type'] == 'vcf':
             if population['file_path'].endswith('.gz'):
@@ -75,7 +126,7 @@ class PopulationFrequencyStore():
             for variant in vcf_stuff.iterate_vcf(vcf_file, genotypes=True, genotype_meta=False):
                 progress.update(progress_file.tell())
                 freq = get_aaf(variant)
-                self._add_population_frequency(variant.xpos, variant.ref, variant.alt, population['slug'], freq)
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
 
         elif population['file_type'] == 'sites_vcf':
@@ -112,13 +163,7 @@ class PopulationFrequencyStore():
                 else:
                     freq = float(variant.extras.get(meta_key, 0).split(',')[variant.extras['alt_allele_pos']])
 
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
 
         #
@@ -132,13 +177,7 @@ class PopulationFrequencyStore():
                 progress = get_progressbar(file_size, 'Loading ESP file: {}'.format(filename))
                 for variant in get_variants_from_esp_file(f):
                     progress.update(f.tell())
-                    self._add_population_frequency(
-                        variant['xpos'],
-                        variant['ref'],
-                        variant['alt'],
-                        population['slug'],
-                        variant[population['counts_key']]
-                    )
+                    yield variant['xpos'], variant['ref'], variant['alt'], variant[population['counts_key']]
                 f.close()
         #
         # text file of allele counts, as Monkol has been using for the joint calling data
@@ -165,13 +204,7 @@ class PopulationFrequencyStore():
                 if int(fields[5]) == 0:
                     continue
                 freq = float(fields[4]) / float(fields[5])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             counts_file.close()
 
         # this is now the canonical allele frequency file -
@@ -193,13 +226,7 @@ class PopulationFrequencyStore():
                 ref = fields[1]
                 alt = fields[2]
                 freq = float(fields[3])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             counts_file.close()
 
         elif population['file_type'] == 'tsv_file':
@@ -223,13 +250,7 @@ class PopulationFrequencyStore():
                 freq = float(fields[4])
 
                 xpos = genomeloc.get_single_location(chrom, pos)
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             freq_file.close()
 
         elif population['file_type'] == 'sites_vcf_with_counts':
@@ -270,13 +291,7 @@ class PopulationFrequencyStore():
                     freq = 0.0
                 else:
                     freq = float(ac)/an
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
         else:
             raise ValueError("Unexpected population['file_type']: " + population['file_type'])
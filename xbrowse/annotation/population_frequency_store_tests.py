@@ -0,0 +1,75 @@
+import mock
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+
+from xbrowse.annotation import population_frequency_store
+from xbrowse.annotation.population_frequency_store import PopulationFrequencyStore
+
+SITES_VCF = '''##fileformat=VCFv4.1
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+1\t1000\t.\tC\tT\t100\tPASS\tAF=0.1
+1\t1000\t.\tC\tT\t100\tPASS\tAF=0.15
+1\t2000\t.\tCA\tC,CAA\t100\tPASS\tAF=0.2,0.3
+2\t5000\t.\tA\tAT\t100\tPASS\tAF=0.5
+'''
+
+POP_VARIANTS = [
+    {'xpos': 1000001000, 'ref': 'C', 'alt': 'T', 'exac': 0.1},
+    {'xpos': 1000001000, 'ref': 'C', 'alt': 'G', 'exac': 0.2, 'gnomad': 0.3},
+    {'xpos': 2000005000, 'ref': 'A', 'alt': 'AT', 'gnomad': 0.01},
+]
+
+
+class PopulationFrequencyStoreTest(TestCase):
+
+    def setUp(self):
+        self.mock_db = mock.MagicMock()
+        self.store = PopulationFrequencyStore(get_db=lambda: self.mock_db, reference_populations=[])
+
+    @mock.patch('xbrowse.annotation.population_frequency_store.get_progressbar', mock.MagicMock())
+    def test_load_population(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        vcf_path = os.path.join(temp_dir, 'sites.vcf')
+        with open(vcf_path, 'w') as f:
+            f.write(SITES_VCF)
+
+        num_loaded = self.store.load_population({'slug': 'exac', 'file_type': 'sites_vcf', 'file_path': vcf_path}, batch_size=2)
+        self.assertEqual(num_loaded, 5)
+
+        batches = []
+        for call in self.mock_db.pop_variants.bulk_write.call_args_list:
+            self.assertDictEqual(call[1], {'ordered': False})
+            batches.append(sorted(
+                (op._filter['xpos'], op._filter['ref'], op._filter['alt'], op._doc['$set']['exac']) for op in call[0][0]
+            ))
+            self.assertTrue(all(op._upsert for op in call[0][0]))
+        # a variant repeated within a batch is only written once, with its last frequency
+        self.assertListEqual(batches, [
+            [(1000001000, 'C', 'T', 0.15), (1000002000, 'CA', 'C', 0.2)],
+            [(1000002000, 'C', 'CA', 0.3), (2000005000, 'A', 'AT', 0.5)],
+        ])
+
+    @mock.patch.object(population_frequency_store, 'FREQUENCY_LOOKUP_BATCH_SIZE', 2)
+    def test_get_frequencies_for_variants(self):
+        self.mock_db.pop_variants.find.side_effect = lambda query, projection: [
+            dict(d) for d in POP_VARIANTS if d['xpos'] in query['xpos']['$in']]
+
+        freqs = self.store.get_frequencies_for_variants(
+            [(2000005000, 'A', 'AT'), (1000001000, 'C', 'T'), (1000001000, 'C', 'A'), (1000001000, 'C', 'T')])
+        self.assertDictEqual(freqs, {
+            (1000001000, 'C', 'A'): {},
+            (1000001000, 'C', 'T'): POP_VARIANTS[0],
+            (2000005000, 'A', 'AT'): POP_VARIANTS[2],
+        })
+        self.assertListEqual(
+            [call[0][0]['xpos']['$in'] for call in self.mock_db.pop_variants.find.call_args_list],
+            [[1000001000], [2000005000]],
+        )
+
+        variant = mock.MagicMock(annotation={'freqs': {}})
+        variant.unique_tuple.return_value = (1000001000, 'C', 'G')
+        self.store.add_populations_to_variants([variant], ['gnomad', 'topmed'])
+        self.assertDictEqual(variant.annotation['freqs'], {'gnomad': 0.3, 'topmed': 0.0})
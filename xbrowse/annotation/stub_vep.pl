@@ -0,0 +1,40 @@
+#!/usr/bin/env perl
+# Stands in for variant_effect_predictor.pl in tests and local development, without the VEP cache.
+# Reads the sites VCF given by -i and writes it to -o with one missense CSQ annotation per alt allele.
+# Set STUB_VEP_FAIL_POS to a position to make the run fail on the batch that contains it, or STUB_VEP_HANG_POS to make
+# the run hang on it.
+use strict;
+use warnings;
+
+my ($input_vcf, $output_vcf);
+for (my $i = 0; $i < @ARGV; $i++) {
+    $input_vcf = $ARGV[++$i] if $ARGV[$i] eq '-i';
+    $output_vcf = $ARGV[++$i] if $ARGV[$i] eq '-o';
+}
+die "usage: stub_vep.pl -i input.vcf -o output.vcf\n" unless $input_vcf && $output_vcf;
+
+open(my $in, '<', $input_vcf) or die "Could not open $input_vcf: $!\n";
+open(my $out, '>', $output_vcf) or die "Could not open $output_vcf: $!\n";
+while (my $line = <$in>) {
+    if ($line =~ /^#CHROM/) {
+        print $out '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. ' .
+            'Format: Allele|Gene|Feature|Feature_type|Consequence|ALLELE_NUM|SYMBOL|CANONICAL|BIOTYPE">' . "\n";
+    }
+    if ($line =~ /^#/) {
+        print $out $line;
+        next;
+    }
+    chomp $line;
+    my @fields = split(/\t/, $line);
+    sleep 600 if defined $ENV{STUB_VEP_HANG_POS} && $fields[1] eq $ENV{STUB_VEP_HANG_POS};
+    die "Stub VEP failure at position $fields[1]\n" if defined $ENV{STUB_VEP_FAIL_POS} && $fields[1] eq $ENV{STUB_VEP_FAIL_POS};
+    my @alts = split(/,/, $fields[4]);
+    my @csq = map {
+        join('|', $alts[$_], 'ENSG00000000001', 'ENST00000000001', 'Transcript', 'missense_variant', $_ + 1, 'STUB',
+            'YES', 'protein_coding')
+    } 0..$#alts;
+    $fields[7] = 'CSQ=' . join(',', @csq);
+    print $out join("\t", @fields) . "\n";
+}
+close($in);
+close($out);
@@ -1,9 +1,13 @@
 import datetime
+import hashlib
 import os
 import re
-#import sh
+import signal
+import subprocess
 import tempfile
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
 from xbrowse import vcf_stuff
 from tqdm import tqdm
 
@@ -59,15 +63,17 @@ class HackedVEPAnnotator():
     This class is a wrapper around VEP that provides a pythonic interface to VEP annotations
     It should just call the REST API, but that is slow, so it spins out subprocesses :(
     """
-    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None):
+    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None, vep_processes=1):
         self._vep_perl_path = vep_perl_path
         self._vep_cache_dir = vep_cache_dir
         self._vep_batch_size = vep_batch_size
         self._human_ancestor_fa = human_ancestor_fa
+        self._vep_processes = vep_processes
 
-    def _run_vep(self, input_vcf, output_vcf):
+    def _run_vep(self, input_vcf, output_vcf, vep_processes=None):
         """
         Just run VEP to the xbrowse configurations
+        If a _VepProcesses is given, the VEP process is tracked by it so it can be killed before it finishes
         """
         vep_command = [
             self._vep_perl_path,
@@ -89,9 +95,12 @@ class HackedVEPAnnotator():
             ]
 
         print("Running VEP:\n" + " ".join(vep_command))
-        sh.perl(vep_command)
+        if vep_processes is None:
+            subprocess.check_call(["perl"] + vep_command)
+        else:
+            vep_processes.check_call(["perl"] + vep_command)
 
-    def get_vep_annotations_for_variants(self, variant_t_list):
+    def get_vep_annotations_for_variants(self, variant_t_list, completed_batch_keys=None):
         """
         Load annotations for a set of variants
         - write these annotations to a temporary vcf file
@@ -99,36 +108,116 @@ class HackedVEPAnnotator():
         - loads newly annotated VCF to annotator
         Obviously there should be a better way to do this, but this is what we have for now
         """
+        for batch_key, annotations in self.iterate_vep_annotation_batches(variant_t_list, completed_batch_keys):
+            for variant_t, annotation in annotations:
+                yield variant_t, annotation
 
-        def process_batch(variant_t_batch):
-            vep_input_file_path = tempfile.mkstemp()[1]
-            vep_output_file_path = tempfile.mkstemp()[1]
-
-            vep_input_file = open(vep_input_file_path, 'w')
-            vcf_stuff.write_sites_vcf(vep_input_file, variant_t_batch)
-            vep_input_file.close()
+    def iterate_vep_annotation_batches(self, variant_t_list, completed_batch_keys=None):
+        """
+        Run VEP on batches of vep_batch_size variants, keeping vep_processes batches in flight, and yield a
+        (batch key, [(variant_t, vep annotation), ...]) tuple for each batch in the order of variant_t_list.
+        Batches with a key in completed_batch_keys are skipped, so an interrupted run can resume where it stopped.
+        """
+        completed_batch_keys = completed_batch_keys or set()
+        pool = ThreadPool(self._vep_processes)
+        vep_processes = _VepProcesses()
+        try:
+            pending_batches = deque()
+            for batch in _iterate_batches(variant_t_list, self._vep_batch_size):
+                batch_key = get_vep_batch_key(batch)
+                if batch_key in completed_batch_keys:
+                    print("Skipping {} variants through {} that were already annotated".format(len(batch), batch[-1][0]))
+                    continue
+
+                print("Running VEP on next {} variants, through {}".format(len(batch), batch[-1][0]))
+                pending_batches.append((batch_key, pool.apply_async(
+                    self._get_vep_annotations_for_batch, (batch, vep_processes))))
+                # the next batch is queued while the oldest is waited on, so vep_processes batches stay in flight
+                if len(pending_batches) > self._vep_processes:
+                    batch_key, result = pending_batches.popleft()
+                    yield batch_key, result.get()
+
+            while pending_batches:
+                batch_key, result = pending_batches.popleft()
+                yield batch_key, result.get()
+        finally:
+            # terminating the pool does not stop the VEP runs its threads are waiting on, so they are killed directly
+            vep_processes.kill_all()
+            pool.terminate()
+
+    def _get_vep_annotations_for_batch(self, variant_t_batch, vep_processes=None):
+        vep_input_file_handle, vep_input_file_path = tempfile.mkstemp()
+        vep_output_file_handle, vep_output_file_path = tempfile.mkstemp()
+        os.close(vep_input_file_handle)
+        os.close(vep_output_file_handle)
+        try:
+            with open(vep_input_file_path, 'w') as vep_input_file:
+                vcf_stuff.write_sites_vcf(vep_input_file, variant_t_batch)
 
-            self._run_vep(vep_input_file_path, vep_output_file_path)
+            self._run_vep(vep_input_file_path, vep_output_file_path, vep_processes=vep_processes)
 
             with open(vep_output_file_path) as f:
-                ret = list(parse_vep_annotations_from_vcf(f))
+                return [(variant.unique_tuple(), annotation) for variant, annotation in parse_vep_annotations_from_vcf(f)]
+        finally:
             os.remove(vep_input_file_path)
             os.remove(vep_output_file_path)
-            return ret
-
-        batch = []
-        for variant_t in variant_t_list:
-            batch.append(variant_t)
-            if len(batch) == self._vep_batch_size:
-                print "Running VEP on next {} variants, through {}".format(self._vep_batch_size, variant_t[0])
-                annotations = process_batch(batch)
-                for variant, annotation in annotations:
-                    yield variant.unique_tuple(), annotation
-                batch = []
-        if len(batch) > 0:
-            annotations = process_batch(batch)
-            for variant, annotation in annotations:
-                yield variant.unique_tuple(), annotation
+
+
+class _VepProcesses(object):
+    """
+    Tracks the VEP processes started for a run, so they can all be killed when the run is stopped early
+    Each process is started in its own process group, so killing it also kills the workers VEP forks
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._killed = False
+
+    def check_call(self, command):
+        with self._lock:
+            if self._killed:
+                raise RuntimeError("VEP run was stopped")
+            process = subprocess.Popen(command, preexec_fn=os.setsid)
+            self._processes.add(process)
+        try:
+            return_code = process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, command)
+
+    def kill_all(self):
+        with self._lock:
+            self._killed = True
+            for process in self._processes:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    # the process already exited
+                    pass
+
+
+def _iterate_batches(variant_t_list, batch_size):
+    batch = []
+    for variant_t in variant_t_list:
+        batch.append(variant_t)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_vep_batch_key(variant_t_batch):
+    """
+    Returns a key identifying the batch of variants, which is the same whenever the same variants are annotated
+    """
+    batch_hash = hashlib.md5()
+    for variant_t in variant_t_batch:
+        batch_hash.update('{}-{}-{}\n'.format(*variant_t))
+    return batch_hash.hexdigest()
 
 
 def parse_vep_annotations_from_vcf(vcf_file_obj):
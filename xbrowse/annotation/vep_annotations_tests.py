@@ -0,0 +1,68 @@
+import mock
+import os
+import subprocess
+import time
+from django.test import TestCase
+
+from xbrowse.annotation.vep_annotations import HackedVEPAnnotator, get_vep_batch_key
+
+STUB_VEP_PATH = os.path.join(os.path.dirname(__file__), 'stub_vep.pl')
+
+VARIANT_TS = [
+    (1000001000, 'C', 'T'),
+    (1000002000, 'CA', 'C'),
+    (1000003000, 'G', 'A'),
+    (2000001000, 'A', 'AT'),
+    (2000002000, 'T', 'G'),
+]
+
+
+class VepAnnotationsTest(TestCase):
+
+    def setUp(self):
+        self.vep_annotator = HackedVEPAnnotator(
+            vep_perl_path=STUB_VEP_PATH, vep_cache_dir='', vep_batch_size=2, vep_processes=2)
+
+    def test_get_vep_annotations_for_variants(self):
+        annotations = list(self.vep_annotator.get_vep_annotations_for_variants(VARIANT_TS))
+        self.assertListEqual([variant_t for variant_t, _ in annotations], VARIANT_TS)
+        vep_annotation = annotations[1][1]
+        self.assertEqual(len(vep_annotation), 1)
+        self.assertEqual(vep_annotation[0]['gene'], 'ENSG00000000001')
+        self.assertEqual(vep_annotation[0]['consequence'], 'missense_variant')
+
+    @mock.patch.dict(os.environ, {'STUB_VEP_FAIL_POS': '3000'})
+    def test_resume_vep_annotation(self):
+        batch_keys = []
+        with self.assertRaises(subprocess.CalledProcessError):
+            for batch_key, annotations in self.vep_annotator.iterate_vep_annotation_batches(VARIANT_TS):
+                batch_keys.append(batch_key)
+        self.assertListEqual(batch_keys, [get_vep_batch_key(VARIANT_TS[:2])])
+
+        del os.environ['STUB_VEP_FAIL_POS']
+        with mock.patch.object(self.vep_annotator, '_run_vep', wraps=self.vep_annotator._run_vep) as mock_run_vep:
+            batches = list(self.vep_annotator.iterate_vep_annotation_batches(VARIANT_TS, completed_batch_keys=set(batch_keys)))
+        self.assertEqual(mock_run_vep.call_count, 2)
+        self.assertListEqual(
+            [[variant_t for variant_t, _ in annotations] for _, annotations in batches], [VARIANT_TS[2:4], VARIANT_TS[4:]])
+
+    @mock.patch.dict(os.environ, {'STUB_VEP_HANG_POS': '3000'})
+    def test_stop_vep_annotation(self):
+        vep_processes = []
+        popen = subprocess.Popen
+
+        def _popen(*args, **kwargs):
+            vep_processes.append(popen(*args, **kwargs))
+            return vep_processes[-1]
+
+        with mock.patch('xbrowse.annotation.vep_annotations.subprocess.Popen', side_effect=_popen):
+            batches = self.vep_annotator.iterate_vep_annotation_batches(VARIANT_TS)
+            batch_key, _ = next(batches)
+            self.assertEqual(batch_key, get_vep_batch_key(VARIANT_TS[:2]))
+
+            # stopping the iteration kills the VEP run that is still in progress
+            batches.close()
+            deadline = time.time() + 10
+            while any(process.poll() is None for process in vep_processes) and time.time() < deadline:
+                time.sleep(0.1)
+        self.assertTrue(all(process.poll() is not None for process in vep_processes))
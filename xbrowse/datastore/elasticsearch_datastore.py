@@ -19,7 +19,6 @@ from xbrowse import Variant
 import datastore
 from pprint import pformat
 
-import elasticsearch
 import elasticsearch_dsl
 from elasticsearch_dsl import Q
 
@@ -126,7 +125,8 @@ class ElasticsearchDatastore(datastore.Datastore):
         ):
         from xbrowse_server.base.models import Project, Family, Individual
         from seqr.models import Sample
-        from seqr.utils.es_utils import _liftover_grch38_to_grch37
+        from seqr.utils.es_utils import get_es_client, get_index_mappings
+        from seqr.utils.liftover_utils import get_liftover
         from xbrowse_server.mall import get_reference
 
         redis_client = None
@@ -202,16 +202,16 @@ class ElasticsearchDatastore(datastore.Datastore):
 
         query_json = self._make_db_query(genotype_filter, variant_filter)
 
-        es_client = elasticsearch.Elasticsearch(host=settings.ELASTICSEARCH_SERVICE_HOSTNAME, timeout=30)
-        mapping = es_client.indices.get_mapping(str(elasticsearch_index) + "*")
-        index_fields = {}
+        es_client = get_es_client()
+        mapping = get_index_mappings(str(elasticsearch_index) + "*", es_client)
+        index_fields = set()
         is_parent_child = False
         is_nested = False
-        if elasticsearch_index in mapping and 'join_field' in mapping[elasticsearch_index]["mappings"]["variant"]["properties"]:
+        if elasticsearch_index in mapping and 'join_field' in mapping[elasticsearch_index]["fields"]:
             # Nested indices are not sharded so all samples are in the single index
             logger.info("matching indices: " + str(elasticsearch_index))
             is_parent_child = True
-        elif elasticsearch_index in mapping and 'genotypes' in mapping[elasticsearch_index]["mappings"]["variant"]["properties"]:
+        elif elasticsearch_index in mapping and 'genotypes' in mapping[elasticsearch_index]["fields"]:
             # Nested indices are not sharded so all samples are in the single index
             logger.info("matching indices: " + str(elasticsearch_index))
             is_nested = True
@@ -224,9 +224,9 @@ class ElasticsearchDatastore(datastore.Datastore):
             for raw_sample_id in family_individual_ids_to_sample_ids.values():
                 sample_id = _encode_name(raw_sample_id)
                 for index_name, index_mapping in mapping.items():
-                    if sample_id+"_num_alt" in index_mapping["mappings"]["variant"]["properties"]:
+                    if sample_id+"_num_alt" in index_mapping["fields"]:
                         matching_indices.append(index_name)
-                        index_fields.update(index_mapping["mappings"]["variant"]["properties"])
+                        index_fields.update(index_mapping["fields"])
                 if len(matching_indices) > 0:
                     break
 
@@ -236,7 +236,7 @@ class ElasticsearchDatastore(datastore.Datastore):
                 elif not mapping:
                     logger.error("no es mapping found for found with prefix %s" % (elasticsearch_index))
                 else:
-                    logger.error("%s not found in %s:\n%s" % (indiv_id, elasticsearch_index, pformat(index_mapping["mappings"]["variant"]["properties"])))
+                    logger.error("%s not found in %s:\n%s" % (indiv_id, elasticsearch_index, pformat(index_mapping["fields"])))
             else:
                 elasticsearch_index = ",".join(matching_indices)
                 logger.info("matching indices: " + str(elasticsearch_index))
@@ -245,7 +245,7 @@ class ElasticsearchDatastore(datastore.Datastore):
                 
         if not index_fields:
             for index_mapping in mapping.values():
-                index_fields.update(index_mapping["mappings"]["variant"]["properties"])
+                index_fields.update(index_mapping["fields"])
 
         s = elasticsearch_dsl.Search(using=es_client, index=elasticsearch_index) #",".join(indices))
 
@@ -671,11 +671,11 @@ class ElasticsearchDatastore(datastore.Datastore):
 
             if project.genome_version == GENOME_VERSION_GRCh38:
                 grch37_coord = None
-                liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
+                liftover_grch38_to_grch37 = get_liftover(GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37)
                 if liftover_grch38_to_grch37:
-                    grch37_coord = liftover_grch38_to_grch37.convert_coordinate("chr%s" % hit["contig"].replace("chr", ""), int(hit["start"]))
-                    if grch37_coord and grch37_coord[0]:
-                        grch37_coord = "%s-%s-%s-%s "% (grch37_coord[0][0], grch37_coord[0][1], hit["ref"], hit["alt"])
+                    grch37_coord = liftover_grch38_to_grch37.convert_coordinate(hit["contig"], hit["start"])
+                    if grch37_coord:
+                        grch37_coord = "chr%s-%s-%s-%s "% (grch37_coord[0], grch37_coord[1], hit["ref"], hit["alt"])
                     else:
                         grch37_coord = None
             else:
@@ -1,8 +1,10 @@
 from collections import defaultdict, OrderedDict
 import copy
 from datetime import date, datetime
+import hashlib
 import itertools
 import logging
+import multiprocessing
 import os
 import pysam
 import pymongo
@@ -58,6 +60,172 @@ def _add_index_fields_to_variant(variant_dict, annotation=None):
         variant_dict['db_gene_ids'] = annotation['gene_ids']
 
 
+# Set in the parent process before the VCF loading processes are forked, so they can use the datastore
+_SHARD_LOADING_CONTEXT = {}
+
+VARIANT_INDEX_KEYS = ['xpos', 'ref', 'alt']
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# Number of VCF variants whose annotations are looked up at once while loading
+ANNOTATION_BATCH_SIZE = 1000
+# Number of buffered family-variants after which they are inserted and the load is checkpointed
+INSERT_BATCH_SIZE = 2000
+# Number of duplicate variants removed per delete, so no single query holds every duplicate id in the collection
+DELETE_BATCH_SIZE = 1000
+
+
+def _load_vcf_shard_in_process(shard):
+    return _SHARD_LOADING_CONTEXT['datastore']._load_vcf_shard(shard, **_SHARD_LOADING_CONTEXT['kwargs'])
+
+
+def _ensure_unique_variant_index(collection):
+    """
+    Variants are deduplicated by a unique (xpos, ref, alt) index, which replaces the non-unique index created by
+    earlier versions of the loader. As those loaders could insert a variant more than once, duplicates are removed
+    before the index is replaced.
+    """
+    index_keys = [(key, pymongo.ASCENDING) for key in VARIANT_INDEX_KEYS]
+    non_unique_index_names = [
+        index_name for index_name, index_info in collection.index_information().items()
+        if [key for key, _ in index_info['key']] == VARIANT_INDEX_KEYS and not index_info.get('unique')
+    ]
+    if not non_unique_index_names:
+        collection.create_index(index_keys, unique=True)
+        return
+
+    _remove_duplicate_variants(collection)
+    for index_name in non_unique_index_names:
+        collection.drop_index(index_name)
+    try:
+        collection.create_index(index_keys, unique=True)
+    except pymongo.errors.DuplicateKeyError:
+        # a duplicate was inserted while the index was replaced, so the collection keeps a non-unique index
+        collection.create_index(index_keys)
+        raise
+
+
+def _remove_duplicate_variants(collection):
+    duplicates = collection.aggregate([
+        {'$group': {'_id': {key: '$' + key for key in VARIANT_INDEX_KEYS}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ], allowDiskUse=True)
+    duplicate_ids = (doc_id for duplicate in duplicates for doc_id in duplicate['ids'][1:])
+    num_removed = 0
+    while True:
+        duplicate_ids_batch = list(itertools.islice(duplicate_ids, 0, DELETE_BATCH_SIZE))
+        if not duplicate_ids_batch:
+            break
+        collection.delete_many({'_id': {'$in': duplicate_ids_batch}})
+        num_removed += len(duplicate_ids_batch)
+    if num_removed:
+        logger.info("Removed %d duplicate variants from %s" % (num_removed, collection.name))
+
+
+def _insert_family_variants(collection, family_variant_dicts):
+    """
+    Insert the variants in bulk, skipping variants that are already in the collection
+    Returns the number of inserted variants
+    """
+    try:
+        return len(collection.insert_many(family_variant_dicts, ordered=False).inserted_ids)
+    except pymongo.errors.BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(error['code'] != DUPLICATE_KEY_ERROR_CODE for error in errors):
+            raise
+        return e.details['nInserted']
+
+
+def _get_vcf_load_id(vcf_file_path, family_info_list):
+    coll_names = sorted(family['coll_name'] for family in family_info_list)
+    return '{}:{}'.format(vcf_file_path, hashlib.md5(','.join(coll_names)).hexdigest())
+
+
+def _get_vcf_shards(vcf_file_path, start_from_chrom=None, end_with_chrom=None):
+    """
+    Split a tabix indexed VCF into (contig, start, end) regions, with rows in a region having start < POS <= end
+    A VCF without an index is loaded as a single region, with a contig of None
+    """
+    chrom_list = list(map(str, range(1,23))) + ['X','Y']
+    chrom_list_start_index = 0
+    if start_from_chrom:
+        logger.info("Start chrom: chr%s" % start_from_chrom)
+        chrom_list_start_index = chrom_list.index(start_from_chrom.replace("chr", "").upper())
+    chrom_list_end_index = len(chrom_list)
+    if end_with_chrom:
+        logger.info("End chrom: chr%s" % end_with_chrom)
+        chrom_list_end_index = chrom_list.index(end_with_chrom.replace("chr", "").upper())
+    chroms_to_load = set(chrom_list[chrom_list_start_index:chrom_list_end_index+1])
+
+    if not os.path.exists(vcf_file_path + '.tbi'):
+        if start_from_chrom or end_with_chrom:
+            logger.warn("WARNING: %s is not tabix indexed, so all chromosomes will be loaded" % vcf_file_path)
+        return [(None, 0, None)]
+
+    shard_size = settings.MONGO_VCF_LOADING_SHARD_SIZE
+    shards = []
+    for contig in pysam.TabixFile(vcf_file_path).contigs:
+        chrom = contig.replace("chr", "").upper()
+        if (start_from_chrom or end_with_chrom) and chrom not in chroms_to_load:
+            continue
+        chrom_size = CHROMOSOME_SIZES.get(chrom)
+        if not chrom_size:
+            shards.append((contig, 0, None))
+            continue
+        shards += [(contig, start, min(start + shard_size, chrom_size)) for start in range(0, chrom_size, shard_size)]
+        # any rows past the reference chromosome length are loaded with the last region
+        shards[-1] = (contig, shards[-1][1], None)
+    return shards
+
+
+def _get_shard_name(shard):
+    contig, start, end = shard
+    if contig is None:
+        return 'all'
+    return '{}:{}-{}'.format(contig, start, end or '')
+
+
+def _iterate_vcf_shard(vcf_file_path, shard, resume_xpos=None, row_position=None):
+    """
+    Iterate the header and rows of one region of the VCF, starting from resume_xpos if given
+    The position of the last row is kept in row_position as the rows are read
+    """
+    contig, start, end = shard
+    if contig is None:
+        vcf_file = compressed_file(vcf_file_path)
+        header = []
+        rows = vcf_file
+    else:
+        tabix_file = pysam.TabixFile(vcf_file_path)
+        header = tabix_file.header
+        fetch_start = start
+        if resume_xpos:
+            fetch_start = max(start, genomeloc.get_chr_pos(resume_xpos)[1] - 1)
+        rows = tabix_file.fetch(contig, fetch_start, end)
+
+    for line in header:
+        yield line
+
+    for line in rows:
+        if line.startswith('#'):
+            yield line
+            continue
+
+        fields = line.split('\t', 2)
+        pos = int(fields[1])
+        # rows overlapping the start of the region belong to the previous region
+        if pos <= start:
+            continue
+        try:
+            xpos = genomeloc.get_xpos(fields[0], pos)
+        except KeyError:
+            xpos = None
+        if resume_xpos and xpos and xpos < resume_xpos:
+            continue
+        if row_position is not None:
+            row_position['xpos'] = xpos
+        yield line
+
+
 class MongoDatastore(datastore.Datastore):
 
     def __init__(self, db_name, annotator, custom_population_store=None, custom_populations_map=None):
@@ -117,17 +285,23 @@ class MongoDatastore(datastore.Datastore):
         if not collection:
             logger.error("Error: mongodb collection not found for project %s family %s " % (project_id, family_id))
             return
-        for i, variant_dict in enumerate(collection.find({'$and' : [{k: v} for k, v in db_query.items()]}).sort('xpos').limit(settings.VARIANT_QUERY_RESULTS_LIMIT+5)):
-            if i >= settings.VARIANT_QUERY_RESULTS_LIMIT:
-                raise Exception("ERROR: this search exceeded the %s variant result size limit. Please set additional filters and try again." % settings.VARIANT_QUERY_RESULTS_LIMIT)
-
-            variant = Variant.fromJSON(variant_dict)
-            variant.set_extra('project_id', project_id)
-            variant.set_extra('family_id', family_id)
-            self.add_annotations_to_variants([variant], project_id)
-
-            if passes_variant_filter(variant, variant_filter)[0]:
-                yield variant
+        variant_dicts = enumerate(collection.find({'$and' : [{k: v} for k, v in db_query.items()]}).sort('xpos').limit(settings.VARIANT_QUERY_RESULTS_LIMIT+5))
+        while True:
+            # annotations are looked up for a batch of variants at a time
+            variant_dicts_batch = list(itertools.islice(variant_dicts, 0, ANNOTATION_BATCH_SIZE))
+            if not variant_dicts_batch:
+                break
+
+            variants = []
+            for i, variant_dict in variant_dicts_batch:
+                if i >= settings.VARIANT_QUERY_RESULTS_LIMIT:
+                    raise Exception("ERROR: this search exceeded the %s variant result size limit. Please set additional filters and try again." % settings.VARIANT_QUERY_RESULTS_LIMIT)
+                variants.append(Variant.fromJSON(variant_dict))
+            self.add_annotations_to_variants(variants, project_id, family_id=family_id)
+
+            for variant in variants:
+                if passes_variant_filter(variant, variant_filter)[0]:
+                    yield variant
 
     def get_variants_in_gene(self, project_id, family_id, gene_id, genotype_filter=None, variant_filter=None):
 
@@ -299,10 +473,11 @@ class MongoDatastore(datastore.Datastore):
         for fam_info in family_list:
             self._add_family_info(fam_info['project_id'], fam_info['family_id'], fam_info['individuals'])
 
-    def load_family_set(self, vcf_file_path, family_list, reference_populations=None, vcf_id_map=None, mark_as_loaded=True, start_from_chrom=None, end_with_chrom=None):
+    def load_family_set(self, vcf_file_path, family_list, reference_populations=None, vcf_id_map=None, mark_as_loaded=True, start_from_chrom=None, end_with_chrom=None, num_processes=None):
         """
         Load a set of families from the same VCF file
         family_list is a list of (project_id, family_id) tuples
+        num_processes defaults to settings.MONGO_VCF_LOADING_PROCESSES
         """
         family_info_list = [self._get_family_info(f[0], f[1]) for f in family_list]
         self._load_variants_for_family_set(
@@ -312,13 +487,14 @@ class MongoDatastore(datastore.Datastore):
             vcf_id_map=vcf_id_map,
             start_from_chrom=start_from_chrom,
             end_with_chrom=end_with_chrom,
+            num_processes=num_processes,
         )
 
         if mark_as_loaded:
             for family in family_info_list:
                 self._finalize_family_load(family['project_id'], family['family_id'])
 
-    def _load_variants_for_family_set(self, family_info_list, vcf_file_path, reference_populations=None, vcf_id_map=None, start_from_chrom=None, end_with_chrom=None):
+    def _load_variants_for_family_set(self, family_info_list, vcf_file_path, reference_populations=None, vcf_id_map=None, start_from_chrom=None, end_with_chrom=None, num_processes=None):
         """
         Load variants for a set of families, assuming all come from the same VCF file
 
@@ -341,141 +517,181 @@ class MongoDatastore(datastore.Datastore):
             vcf_id_map=vcf_id_map,
             start_from_chrom=start_from_chrom,
             end_with_chrom=end_with_chrom,
+            num_processes=num_processes,
         )
 
-    def _add_vcf_file_for_family_set(self, family_info_list, vcf_file_path, reference_populations=None, vcf_id_map=None, start_from_chrom=None, end_with_chrom=None):
-        collections = {f['family_id']: getattr(settings, self._db_name)[f['coll_name']] for f in family_info_list}
-        #for collection in collections.values():
-        #    collection.drop_indexes()
-        indiv_id_list = [i for f in family_info_list for i in f['individuals']]
+    def _add_vcf_file_for_family_set(self, family_info_list, vcf_file_path, reference_populations=None, vcf_id_map=None, start_from_chrom=None, end_with_chrom=None, num_processes=None):
+        """
+        Load the variants for the families from the VCF, in regions that are loaded in parallel when the VCF is tabix
+        indexed. The progress of each region is checkpointed, so an interrupted load resumes where it stopped.
+        """
+        db = getattr(settings, self._db_name)
+        collections = {f['family_id']: db[f['coll_name']] for f in family_info_list}
         number_of_families = len(family_info_list)
         sys.stderr.write("Loading variants for %(number_of_families)d families %(family_info_list)s from %(vcf_file_path)s\n" % locals())
 
         for family in family_info_list:
             logger.info("Indexing family: " + str(family))
-            collection = collections[family['family_id']]
-            collection.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
-
-        # check whether some of the variants for this chromosome has been loaded already
-        # if yes, start from the last loaded variant, and not from the beginning
-        if "_chr" in vcf_file_path or ".chr" in vcf_file_path:
-            # if the VCF files are split by chromosome (eg. for WGS projects), check within the chromosome
-            vcf_file = compressed_file(vcf_file_path)
-            variant = next(vcf_stuff.iterate_vcf(vcf_file, genotypes=False, indiv_id_list=indiv_id_list, vcf_id_map=vcf_id_map))
-            logger.info(vcf_file_path + "  - chromsome: " + str(variant.chr))
-            vcf_file.close()
-
-            position_per_chrom = {}
-            for chrom in range(1,24):
-                position_per_chrom[chrom] = defaultdict(int)
-                for family in family_info_list:     #variants = collections[family['family_id']].find().sort([('xpos',-1)]).limit(1)
-                    variants = list(collections[family['family_id']].find({'$and': [{'xpos': { '$gte': chrom*1e9 }}, {'xpos': { '$lt': (chrom+1)*1e9}}] }).sort([('xpos',-1)]).limit(1))
-                    if len(variants) > 0:
-                        position_per_chrom[chrom][family['family_id']] = variants[0]['xpos'] - chrom*1e9
-                    else:
-                        position_per_chrom[chrom][family['family_id']] = 0
-
-            for chrom in range(1,24):
-                position_per_chrom[chrom] = min(position_per_chrom[chrom].values()) # get the smallest last-loaded variant position for this chromosome across all families
-
-            chr_idx = int(variant.xpos/1e9)
-            start_from_pos = int(position_per_chrom[chr_idx])
-
-            logger.info("Start from: %s - %s (%0.1f%% done)" % (chr_idx, start_from_pos, 100.*start_from_pos/CHROMOSOME_SIZES[variant.chr.replace("chr", "")]))
-            tabix_file = pysam.TabixFile(vcf_file_path)
-            vcf_iter = itertools.chain(tabix_file.header, tabix_file.fetch(variant.chr.replace("chr", ""), start_from_pos, int(2.5e8)))
-        elif start_from_chrom or end_with_chrom:
-            if start_from_chrom:
-                logger.info("Start chrom: chr%s" % start_from_chrom)
-            if end_with_chrom:
-                logger.info("End chrom: chr%s" % end_with_chrom)
-
-            chrom_list = list(map(str, range(1,23))) + ['X','Y']
-            chrom_list_start_index = 0
-            if start_from_chrom:
-                chrom_list_start_index = chrom_list.index(start_from_chrom.replace("chr", "").upper())
-
-            chrom_list_end_index = len(chrom_list)
-            if end_with_chrom:
-                chrom_list_end_index = chrom_list.index(end_with_chrom.replace("chr", "").upper())
-
-            tabix_file = pysam.TabixFile(vcf_file_path)
-            vcf_iter = tabix_file.header
-            for chrom in chrom_list[chrom_list_start_index:chrom_list_end_index+1]:
-                logger.info("Will load chrom: " + chrom)
-                try:
-                    vcf_iter = itertools.chain(vcf_iter, tabix_file.fetch(chrom))
-                except ValueError as e:
-                    logger.warn("WARNING: _add_vcf_file_for_family_set: " + str(e))
-
+            _ensure_unique_variant_index(collections[family['family_id']])
+
+        load_id = _get_vcf_load_id(vcf_file_path, family_info_list)
+        shards = _get_vcf_shards(vcf_file_path, start_from_chrom=start_from_chrom, end_with_chrom=end_with_chrom)
+        done_shards = {checkpoint['shard'] for checkpoint in db.vcf_load_checkpoints.find({'load_id': load_id, 'done': True})}
+        shards = [shard for shard in shards if _get_shard_name(shard) not in done_shards]
+        if done_shards:
+            logger.info("Resuming load of %s: %d regions already loaded" % (vcf_file_path, len(done_shards)))
+
+        shard_kwargs = {
+            'family_info_list': family_info_list,
+            'vcf_file_path': vcf_file_path,
+            'reference_populations': reference_populations,
+            'vcf_id_map': vcf_id_map,
+            'load_id': load_id,
+        }
+        num_processes = min(num_processes or settings.MONGO_VCF_LOADING_PROCESSES, len(shards))
+        if num_processes > 1:
+            # Each process opens its own connection, as mongo clients can not be shared across a fork
+            shard_kwargs['db_address'] = db.client.address
+            _SHARD_LOADING_CONTEXT.update({'datastore': self, 'kwargs': shard_kwargs})
+            pool = multiprocessing.Pool(num_processes)
+            try:
+                shard_results = pool.imap_unordered(_load_vcf_shard_in_process, shards)
+                self._log_shard_results(shard_results, len(shards))
+            finally:
+                pool.close()
+                pool.join()
+                _SHARD_LOADING_CONTEXT.clear()
         else:
-            vcf_iter = vcf_file = compressed_file(vcf_file_path)
-            # TODO handle case where it's one vcf file, not split by chromosome
+            self._log_shard_results((self._load_vcf_shard(shard, **shard_kwargs) for shard in shards), len(shards))
 
-        size = os.path.getsize(vcf_file_path)
-        #progress = get_progressbar(size, 'Loading VCF: {}'.format(vcf_file_path))
+        # Once everything is loaded the checkpoints are removed, so loading the file again reloads all its variants
+        db.vcf_load_checkpoints.delete_many({'load_id': load_id})
 
-        def insert_all_variants_in_buffer(buff, collections_dict):
-            for family_id in buff:
-                if len(buff[family_id]) == 0:  # defensive programming
-                    raise ValueError("%s has zero variants to insert. Should not be in buff." % family_id)
+    def _log_shard_results(self, shard_results, num_shards):
+        start_time = datetime.now()
+        total_rows = total_inserted = 0
+        for i, (shard_name, num_rows, num_inserted) in enumerate(shard_results):
+            total_rows += num_rows
+            total_inserted += num_inserted
+            logger.info("Loaded %s: %d vcf rows, %d family-variants (%d of %d regions done)" % (
+                shard_name, num_rows, num_inserted, i + 1, num_shards))
 
-            while len(buff) > 0:
-                # choose a random family for which to insert a variant from among families that still have variants to insert
-                family_id = random.choice(buff.keys())
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info("Loaded %d vcf rows and %d family-variants in %0.1fs (%0.0f rows/s)" % (
+            total_rows, total_inserted, elapsed, total_rows / elapsed if elapsed else 0))
 
-                # pop a variant off the list for this family, and insert it
-                family_variant_dict_to_insert = buff[family_id].pop()
-                c = collections_dict[family_id]
-                c.insert(family_variant_dict_to_insert)
+    def _load_vcf_shard(self, shard, family_info_list, vcf_file_path, load_id, reference_populations=None, vcf_id_map=None, db_address=None):
+        """
+        Load the variants in one region of the VCF, inserting them in bulk into each family collection
+        Returns a (region name, number of vcf rows, number of family-variants inserted) tuple
+        """
+        if db_address:
+            db = pymongo.MongoClient(*db_address)[getattr(settings, self._db_name).name]
+        else:
+            db = getattr(settings, self._db_name)
+        collections = {f['family_id']: db[f['coll_name']] for f in family_info_list}
+        indiv_id_list = [i for f in family_info_list for i in f['individuals']]
 
-                if len(buff[family_id]) == 0:
-                    del buff[family_id]  # if no more variants for this family, delete it
+        shard_name = _get_shard_name(shard)
+        checkpoint = db.vcf_load_checkpoints.find_one({'load_id': load_id, 'shard': shard_name}) or {}
+        resume_xpos = checkpoint.get('last_xpos')
+        if resume_xpos:
+            logger.info("Resuming %s from %s" % (shard_name, resume_xpos))
+
+        row_position = {}
+        vcf_iter = _iterate_vcf_shard(vcf_file_path, shard, resume_xpos=resume_xpos, row_position=row_position)
+
+        def insert_all_variants_in_buffer(buff):
+            # annotations are looked up for all the buffered variants at once, so no rows are read ahead of the inserts
+            self._add_annotations_to_variant_dicts(buff, reference_populations)
+            num_inserted = 0
+            for family_id, family_variant_dicts in buff.items():
+                num_inserted += _insert_family_variants(collections[family_id], family_variant_dicts)
+            buff.clear()
+
+            # the current row may be partially inserted, so the load resumes from the start of the row
+            if row_position.get('xpos'):
+                db.vcf_load_checkpoints.update_one(
+                    {'load_id': load_id, 'shard': shard_name}, {'$set': {'last_xpos': row_position['xpos']}}, upsert=True)
+            return num_inserted
 
         vcf_rows_counter = 0
         variants_buffered_counter = 0
+        total_inserted = 0
         family_id_to_variant_list = defaultdict(list)  # will accumulate variants to be inserted all at once
         for variant in vcf_stuff.iterate_vcf(vcf_iter, genotypes=True, indiv_id_list=indiv_id_list, vcf_id_map=vcf_id_map):
             if variant.alt == "*":
                 #print("Skipping GATK 3.4 * alt allele: " + str(variant.unique_tuple()))
                 continue
 
-            try:
-                annotation = self._annotator.get_annotation(variant.xpos, variant.ref, variant.alt, populations=reference_populations)
-            except ValueError, e:
-                logger.warn("WARNING: _annotator.get_annotation: " + str(e) + "\n")
-                continue
-
             vcf_rows_counter += 1
             for family in family_info_list:
-                # TODO: can we move this inside the if relevant clause below?
                 try:
                     family_variant = variant.make_copy(restrict_to_genotypes=family['individuals'])
-                    family_variant_dict = family_variant.toJSON()
-                    _add_index_fields_to_variant(family_variant_dict, annotation)
                     if xbrowse_utils.is_variant_relevant_for_individuals(family_variant, family['individuals']):
-                        collection = collections[family['family_id']]
-                        if not collection.find_one({'xpos': family_variant.xpos, 'ref': family_variant.ref, 'alt': family_variant.alt}):
-                            family_id_to_variant_list[family['family_id']].append(family_variant_dict)
-                            variants_buffered_counter += 1
+                        family_variant_dict = family_variant.toJSON()
+                        family_id_to_variant_list[family['family_id']].append(family_variant_dict)
+                        variants_buffered_counter += 1
                 except Exception, e:
                     sys.stderr.write("ERROR: on variant %s, family: %s - %s\n" % (variant.toJSON(), family, e))
 
-
-            if variants_buffered_counter > 2000:
-                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s (%0.1f%% done) - inserting %d family-variants from %d vcf rows into %s families" % (variant.chr, variant.pos, variant.ref, variant.alt, 100*variant.pos / CHROMOSOME_SIZES[variant.chr.replace("chr", "")], variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
-
-                insert_all_variants_in_buffer(family_id_to_variant_list, collections)
-
-                assert len(family_id_to_variant_list) == 0
-                vcf_rows_counter = 0
+            if variants_buffered_counter > INSERT_BATCH_SIZE:
+                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s - inserting %d family-variants from %d vcf rows into %s families" % (variant.chr, variant.pos, variant.ref, variant.alt, variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
+                total_inserted += insert_all_variants_in_buffer(family_id_to_variant_list)
                 variants_buffered_counter = 0
 
-        if variants_buffered_counter > 0:
-            insert_all_variants_in_buffer(family_id_to_variant_list, collections)
+        row_position.clear()
+        total_inserted += insert_all_variants_in_buffer(family_id_to_variant_list)
+        db.vcf_load_checkpoints.update_one(
+            {'load_id': load_id, 'shard': shard_name}, {'$set': {'done': True}}, upsert=True)
 
-            assert len(family_id_to_variant_list) == 0
+        return shard_name, vcf_rows_counter, total_inserted
 
+    def _add_annotations_to_variant_dicts(self, family_id_to_variant_list, reference_populations):
+        """
+        Add the annotation index fields to the buffered family variant dicts, looking up the annotations for all the
+        variants at once. Variants without annotations are removed from the buffer.
+        """
+        variant_tuples = {
+            (variant_dict['xpos'], variant_dict['ref'], variant_dict['alt'])
+            for family_variant_dicts in family_id_to_variant_list.values() for variant_dict in family_variant_dicts
+        }
+        annotations = self._annotator.get_annotations(sorted(variant_tuples), populations=reference_populations)
+        for variant_tuple in sorted(variant_tuples):
+            if annotations.get(variant_tuple) is None:
+                logger.warn("WARNING: Could not find annotations for variant: " + str(variant_tuple) + "\n")
+
+        for family_id, family_variant_dicts in family_id_to_variant_list.items():
+            annotated_variant_dicts = []
+            for variant_dict in family_variant_dicts:
+                annotation = annotations.get((variant_dict['xpos'], variant_dict['ref'], variant_dict['alt']))
+                if annotation is not None:
+                    _add_index_fields_to_variant(variant_dict, annotation)
+                    annotated_variant_dicts.append(variant_dict)
+            if annotated_variant_dicts:
+                family_id_to_variant_list[family_id] = annotated_variant_dicts
+            else:
+                del family_id_to_variant_list[family_id]
+
+    def _iterate_annotated_variants(self, vcf_file, reference_populations, **kwargs):
+        """
+        Iterate (variant, annotation) tuples for the variants in the VCF, looking up the annotations for a batch of
+        variants at a time. Variants without annotations and GATK 3.4 * alt alleles are skipped.
+        """
+        variant_iter = vcf_stuff.iterate_vcf(vcf_file, **kwargs)
+        while True:
+            variants = list(itertools.islice(variant_iter, 0, ANNOTATION_BATCH_SIZE))
+            if not variants:
+                break
+            variants = [variant for variant in variants if variant.alt != "*"]
+            annotations = self._annotator.get_annotations(
+                [variant.unique_tuple() for variant in variants], populations=reference_populations)
+            for variant in variants:
+                annotation = annotations.get(variant.unique_tuple())
+                if annotation is None:
+                    logger.warn("WARNING: Could not find annotations for variant: " + str(variant.unique_tuple()) + "\n")
+                    continue
+                yield variant, annotation
 
     def _finalize_family_load(self, project_id, family_id):
         """
@@ -504,9 +720,8 @@ class MongoDatastore(datastore.Datastore):
         getattr(settings, self._db_name).families.remove({'project_id': project_id, 'family_id': family_id})
 
     def add_annotations_to_variants(self, variants, project_id, family_id=None):
+        self._annotator.annotate_variants(variants)
         for variant in variants:
-            self._annotator.annotate_variant(variant)
-
             variant.set_extra('project_id', project_id)
             if family_id is not None:
                 variant.set_extra('family_id', family_id)
@@ -553,24 +768,18 @@ class MongoDatastore(datastore.Datastore):
 
         project_collection = self._get_project_collection(project_id)
         reference_populations = self._annotator.reference_population_slugs + self._custom_populations_map.get(project_id)
-        for counter, variant in enumerate(vcf_stuff.iterate_vcf(vcf_file, genotypes=True, indiv_id_list=indiv_id_list)):
+        annotated_variants = self._iterate_annotated_variants(
+            vcf_file, reference_populations, genotypes=True, indiv_id_list=indiv_id_list)
+        for counter, (variant, annotation) in enumerate(annotated_variants):
             if (start_from_chrom or end_with_chrom) and variant.chr.replace("chr", "") not in chromosomes_to_include:
                 continue
 
-            if variant.alt == "*":
-                continue
-
             if counter % 2000 == 0:
                 logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- inserting variant %d  %s:%s-%s-%s (%0.1f%% done with %s) " % (counter, variant.chr, variant.pos, variant.ref, variant.alt, 100*variant.pos / CHROMOSOME_SIZES[variant.chr.replace("chr", "")], variant.chr))
 
             variant_dict = project_collection.find_one({'xpos': variant.xpos, 'ref': variant.ref, 'alt': variant.alt})
             if not variant_dict:
                 variant_dict = variant.toJSON()
-                try:
-                    annotation = self._annotator.get_annotation(variant.xpos, variant.ref, variant.alt, populations=reference_populations)
-                except ValueError, e:
-                    logger.warn("WARNING: self._annotator.get_annotation: " + str(e) + "\n")
-                    continue
                 _add_index_fields_to_variant(variant_dict, annotation)
             else:
                 for indiv_id, genotype in variant.get_genotypes():
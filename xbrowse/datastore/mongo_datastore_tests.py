@@ -0,0 +1,297 @@
+import mock
+import os
+import pysam
+import pymongo
+import shutil
+import tempfile
+from collections import defaultdict
+from django.test import TestCase
+
+from xbrowse.datastore import mongo_datastore
+from xbrowse.datastore.mongo_datastore import MongoDatastore
+
+VCF_HEADER = [
+    '##fileformat=VCFv4.1\n',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n',
+]
+VCF_ROWS = [
+    '1\t500\t.\tA\tG\t100\tPASS\t.\tGT\t0/1\n',
+    '1\t100000000\t.\tC\tT\t100\tPASS\t.\tGT\t0/1\n',
+    '1\t100000001\t.\tG\tA\t100\tPASS\t.\tGT\t1/1\n',
+    '1\t249250700\t.\tT\tC\t100\tPASS\t.\tGT\t0/1\n',
+    '2\t700\t.\tT\tC\t100\tPASS\t.\tGT\t0/1\n',
+    'X\t800\t.\tG\tC\t100\tPASS\t.\tGT\t0/1\n',
+]
+
+FAMILY_INFO_LIST = [{'family_id': 'F1', 'coll_name': 'family_F1', 'individuals': ['S1']}]
+
+
+class FakeCollection(object):
+    """Stands in for the parts of a pymongo collection used by the VCF loader"""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+
+    def index_information(self):
+        return self.indexes
+
+    def drop_index(self, index_name):
+        del self.indexes[index_name]
+
+    def create_index(self, keys, unique=False):
+        if unique and len({self._variant_key(doc) for doc in self.docs}) < len(self.docs):
+            raise pymongo.errors.DuplicateKeyError('duplicate key')
+        index_info = {'key': keys}
+        if unique:
+            index_info['unique'] = True
+        self.indexes['_'.join('{}_1'.format(key) for key, _ in keys)] = index_info
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        ids_by_variant = defaultdict(list)
+        for doc in self.docs:
+            ids_by_variant[self._variant_key(doc)].append(doc['_id'])
+        return [{'ids': ids, 'count': len(ids)} for ids in ids_by_variant.values() if len(ids) > 1]
+
+    def delete_many(self, query):
+        self.docs = [doc for doc in self.docs if not self._matches(doc, query)]
+
+    def insert_many(self, docs, ordered=True):
+        existing_variants = {self._variant_key(doc) for doc in self.docs}
+        errors = []
+        for doc in docs:
+            if self._variant_key(doc) in existing_variants:
+                errors.append({'code': mongo_datastore.DUPLICATE_KEY_ERROR_CODE})
+                continue
+            existing_variants.add(self._variant_key(doc))
+            self.docs.append(dict(doc, _id=len(self.docs)))
+        if errors:
+            raise pymongo.errors.BulkWriteError({'writeErrors': errors, 'nInserted': len(docs) - len(errors)})
+        return mock.MagicMock(inserted_ids=range(len(docs)))
+
+    def find(self, query):
+        return [doc for doc in self.docs if self._matches(doc, query)]
+
+    def find_one(self, query):
+        docs = self.find(query)
+        return docs[0] if docs else None
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.find_one(query)
+        if doc is None:
+            doc = dict(query, _id=len(self.docs))
+            self.docs.append(doc)
+        doc.update(update['$set'])
+
+    @staticmethod
+    def _variant_key(doc):
+        return doc.get('xpos'), doc.get('ref'), doc.get('alt')
+
+    @staticmethod
+    def _matches(doc, query):
+        for key, value in query.items():
+            if isinstance(value, dict):
+                if doc.get(key) not in value['$in']:
+                    return False
+            elif doc.get(key) != value:
+                return False
+        return True
+
+
+class FakeDatabase(dict):
+
+    def __missing__(self, name):
+        self[name] = FakeCollection(name)
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def _get_annotations(variant_t_list, populations=None):
+    return {variant_t: {'freqs': {}, 'annotation_tags': [], 'gene_ids': []} for variant_t in variant_t_list}
+
+
+class MongoDatastoreVcfLoadingTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+        for patcher in [
+            mock.patch.object(mongo_datastore.settings, 'MONGO_VCF_LOADING_SHARD_SIZE', 10**8),
+            mock.patch.object(mongo_datastore.settings, 'TEST_DATASTORE_DB', FakeDatabase(), create=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.db = mongo_datastore.settings.TEST_DATASTORE_DB
+
+        annotator = mock.MagicMock()
+        annotator.get_annotations.side_effect = _get_annotations
+        self.datastore = MongoDatastore('TEST_DATASTORE_DB', annotator)
+
+    def _write_vcf(self, rows, tabix_index=True):
+        vcf_path = os.path.join(self.temp_dir, 'test.vcf')
+        with open(vcf_path, 'w') as f:
+            f.writelines(VCF_HEADER + rows)
+        if tabix_index:
+            vcf_path = pysam.tabix_index(vcf_path, preset='vcf', force=True)
+        return vcf_path
+
+    def _get_loaded_positions(self):
+        return sorted(doc['xpos'] for doc in self.db['family_F1'].docs)
+
+    def test_get_vcf_shards(self):
+        vcf_path = self._write_vcf(VCF_ROWS)
+        shards = mongo_datastore._get_vcf_shards(vcf_path)
+        self.assertListEqual(shards, [
+            ('1', 0, 10**8), ('1', 10**8, 2 * 10**8), ('1', 2 * 10**8, None),
+            ('2', 0, 10**8), ('2', 10**8, 2 * 10**8), ('2', 2 * 10**8, None),
+            ('X', 0, 10**8), ('X', 10**8, None),
+        ])
+
+        # each row is in exactly one region, with start < POS <= end, and rows past the end of the reference
+        # chromosome are in the open-ended last region
+        shard_positions = {
+            mongo_datastore._get_shard_name(shard): [
+                int(line.split('\t')[1]) for line in mongo_datastore._iterate_vcf_shard(vcf_path, shard)
+                if not line.startswith('#')
+            ] for shard in shards
+        }
+        self.assertDictEqual(shard_positions, {
+            '1:0-100000000': [500, 100000000],
+            '1:100000000-200000000': [100000001],
+            '1:200000000-': [249250700],
+            '2:0-100000000': [700],
+            '2:100000000-200000000': [],
+            '2:200000000-': [],
+            'X:0-100000000': [800],
+            'X:100000000-': [],
+        })
+
+        self.assertListEqual(
+            [shard[0] for shard in mongo_datastore._get_vcf_shards(vcf_path, start_from_chrom='2', end_with_chrom='chrX')],
+            ['2', '2', '2', 'X', 'X'],
+        )
+        self.assertListEqual(
+            mongo_datastore._get_vcf_shards(vcf_path, end_with_chrom='1'),
+            [('1', 0, 10**8), ('1', 10**8, 2 * 10**8), ('1', 2 * 10**8, None)],
+        )
+
+        # a VCF without a tabix index is loaded as a single region
+        vcf_path = self._write_vcf(VCF_ROWS, tabix_index=False)
+        self.assertListEqual(mongo_datastore._get_vcf_shards(vcf_path, start_from_chrom='2'), [(None, 0, None)])
+        self.assertEqual(
+            len([line for line in mongo_datastore._iterate_vcf_shard(vcf_path, (None, 0, None)) if not line.startswith('#')]),
+            len(VCF_ROWS),
+        )
+
+    def test_load_vcf_shards(self):
+        vcf_path = self._write_vcf(VCF_ROWS)
+        self.datastore._add_vcf_file_for_family_set(FAMILY_INFO_LIST, vcf_path, num_processes=1)
+        self.assertListEqual(self._get_loaded_positions(), [
+            1000000500, 1100000000, 1100000001, 1249250700, 2000000700, 23000000800,
+        ])
+        self.assertTrue(self.db['family_F1'].indexes['xpos_1_ref_1_alt_1']['unique'])
+        # the checkpoints are removed once the whole file is loaded
+        self.assertListEqual(self.db['vcf_load_checkpoints'].docs, [])
+
+        # loading the file again skips variants that are already loaded
+        self.datastore._add_vcf_file_for_family_set(FAMILY_INFO_LIST, vcf_path, num_processes=1)
+        self.assertEqual(len(self.db['family_F1'].docs), 6)
+
+    def test_resume_vcf_load(self):
+        vcf_path = self._write_vcf(VCF_ROWS)
+        load_id = mongo_datastore._get_vcf_load_id(vcf_path, FAMILY_INFO_LIST)
+        checkpoints = self.db['vcf_load_checkpoints']
+        checkpoints.update_one({'load_id': load_id, 'shard': '1:0-100000000'}, {'$set': {'done': True}}, upsert=True)
+        checkpoints.update_one(
+            {'load_id': load_id, 'shard': '1:200000000-'}, {'$set': {'last_xpos': 1249250701}}, upsert=True)
+        checkpoints.update_one(
+            {'load_id': load_id, 'shard': '2:0-100000000'}, {'$set': {'last_xpos': 2000000700}}, upsert=True)
+        checkpoints.update_one({'load_id': 'other_load', 'shard': '1:0-100000000'}, {'$set': {'done': True}}, upsert=True)
+
+        self.datastore._add_vcf_file_for_family_set(FAMILY_INFO_LIST, vcf_path, num_processes=1)
+        # finished regions are skipped, and other regions resume from the row they were checkpointed at
+        self.assertListEqual(self._get_loaded_positions(), [1100000001, 2000000700, 23000000800])
+        self.assertListEqual([checkpoint['load_id'] for checkpoint in checkpoints.docs], ['other_load'])
+
+    @mock.patch.object(mongo_datastore, 'INSERT_BATCH_SIZE', 0)
+    def test_resume_vcf_load_in_multi_allelic_row(self):
+        # the GTA allele is trimmed to 1:1001 C>T, past the position of its row
+        vcf_path = self._write_vcf([
+            '1\t500\t.\tA\tG\t100\tPASS\t.\tGT\t0/1\n',
+            '1\t1000\t.\tGCA\tGTA,G\t100\tPASS\t.\tGT\t1/2\n',
+            '1\t2000\t.\tT\tC\t100\tPASS\t.\tGT\t0/1\n',
+        ])
+        collection = self.db['family_F1']
+        insert_many = collection.insert_many
+
+        def _fail_on_second_allele(docs, ordered=True):
+            if any(doc['ref'] == 'GCA' for doc in docs):
+                raise KeyboardInterrupt()
+            return insert_many(docs, ordered=ordered)
+
+        with mock.patch.object(collection, 'insert_many', side_effect=_fail_on_second_allele):
+            with self.assertRaises(KeyboardInterrupt):
+                self.datastore._add_vcf_file_for_family_set(FAMILY_INFO_LIST, vcf_path, num_processes=1)
+        self.assertListEqual(self._get_loaded_positions(), [1000000500, 1000001001])
+        checkpoint = self.db['vcf_load_checkpoints'].find_one({'shard': '1:0-100000000'})
+        self.assertLessEqual(checkpoint['last_xpos'], 1000001000)
+
+        self.datastore._add_vcf_file_for_family_set(FAMILY_INFO_LIST, vcf_path, num_processes=1)
+        self.assertListEqual(
+            sorted((doc['xpos'], doc['ref'], doc['alt']) for doc in collection.docs),
+            [(1000000500, 'A', 'G'), (1000001000, 'GCA', 'G'), (1000001001, 'C', 'T'), (1000002000, 'T', 'C')],
+        )
+
+    def test_insert_family_variants(self):
+        collection = FakeCollection('family_F1')
+        self.assertEqual(mongo_datastore._insert_family_variants(collection, [
+            {'xpos': 1000000500, 'ref': 'A', 'alt': 'G'}, {'xpos': 1000000600, 'ref': 'A', 'alt': 'G'},
+        ]), 2)
+        self.assertEqual(mongo_datastore._insert_family_variants(collection, [
+            {'xpos': 1000000500, 'ref': 'A', 'alt': 'G'}, {'xpos': 1000000500, 'ref': 'A', 'alt': 'C'},
+        ]), 1)
+        self.assertEqual(len(collection.docs), 3)
+
+        collection = mock.MagicMock()
+        collection.insert_many.side_effect = pymongo.errors.BulkWriteError({
+            'writeErrors': [{'code': mongo_datastore.DUPLICATE_KEY_ERROR_CODE}, {'code': 121}], 'nInserted': 0,
+        })
+        with self.assertRaises(pymongo.errors.BulkWriteError):
+            mongo_datastore._insert_family_variants(collection, [{'xpos': 1000000500, 'ref': 'A', 'alt': 'G'}])
+
+    def test_ensure_unique_variant_index(self):
+        collection = FakeCollection('family_F1')
+        collection.create_index([('xpos', 1), ('ref', 1), ('alt', 1)])
+        collection.docs = [
+            {'_id': 0, 'xpos': 1000000500, 'ref': 'A', 'alt': 'G'},
+            {'_id': 1, 'xpos': 1000000500, 'ref': 'A', 'alt': 'G'},
+            {'_id': 2, 'xpos': 1000000600, 'ref': 'A', 'alt': 'G'},
+        ]
+
+        mongo_datastore._ensure_unique_variant_index(collection)
+        self.assertListEqual([doc['_id'] for doc in collection.docs], [0, 2])
+        self.assertTrue(collection.indexes['xpos_1_ref_1_alt_1']['unique'])
+
+        # duplicates are deleted in fixed size batches
+        collection.indexes['xpos_1_ref_1_alt_1'] = {'key': [('xpos', 1), ('ref', 1), ('alt', 1)]}
+        collection.docs += [{'_id': i, 'xpos': 1000000500 + i % 2, 'ref': 'A', 'alt': 'G'} for i in range(3, 11)]
+        with mock.patch.object(mongo_datastore, 'DELETE_BATCH_SIZE', 2), \
+                mock.patch.object(collection, 'delete_many', wraps=collection.delete_many) as mock_delete_many:
+            mongo_datastore._ensure_unique_variant_index(collection)
+        self.assertListEqual(
+            [len(call_args[0][0]['_id']['$in']) for call_args in mock_delete_many.call_args_list], [2, 2, 2, 1])
+        self.assertListEqual([doc['_id'] for doc in collection.docs], [0, 2, 3])
+        self.assertTrue(collection.indexes['xpos_1_ref_1_alt_1']['unique'])
+
+        # a duplicate added while the index is replaced leaves the collection with a non-unique index
+        collection.indexes['xpos_1_ref_1_alt_1'] = {'key': [('xpos', 1), ('ref', 1), ('alt', 1)]}
+        with mock.patch.object(mongo_datastore, '_remove_duplicate_variants'):
+            collection.docs.append({'_id': 11, 'xpos': 1000000600, 'ref': 'A', 'alt': 'G'})
+            with self.assertRaises(pymongo.errors.DuplicateKeyError):
+                mongo_datastore._ensure_unique_variant_index(collection)
+        self.assertDictEqual(
+            collection.indexes['xpos_1_ref_1_alt_1'], {'key': [('xpos', 1), ('ref', 1), ('alt', 1)]})
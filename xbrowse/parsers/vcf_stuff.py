@@ -4,6 +4,7 @@
 
 import sys
 import gzip
+import numpy as np
 import vcf as pyvcf
 
 from xbrowse import genomeloc
@@ -89,7 +90,7 @@ def get_vcf_headers(header_line):
     return header_line.strip('#').split('\t')
 
 
-def get_variants_from_vcf_fields(vcf_fields):
+def get_variants_from_vcf_fields(vcf_fields, variant_class=Variant):
     """
     return a *list* of variants that are taken from vcf_fields
     One for each alt allele
@@ -98,14 +99,14 @@ def get_variants_from_vcf_fields(vcf_fields):
     num_alt_alleles = len(vcf_fields[4].split(','))
     variants = []
     for i in range(num_alt_alleles):
-        variant = get_variant_from_vcf_fields(vcf_fields, i)
+        variant = get_variant_from_vcf_fields(vcf_fields, i, variant_class=variant_class)
         if variant is not None:
             variants.append(variant)
 
     return variants
 
 
-def get_variant_from_vcf_fields(vcf_fields, alt_allele_pos):
+def get_variant_from_vcf_fields(vcf_fields, alt_allele_pos, variant_class=Variant):
     """
     Get a basic variant from vcf_fields, for allele given by alt_allele_pos
     """
@@ -126,7 +127,7 @@ def get_variant_from_vcf_fields(vcf_fields, alt_allele_pos):
     xpos = genomeloc.get_single_location(chrom, pos)
     xpos, ref, alt = get_minimal_representation(xpos, ref, alt)
 
-    variant = Variant(xpos, ref, alt)
+    variant = variant_class(xpos, ref, alt)
     variant.set_extra('alt_allele_pos', alt_allele_pos)
     variant.set_extra('orig_alt_alleles', orig_alt_alleles)
 
@@ -171,11 +172,15 @@ def get_allele_balance(genotype_dict, alt_allele_pos):
     Or '.' if ab does not apply
     """
 
+    return _get_allele_balance_from_ad(genotype_dict['extras'].get('ad'), alt_allele_pos)
+
+
+def _get_allele_balance_from_ad(ad, alt_allele_pos):
     # can't compute ab without ad
-    if genotype_dict['extras'].get('ad') is None or genotype_dict['extras']['ad'] == '.':
+    if ad is None or ad == '.':
         return None
 
-    ad_fields = [int(s) for s in genotype_dict['extras']['ad'].split(',')]
+    ad_fields = [int(s) for s in ad.split(',')]
 
     # TODO: should we still compute AD for
     if len(ad_fields) == 1: return '.'
@@ -382,6 +387,226 @@ def set_genotypes_from_vcf_fields(vcf_fields, variant, alt_allele_pos, vcf_heade
     return variant
 
 
+#
+# Columnar genotype parsing: the sample columns and FORMAT layouts are resolved once per file, and the genotypes of
+# each row are decoded once into arrays shared by all its alt alleles. Genotype objects are only built when accessed.
+#
+
+NO_CALL = -1
+
+# GT strings take few distinct values, so they are only parsed the first time they are seen. GQ is capped at 99 by
+# most callers, so the common values are parsed up front and any others are parsed each time, keeping the cache bounded
+_GT_ALLELES_CACHE = {'.': (NO_CALL, NO_CALL), './.': (NO_CALL, NO_CALL)}
+_GQ_CACHE = {str(gq): float(gq) for gq in range(100)}
+_GQ_CACHE['.'] = None
+
+
+def _parse_gt_alleles(gt_str):
+    alleles = _GT_ALLELES_CACHE.get(gt_str)
+    if alleles is None:
+        a1, a2 = gt_str.split('|' if '|' in gt_str else '/')
+        alleles = (NO_CALL if a1 == '.' else int(a1), NO_CALL if a2 == '.' else int(a2))
+        _GT_ALLELES_CACHE[gt_str] = alleles
+    return alleles
+
+
+def _parse_gq(gq_str):
+    if gq_str in _GQ_CACHE:
+        return _GQ_CACHE[gq_str]
+    try:
+        return float(gq_str)
+    except ValueError:
+        return None
+
+
+class VcfSampleColumns(object):
+    """
+    Maps the sample columns of a VCF to individual ids, once per file
+    """
+
+    def __init__(self, vcf_header_fields, indivs_to_include=None, vcf_id_map=None):
+        self.num_columns = len(vcf_header_fields)
+        if indivs_to_include:
+            indivs_to_include = {slugify(indiv_id, separator='_', replace_dot=True) for indiv_id in indivs_to_include}
+
+        self.column_indices = []
+        self.indiv_ids = []
+        for col_index in range(9, self.num_columns):
+            vcf_id = slugify(vcf_header_fields[col_index], separator='_', replace_dot=True)
+            indiv_id = vcf_id_map.get(vcf_id, vcf_id) if vcf_id_map else vcf_id
+            if indivs_to_include and indiv_id not in indivs_to_include:
+                continue
+            self.column_indices.append(col_index)
+            self.indiv_ids.append(indiv_id)
+
+        self._format_layouts = {}
+
+    def _get_format_layout(self, format_str):
+        layout = self._format_layouts.get(format_str)
+        if layout is None:
+            format_map = get_format_map(format_str)
+            layout = tuple(format_map.get(k) for k in ['gq', 'dp', 'ad', 'pl'])
+            self._format_layouts[format_str] = layout
+        return layout
+
+    def parse_row(self, vcf_fields, genotype_meta=True):
+        """
+        Decode the genotypes of the included samples in a VCF row
+        Returns VcfRowGenotypes
+        """
+        if len(vcf_fields) != self.num_columns:
+            raise Exception("Wrong number of columns")
+
+        num_samples = len(self.column_indices)
+        gt_alleles = [None] * num_samples
+        gq = [None] * num_samples
+        dp = [None] * num_samples
+        ad = [None] * num_samples
+        pl = [None] * num_samples
+
+        gq_pos, dp_pos, ad_pos, pl_pos = self._get_format_layout(vcf_fields[8])
+        if not genotype_meta:
+            gq_pos = dp_pos = ad_pos = pl_pos = None
+
+        for i, col_index in enumerate(self.column_indices):
+            geno_str = vcf_fields[col_index]
+            geno_fields = geno_str.split(':')
+            try:
+                gt_alleles[i] = _parse_gt_alleles(geno_fields[0])
+            except ValueError:
+                sys.stdout.write("Could not parse genotype from string: %s with format: %s" % (geno_str, vcf_fields[8]))
+                raise
+
+            # accommodate the fact that VCF can skip trailing genotype fields
+            num_fields = len(geno_fields)
+            if gq_pos is not None and gq_pos < num_fields:
+                gq[i] = _parse_gq(geno_fields[gq_pos])
+            if dp_pos is not None and dp_pos < num_fields:
+                dp[i] = geno_fields[dp_pos]
+            if ad_pos is not None and ad_pos < num_fields:
+                ad[i] = geno_fields[ad_pos]
+            if pl_pos is not None and pl_pos < num_fields:
+                pl[i] = geno_fields[pl_pos]
+
+        return VcfRowGenotypes(
+            self.indiv_ids, [vcf_fields[3]] + vcf_fields[4].split(','), vcf_fields[6].lower(), gt_alleles, gq, dp, ad, pl,
+        )
+
+
+class VcfRowGenotypes(object):
+    """
+    The genotypes of the included samples in a single VCF row, shared by all of its alt alleles
+
+    The called allele positions of each sample are stored as the allele1 and allele2 arrays, with NO_CALL for missing
+    alleles. The GQ, DP, AD and PL values are kept as parsed from the VCF, and are available as arrays through
+    gq_values, dp_values and ad_values
+    """
+
+    def __init__(self, indiv_ids, alleles, vcf_filter, gt_alleles, gq, dp, ad, pl):
+        self.indiv_ids = indiv_ids
+        self.alleles = alleles
+        self.vcf_filter = vcf_filter
+        # Genotypes are built from the python values, as indexing numpy arrays one sample at a time is slow
+        self.gt_alleles = gt_alleles
+        gt_array = np.array(gt_alleles, dtype=np.int16).reshape(len(gt_alleles), 2)
+        self.allele1 = gt_array[:, 0]
+        self.allele2 = gt_array[:, 1]
+        self.gq = gq
+        self.dp = dp
+        self.ad = ad
+        self.pl = pl
+        self._indiv_indices = None
+
+    def num_alt(self, alt_allele_pos):
+        """Array of the number of copies of the given alt allele in each sample, or NO_CALL"""
+        allele_position = alt_allele_pos + 1
+        num_alt = (self.allele1 == allele_position).astype(np.int8) + (self.allele2 == allele_position)
+        num_alt[(self.allele1 == NO_CALL) | (self.allele2 == NO_CALL)] = NO_CALL
+        return num_alt
+
+    def has_alt(self, alt_allele_pos):
+        return bool((self.num_alt(alt_allele_pos) > 0).any())
+
+    @property
+    def gq_values(self):
+        return np.array([np.nan if gq is None else gq for gq in self.gq], dtype=np.float32)
+
+    @property
+    def dp_values(self):
+        return np.array([int(dp) if dp and dp.isdigit() else NO_CALL for dp in self.dp], dtype=np.int32)
+
+    @property
+    def ad_values(self):
+        """2D array of read depths for each sample and allele, or NO_CALL if missing"""
+        ad_values = np.full((len(self.ad), len(self.alleles)), NO_CALL, dtype=np.int32)
+        for i, ad in enumerate(self.ad):
+            if ad and ad != '.':
+                reads = [int(reads) for reads in ad.split(',')[:len(self.alleles)] if reads != '.']
+                ad_values[i, :len(reads)] = reads
+        return ad_values
+
+    def get_genotype(self, indiv_id, alt_allele_pos):
+        if self._indiv_indices is None:
+            self._indiv_indices = {indiv_id: i for i, indiv_id in enumerate(self.indiv_ids)}
+        i = self._indiv_indices.get(indiv_id)
+        if i is None:
+            return None
+        return self._get_genotype(i, alt_allele_pos)
+
+    def get_genotypes(self, alt_allele_pos):
+        return {indiv_id: self._get_genotype(i, alt_allele_pos) for i, indiv_id in enumerate(self.indiv_ids)}
+
+    def _get_genotype(self, i, alt_allele_pos):
+        a1, a2 = self.gt_alleles[i]
+        if a1 == NO_CALL or a2 == NO_CALL:
+            num_alt = None
+            alleles = []
+        else:
+            num_alt = int(a1 == alt_allele_pos + 1) + int(a2 == alt_allele_pos + 1)
+            if a1 < len(self.alleles) and a2 < len(self.alleles):
+                alleles = [self.alleles[a1], self.alleles[a2]]
+            else:
+                alleles = []
+                sys.stdout.write("WARNING: Could not parse genotype with alleles: %s/%s. Alleles: %s" % (a1, a2, self.alleles))
+
+        ad = self.ad[i]
+        return Genotype(
+            alleles=alleles,
+            gq=self.gq[i],
+            num_alt=num_alt,
+            filter=self.vcf_filter,
+            ab=_get_allele_balance_from_ad(ad, alt_allele_pos),
+            extras={'dp': self.dp[i], 'pl': self.pl[i], 'ad': ad},
+        )
+
+
+class VcfRowVariant(Variant):
+    """
+    A Variant whose genotypes are built from the decoded VCF row the first time they are used
+    """
+
+    def __init__(self, xpos, ref, alt):
+        Variant.__init__(self, xpos, ref, alt)
+        del self.genotypes
+        self.row_genotypes = None
+
+    def set_row_genotypes(self, row_genotypes):
+        self.row_genotypes = row_genotypes
+
+    def __getattr__(self, name):
+        if name == 'genotypes':
+            row_genotypes = self.__dict__.get('row_genotypes')
+            self.genotypes = row_genotypes.get_genotypes(self.extras['alt_allele_pos']) if row_genotypes else {}
+            return self.genotypes
+        raise AttributeError(name)
+
+    def get_genotype(self, indiv_id):
+        # a single genotype is built without building the genotypes of all the other samples in the row
+        if 'genotypes' in self.__dict__ or not self.row_genotypes:
+            return Variant.get_genotype(self, indiv_id)
+        return self.row_genotypes.get_genotype(indiv_id, self.extras['alt_allele_pos'])
+
+
 # TODO: remove vcf_row_info
 def iterate_vcf(
         vcf_file,
@@ -391,7 +616,8 @@ def iterate_vcf(
         header_info=None,
         vcf_row_info=False,
         indiv_id_list=None,
-        vcf_id_map=None
+        vcf_id_map=None,
+        columnar_genotypes=True,
 ):
     """
     Get the variants in a VCF file
@@ -403,6 +629,8 @@ def iterate_vcf(
         genotype_meta (bool): Should genotype meta info be read? All genotype meta is None if False
         vcf_row_info(bool): Include information about the underlying VCF row in variant.meta['vcf_row_info']
         indiv_id_list(list): Only get genotypes for these individuals (helps w performance)
+        columnar_genotypes(bool): Decode the genotypes of each row once, and only build the Genotypes of a variant
+            when they are used. If False, the Genotypes of every sample are parsed separately for each alt allele
 
     Returns:
         Iterator of Variants
@@ -417,15 +645,20 @@ def iterate_vcf(
     pyvcf_meta_parser = pyvcf.parser._vcf_metadata_parser()
 
     vcf_headers = None
+    sample_columns = None
     if header_info is None:
         header_info = {}
 
+    variant_class = VcfRowVariant if genotypes and columnar_genotypes else Variant
+
     for i, _line in enumerate(vcf_file):
         line = _line.strip('\n')
         fields = line.split('\t')
 
         if line.startswith('#CHROM'):
             vcf_headers = get_vcf_headers(line)
+            if genotypes and columnar_genotypes:
+                sample_columns = VcfSampleColumns(vcf_headers, indivs_to_include=indivs_to_include, vcf_id_map=vcf_id_map)
 
         if line.startswith('##INFO'):
             k, v = pyvcf_meta_parser.read_info(_line)
@@ -435,9 +668,11 @@ def iterate_vcf(
             continue
         
         try:
-            variants = get_variants_from_vcf_fields(fields)
+            variants = get_variants_from_vcf_fields(fields, variant_class=variant_class)
         except Exception, e:
             raise Exception(str(e) + " on row %s: %s" % (i, _line))
+
+        row_genotypes = sample_columns.parse_row(fields, genotype_meta=genotype_meta) if sample_columns and variants else None
         for j, variant in enumerate(variants):
 
             # this is a temporary hack because mongo keys can't be big
@@ -453,7 +688,13 @@ def iterate_vcf(
                 }
                 variant.extras['vcf_row_info'] = d
 
-            if genotypes:
+            if row_genotypes:
+                if not row_genotypes.has_alt(variant.extras['alt_allele_pos']):
+                    # all of genotypes are hom-ref or not called
+                    continue
+                variant.set_row_genotypes(row_genotypes)
+
+            elif genotypes:
                 set_genotypes_from_vcf_fields(
                     fields,
                     variant,
@@ -484,7 +725,7 @@ def write_sites_vcf(f, sites_list):
     f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
     for site in sites_list:
         chrom, pos = genomeloc.get_chr_pos(site[0])
-        fields = [chrom[3:], str(pos), '.', site[1], site[2], '.', '.', '.']
+        fields = [chrom.replace('chr', ''), str(pos), '.', site[1], site[2], '.', '.', '.']
         f.write('\t'.join(fields) + '\n')
     return True
 
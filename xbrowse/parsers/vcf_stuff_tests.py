@@ -0,0 +1,78 @@
+import numpy as np
+from django.test import TestCase
+
+from xbrowse.parsers import vcf_stuff
+
+VCF_LINES = [
+    '##fileformat=VCFv4.1\n',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA19675.1\tNA19678\tNA19679\n',
+    '1\t1000\trs1\tC\tT\t100\tPASS\tAC=1\tGT:AD:DP:GQ:PL\t0/1:10,5:15:99:100,0,200\t0/0:20,0:20:60:0,60,900\t./.\n',
+    '1\t2000\t.\tCA\tC,CAA\t100\tVQSRTrancheSNP\tAC=1,2\tGT:AD:DP:GQ\t1/2:3,4,5:12:30\t0/2:8,8\t0/0:.:.:.\n',
+    '1\t3000\t.\tG\tA\t100\tPASS\tAC=0\tGT:GQ\t0/0:99\t0/0:99\t./.\n',
+]
+
+
+class VcfStuffTest(TestCase):
+
+    def test_iterate_vcf_columnar_genotypes(self):
+        legacy_variants = list(vcf_stuff.iterate_vcf(VCF_LINES, genotypes=True, columnar_genotypes=False))
+        variants = list(vcf_stuff.iterate_vcf(VCF_LINES, genotypes=True))
+
+        self.assertListEqual(
+            [variant.unique_tuple() for variant in variants],
+            [(1000001000, 'C', 'T'), (1000002000, 'CA', 'C'), (1000002000, 'C', 'CA')],
+        )
+        self.assertListEqual([variant.toJSON() for variant in variants], [variant.toJSON() for variant in legacy_variants])
+
+        genotype = variants[2].get_genotype('NA19675_1')
+        self.assertEqual(genotype.num_alt, 1)
+        self.assertListEqual(genotype.alleles, ['C', 'CAA'])
+        self.assertEqual(genotype.gq, 30.0)
+        self.assertEqual(genotype.filter, 'vqsrtranchesnp')
+        self.assertAlmostEqual(genotype.ab, 5 / 8.0)
+        self.assertEqual(variants[2].get_genotype('NA19679').num_alt, 0)
+        self.assertIsNone(variants[0].get_genotype('NA19679').num_alt)
+
+        variant = variants[1].make_copy(restrict_to_genotypes=['NA19675_1', 'NA19678'])
+        self.assertDictEqual(variant.genotypes, {
+            'NA19675_1': legacy_variants[1].genotypes['NA19675_1'],
+            'NA19678': legacy_variants[1].genotypes['NA19678'],
+        })
+
+    def test_iterate_vcf_columnar_genotypes_subset(self):
+        variants = list(vcf_stuff.iterate_vcf(
+            VCF_LINES, genotypes=True, indiv_id_list=['I1', 'NA19679'], vcf_id_map={'NA19678': 'I1'}))
+        self.assertListEqual([variant.unique_tuple() for variant in variants], [(1000002000, 'C', 'CA')])
+        self.assertSetEqual(set(variants[0].genotypes.keys()), {'I1', 'NA19679'})
+        genotype = variants[0].genotypes['I1']
+        self.assertEqual(genotype.num_alt, 1)
+        self.assertIsNone(genotype.gq)
+        self.assertEqual(genotype.ab, 0.5)
+        self.assertDictEqual(genotype.extras, {'ad': '8,8', 'dp': None, 'pl': None})
+
+        variants = list(vcf_stuff.iterate_vcf(
+            VCF_LINES, genotypes=True, indiv_id_list=['I1'], vcf_id_map={'NA19678': 'I1'}, genotype_meta=False))
+        genotype = variants[0].genotypes['I1']
+        self.assertEqual(genotype.num_alt, 1)
+        self.assertIsNone(genotype.ab)
+        self.assertDictEqual(genotype.extras, {'ad': None, 'dp': None, 'pl': None})
+
+    def test_parse_row(self):
+        sample_columns = vcf_stuff.VcfSampleColumns(vcf_stuff.get_vcf_headers(VCF_LINES[1]))
+        self.assertListEqual(sample_columns.indiv_ids, ['NA19675_1', 'NA19678', 'NA19679'])
+
+        row_genotypes = sample_columns.parse_row(VCF_LINES[3].strip('\n').split('\t'))
+        self.assertListEqual(list(row_genotypes.num_alt(0)), [1, 0, 0])
+        self.assertListEqual(list(row_genotypes.num_alt(1)), [1, 1, 0])
+        self.assertTrue(row_genotypes.has_alt(1))
+        self.assertListEqual(list(row_genotypes.dp_values), [12, vcf_stuff.NO_CALL, vcf_stuff.NO_CALL])
+        self.assertTrue(np.isnan(row_genotypes.gq_values[1]))
+        self.assertListEqual(row_genotypes.ad_values.tolist(), [[3, 4, 5], [8, 8, -1], [-1, -1, -1]])
+
+        # GQ values outside the common range are parsed without growing the cache
+        num_cached_gq = len(vcf_stuff._GQ_CACHE)
+        row_genotypes = sample_columns.parse_row(
+            '1\t4000\t.\tG\tA\t100\tPASS\t.\tGT:GQ\t0/1:99\t0/1:45.5\t0/1:x'.split('\t'))
+        self.assertListEqual(row_genotypes.gq_values[:2].tolist(), [99.0, 45.5])
+        self.assertTrue(np.isnan(row_genotypes.gq_values[2]))
+        self.assertEqual(len(vcf_stuff._GQ_CACHE), num_cached_gq)
@@ -40,6 +40,7 @@ def get_variants_from_variant_tuples(project, variant_tuples, user=None):
         variant_tuples_by_family_id[family_id].append((xpos, ref, alt))
 
     variants = []
+    created_variants = []
     for family_id, variant_tuples in variant_tuples_by_family_id.items():
         variants_for_family = datastore.get_multiple_variants(
             project.project_id,
@@ -50,13 +51,15 @@ def get_variants_from_variant_tuples(project, variant_tuples, user=None):
         for (xpos, ref, alt), variant in zip(variant_tuples, variants_for_family):
             if not variant:
                 variant = Variant(xpos, ref, alt)
-                get_annotator().annotate_variant(variant, population_slugs)
                 variant.set_extra('created_variant', True)
+                created_variants.append(variant)
 
             variant.set_extra('family_id', family_id)
             variant.set_extra('project_id', project.project_id)
             variants.append(variant)
 
+    get_annotator().annotate_variants(created_variants, population_slugs)
+
     return variants
 
 
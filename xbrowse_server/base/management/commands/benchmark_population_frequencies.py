@@ -0,0 +1,94 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from pymongo import MongoClient
+
+from xbrowse.annotation.population_frequency_store import PopulationFrequencyStore
+
+POPULATION_SLUG = 'benchmark'
+
+
+def _write_synthetic_sites_vcf(vcf_file, num_rows, seed=0):
+    """Writes a sites VCF with random allele frequencies, with some multi-allelic rows"""
+    rand = random.Random(seed)
+    vcf_file.write('##fileformat=VCFv4.1\n')
+    vcf_file.write('##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">\n')
+    vcf_file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+    pos = 10000
+    for _ in range(num_rows):
+        pos += rand.randint(1, 100)
+        if rand.random() < 0.2:
+            alt, af = 'T,TA', '{:.4f},{:.4f}'.format(rand.random(), rand.random())
+        else:
+            alt, af = 'T', '{:.4f}'.format(rand.random())
+        vcf_file.write('1\t{}\t.\tC\t{}\t100\tPASS\tAF={}\n'.format(pos, alt, af))
+
+
+class Command(BaseCommand):
+    help = 'Compare loading and looking up population frequencies one variant at a time and in bulk, using a ' \
+           'scratch mongo database that is dropped afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='number of rows in the sites VCF')
+        parser.add_argument('--lookups', type=int, default=5000, help='number of variants looked up')
+        parser.add_argument('--db-name', default='xbrowse_benchmark_population_frequencies',
+                            help='name of the scratch mongo database')
+
+    def handle(self, *args, **options):
+        client = MongoClient(settings.MONGO_SERVICE_HOSTNAME, 27017)
+        db = client[options['db_name']]
+        store = PopulationFrequencyStore(get_db=lambda: db, reference_populations=[])
+
+        temp_dir = tempfile.mkdtemp()
+        vcf_path = os.path.join(temp_dir, 'sites.vcf')
+        with open(vcf_path, 'w') as vcf_file:
+            _write_synthetic_sites_vcf(vcf_file, options['rows'])
+        population = {'slug': POPULATION_SLUG, 'file_type': 'sites_vcf', 'file_path': vcf_path}
+
+        try:
+            db.drop_collection('pop_variants')
+            store._ensure_indices()
+            start_time = time.time()
+            num_variants = 0
+            for xpos, ref, alt, freq in store._iterate_population_frequencies(population):
+                db.pop_variants.update(
+                    {'xpos': xpos, 'ref': ref, 'alt': alt}, {'$set': {POPULATION_SLUG: freq}}, upsert=True)
+                num_variants += 1
+            single_load_time = time.time() - start_time
+
+            db.drop_collection('pop_variants')
+            store._ensure_indices()
+            start_time = time.time()
+            store.load_population(population)
+            bulk_load_time = time.time() - start_time
+
+            variant_ts = [(d['xpos'], d['ref'], d['alt']) for d in db.pop_variants.find({}, projection={'_id': False})]
+            variant_ts = random.Random(0).sample(variant_ts, min(options['lookups'], len(variant_ts)))
+            start_time = time.time()
+            single_freqs = {
+                variant_t: db.pop_variants.find_one(
+                    {'xpos': variant_t[0], 'ref': variant_t[1], 'alt': variant_t[2]}, projection={'_id': False})
+                for variant_t in variant_ts
+            }
+            single_lookup_time = time.time() - start_time
+
+            start_time = time.time()
+            bulk_freqs = store.get_frequencies_for_variants(variant_ts)
+            bulk_lookup_time = time.time() - start_time
+            if bulk_freqs != single_freqs:
+                print('WARNING: bulk lookup returned different frequencies from single variant lookups')
+        finally:
+            client.drop_database(options['db_name'])
+            shutil.rmtree(temp_dir)
+
+        print('Load {} variants - single: {:.0f} variants/s, bulk: {:.0f} variants/s ({:.1f}x)'.format(
+            num_variants, num_variants / single_load_time, num_variants / bulk_load_time,
+            single_load_time / bulk_load_time))
+        print('Look up {} variants - single: {:.0f} variants/s, bulk: {:.0f} variants/s ({:.1f}x)'.format(
+            len(variant_ts), len(variant_ts) / single_lookup_time, len(variant_ts) / bulk_lookup_time,
+            single_lookup_time / bulk_lookup_time))
@@ -0,0 +1,82 @@
+import random
+import timeit
+from django.core.management.base import BaseCommand
+
+from xbrowse.parsers import vcf_stuff
+
+FORMAT = 'GT:AD:DP:GQ:PL'
+GENOTYPES = [('0/0', 0.8), ('0/1', 0.1), ('1/1', 0.04), ('./.', 0.04), ('0/2', 0.01), ('1/2', 0.01)]
+
+
+def _synthetic_vcf_lines(num_samples, num_rows, seed=0):
+    """Yields the lines of a multi-sample VCF with random genotypes, with some multi-allelic rows"""
+    rand = random.Random(seed)
+    genotype_strs = []
+    for genotype_str, frequency in GENOTYPES:
+        genotype_strs += [genotype_str] * int(frequency * 100)
+    biallelic_genotype_strs = [genotype_str for genotype_str in genotype_strs if '2' not in genotype_str]
+
+    yield '##fileformat=VCFv4.1\n'
+    yield '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count">\n'
+    yield '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n'.format(
+        '\t'.join('SAMPLE-{}'.format(i) for i in range(num_samples)))
+
+    pos = 10000
+    for _ in range(num_rows):
+        pos += rand.randint(1, 1000)
+        is_multiallelic = rand.random() < 0.2
+        alt = 'T,TA' if is_multiallelic else 'T'
+        sample_fields = []
+        for _ in range(num_samples):
+            genotype_str = rand.choice(genotype_strs if is_multiallelic else biallelic_genotype_strs)
+            if genotype_str == './.':
+                sample_fields.append(genotype_str)
+            else:
+                ref_reads, alt_reads = rand.randint(0, 30), rand.randint(0, 30)
+                sample_fields.append('{}:{},{}:{}:{}:{},{},{}'.format(
+                    genotype_str, ref_reads, alt_reads, ref_reads + alt_reads, rand.randint(0, 99),
+                    rand.randint(0, 500), rand.randint(0, 500), rand.randint(0, 500)))
+        yield '1\t{}\t.\tC\t{}\t100\tPASS\tAC=1\t{}\t{}\n'.format(pos, alt, FORMAT, '\t'.join(sample_fields))
+
+
+class Command(BaseCommand):
+    help = 'Compare the cost of parsing a synthetic multi-sample VCF with the legacy and columnar genotype parsers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000, help='number of samples in the VCF')
+        parser.add_argument('--rows', type=int, default=200, help='number of rows in the VCF')
+        parser.add_argument('--family-size', type=int, default=3,
+                            help='number of samples per family whose genotypes are copied from each variant')
+        parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+
+    def handle(self, *args, **options):
+        vcf_lines = list(_synthetic_vcf_lines(options['samples'], options['rows']))
+        indiv_ids = vcf_stuff.get_ids_from_vcf(vcf_lines)
+        families = [indiv_ids[i:i + options['family_size']] for i in range(0, len(indiv_ids), options['family_size'])]
+
+        def _parse(columnar_genotypes):
+            return list(vcf_stuff.iterate_vcf(vcf_lines, genotypes=True, columnar_genotypes=columnar_genotypes))
+
+        def _parse_family_variants(columnar_genotypes):
+            # iterate the variants the way the datastore loads them: one copy of each variant per family
+            variants = _parse(columnar_genotypes)
+            for variant in variants:
+                for family in families:
+                    variant.make_copy(restrict_to_genotypes=family).toJSON()
+            return variants
+
+        legacy_variants = _parse(columnar_genotypes=False)
+        columnar_variants = _parse(columnar_genotypes=True)
+        mismatches = sum(1 for legacy, columnar in zip(legacy_variants, columnar_variants)
+                         if legacy.toJSON() != columnar.toJSON())
+        if mismatches or len(legacy_variants) != len(columnar_variants):
+            print('WARNING: {} of {} variants differ from the legacy parser'.format(mismatches, len(legacy_variants)))
+
+        num_genotypes = options['samples'] * options['rows']
+        print('Parsed {} variants with {} samples'.format(len(legacy_variants), options['samples']))
+        for name, parse_func in [('Parse', _parse), ('Parse and copy per family', _parse_family_variants)]:
+            legacy_time = min(timeit.repeat(lambda: parse_func(False), number=1, repeat=options['repeat']))
+            columnar_time = min(timeit.repeat(lambda: parse_func(True), number=1, repeat=options['repeat']))
+            print('{} - legacy: {:.2f} us per genotype, columnar: {:.2f} us per genotype ({:.1f}x)'.format(
+                name, legacy_time / num_genotypes * 10**6, columnar_time / num_genotypes * 10**6,
+                legacy_time / columnar_time))